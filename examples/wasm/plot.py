@@ -1,9 +1,10 @@
 import numpy
 import math
-import matplotlib
-matplotlib.use('Agg')
-from matplotlib.pyplot import *
-from matplotlib.contour import *
+import os
+import sys
+# Only numpy is needed, the contour lines are computed by src/unused/server/JXGContour.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src', 'unused', 'server'))
+from JXGContour import zeroContours
 #import js
 
 xs = -5.0
@@ -16,12 +17,9 @@ x, y = numpy.meshgrid(numpy.linspace(xs, xe, 200), numpy.linspace(ys, ye, 200))
 
 r = math.sqrt(2**2+2**2)
 z = eval(f"x**2 + y**2 - {r}")
-C = contour(x, y, z, [0])
 
 data = ""
-for i in range(0, len(C.collections[0].get_paths())):
-    pa = C.collections[0].get_paths()[i].to_polygons()[0]
-    
+for pa in zeroContours(x, y, z):
 
     for j in range(0,len(pa)):
         data += f"{pa[j][0]},{pa[j][1]};"
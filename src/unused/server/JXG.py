@@ -1,12 +1,85 @@
 import json
 import inspect
+import struct
+
+# Little-endian dtypes of typed array fields, see Request
+TYPED_DTYPES = {                                                \
+                 'float64' : '<f8',                             \
+                 'float32' : '<f4',                             \
+                 'int32'   : '<i4',                             \
+                 'int16'   : '<i2'                              \
+               }
+
+# Magic bytes of a response holding typed arrays, see Response.dump()
+TYPED_MAGIC = b'JXGB'
+
+def _typedName(array):
+    # Maps the dtype of a numpy array to one of the TYPED_DTYPES
+    kind = array.dtype.kind
+    size = array.dtype.itemsize
+    if kind == 'f':
+        return 'float32' if size == 4 else 'float64'
+    if kind == 'b' or (kind == 'i' and size <= 2) or (kind == 'u' and size == 1):
+        return 'int16'
+    if (kind == 'i' and size == 4) or (kind == 'u' and size == 2):
+        return 'int32'
+    if kind in 'iu':
+        return 'float64'
+    raise TypeError("numpy arrays of type " + str(array.dtype) + " can't be sent to the client")
+
+class _TypedBlocks(object):
+    # json.dumps() hook collecting numpy arrays as little-endian blocks
+
+    def __init__(self):
+        self.blocks = []
+        self.length = 0
+
+    def default(self, obj):
+        if hasattr(obj, 'tolist') and hasattr(obj, 'dtype'):
+            if obj.ndim == 0:
+                return obj.item()
+
+            name = _typedName(obj)
+            import numpy
+            block = numpy.ascontiguousarray(obj, dtype=TYPED_DTYPES[name])
+            ref = {'__jxgtyped__': name, 'offset': self.length, 'shape': list(obj.shape)}
+            self.blocks.append(memoryview(block).cast('B'))
+            self.length += block.nbytes
+            pad = -self.length % 8
+            if pad > 0:
+                self.blocks.append(b'\0' * pad)
+                self.length += pad
+            return ref
+        raise TypeError("Object of type " + type(obj).__name__ + " is not JSON serializable")
+
+def _plainDefault(obj):
+    # json.dumps() hook for clients not accepting typed arrays
+    if hasattr(obj, 'tolist') and hasattr(obj, 'dtype'):
+        if obj.dtype.kind == 'f' and obj.ndim > 0:
+            # NaN isn't valid JSON, gaps in curves are sent as 'null' like
+            # the plugins always did
+            import numpy
+            gaps = numpy.isnan(obj)
+            if gaps.any():
+                obj = obj.astype(object)
+                obj[gaps] = 'null'
+        return obj.tolist()
+    raise TypeError("Object of type " + type(obj).__name__ + " is not JSON serializable")
 
 class Request(object):
 
-    def __init__(self, action, id, data):
+    def __init__(self, action, id, data, binary=b'', values=None):
         self._action = action
         self._id = id
         self._data = data
+        self._binary = binary
+        self._values = values
+
+    def getValues(self):
+        # The payload is decoded only once per request
+        if self._values is None:
+            self._values = json.loads(self._data, object_hook=self._decodeTyped)
+        return self._values
 
     def getValue(self, item, default = 'empty'):
         if item == 'action':
@@ -14,16 +87,39 @@ class Request(object):
         elif item == 'id':
             return self._id
         else:
-            return json.loads(self._data)[item]
+            return self.getValues()[item]
 
     def getList(self, item):
         return self._data.getlist(item)
 
+    def _decodeTyped(self, obj):
+        # Typed array fields are sent as
+        #   {"__jxgtyped__": "float64", "offset": 0, "shape": [n]}
+        # pointing into the binary block of the request. They are returned
+        # as read-only numpy arrays sharing the memory of that block.
+        if '__jxgtyped__' not in obj:
+            return obj
+
+        dtype = TYPED_DTYPES.get(obj['__jxgtyped__'])
+        if dtype is None:
+            raise ValueError("unknown typed array type \"" + str(obj['__jxgtyped__']) + "\"")
+
+        import numpy
+        shape = tuple(obj['shape'])
+        count = 1
+        for n in shape:
+            count *= n
+        return numpy.frombuffer(self._binary, dtype=dtype, count=count, offset=obj['offset']).reshape(shape)
+
 
 class Response(object):
 
-    def __init__(self, _id):
+    def __init__(self, _id, typed=False, streaming=False):
         self._id = _id
+        self._typed = typed
+        # The client reads streamed frames, see addStream()
+        self._streaming = streaming
+        self._stream = None
         self._type = 'response'
         self._data = {}
         self._fields = []
@@ -42,13 +138,39 @@ class Response(object):
                                 'message' : self._message       \
                               })
         else:
-            return json.dumps({                                 \
-                                'type'    : 'response',         \
-                                'id'      : self._id,           \
-                                'fields'  : self._fields,       \
-                                'handler' : self._handler,      \
-                                'data'    : self._data          \
-                              })
+            ret = {                                             \
+                    'type'    : 'response',                     \
+                    'id'      : self._id,                       \
+                    'fields'  : self._fields,                   \
+                    'handler' : self._handler,                  \
+                    'data'    : self._data                      \
+                  }
+            return self._encode(ret)
+
+    def dumpFrame(self, value):
+        # One of the frames of the stream, encoded like the response
+        return self._encode({                                   \
+                              'type'    : 'frame',              \
+                              'id'      : self._id,             \
+                              'name'    : self._stream[0],      \
+                              'data'    : value                 \
+                            })
+
+    def _encode(self, ret):
+        if not self._typed:
+            return json.dumps(ret, default=_plainDefault)
+
+        # numpy arrays are sent as binary blocks, the response is
+        #   'JXGB', uint32 length of the JSON header, JSON header,
+        #   padding to 8 bytes, blocks (each padded to 8 bytes)
+        typed = _TypedBlocks()
+        header = json.dumps(ret, default=typed.default)
+        if len(typed.blocks) == 0:
+            return header
+
+        header = header.encode('utf-8')
+        pad = b'\0' * (-(len(header) + 8) % 8)
+        return b''.join([TYPED_MAGIC, struct.pack('<I', len(header)), header, pad] + typed.blocks)
 
     def addField(self, namespace, name, value):
         self._fields.append({                                   \
@@ -58,11 +180,22 @@ class Response(object):
                             })
 
     def addData(self, name, value):
+        # value may contain numpy arrays, clients accepting typed
+        # arrays get them as binary blocks, the others as lists
         self._data[name] = value
 
+    def addStream(self, name, frames):
+        # frames is an iterable computing the values one by one. Clients
+        # accepting streams get every value as a message of its own as soon
+        # as it's computed, all others get the list of values in data name.
+        if self._streaming:
+            self._stream = (name, frames)
+        else:
+            self.addData(name, list(frames))
+
     def addHandler(self, function, callback):
         params = [];
-        args = inspect.getargspec(function);
+        args = inspect.getfullargspec(function);
         for i in range(0, len(args.args)):
             if (args.args[i] != 'resp') and (args.args[i] != 'self'):
                 params.append(args.args[i])
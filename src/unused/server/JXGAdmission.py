@@ -0,0 +1,107 @@
+import contextlib
+import threading
+import time
+
+from JXGMetrics import metrics, HELP
+
+HELP['jxg_rejected_total'] = 'Number of calls refused because their module was busy'
+HELP['jxg_queue_depth'] = 'Number of calls waiting for a free slot of their module'
+HELP['jxg_running'] = 'Number of calls running per module'
+
+
+class Busy(Exception): pass
+
+
+class Limiter(object):
+    '''
+    Admission control of the handlers of one module. At most concurrency
+    calls run at once, up to depth more wait for a free slot, but not
+    longer than timeout seconds. Calls beyond that are refused at once
+    instead of piling up. concurrency None doesn't limit anything.
+    '''
+
+    def __init__(self, module, concurrency=None, depth=0, timeout=10.0):
+        self.module = module
+        self.concurrency = concurrency
+        self.depth = depth
+        self.timeout = timeout
+        self.running = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        # Takes a slot, waits for one or raises Busy
+        if self.concurrency is None:
+            return
+
+        with self._cond:
+            if self.running >= self.concurrency:
+                if self.waiting >= self.depth:
+                    metrics.inc('jxg_rejected_total', module=self.module, reason='queue')
+                    raise Busy("busy, retry: module \"" + self.module + "\" is running too many requests")
+
+                deadline = time.monotonic() + self.timeout
+                self.waiting += 1
+                try:
+                    while self.running >= self.concurrency:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            metrics.inc('jxg_rejected_total', module=self.module, reason='deadline')
+                            raise Busy("busy, retry: module \"" + self.module + "\" had no free slot within %s seconds" % self.timeout)
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.running += 1
+
+    def release(self):
+        if self.concurrency is None:
+            return
+
+        with self._cond:
+            self.running -= 1
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def admit(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def hold(self, frames):
+        '''
+        Passes on a slot taken by acquire() to the iterable frames, it's
+        released when they are exhausted, fail or are given up.
+        '''
+        return _Held(self, frames)
+
+
+class _Held(object):
+
+    def __init__(self, limiter, frames):
+        self.limiter = limiter
+        self.frames = iter(frames)
+        self._held = True
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.frames)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        with self._lock:
+            held, self._held = self._held, False
+        if held:
+            self.limiter.release()
+            if hasattr(self.frames, 'close'):
+                self.frames.close()
+
+    def __del__(self):
+        self.close()
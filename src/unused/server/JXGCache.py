@@ -0,0 +1,240 @@
+import collections
+import hashlib
+import os
+import pickle
+import struct
+import threading
+import time
+
+
+def _feed(h, obj):
+    # Type tagged serialization, equal values give equal byte streams
+    if obj is None:
+        h.update(b'N')
+    elif obj is True or obj is False:
+        h.update(b'T' if obj else b'F')
+    elif isinstance(obj, int):
+        h.update(b'i' + str(obj).encode('ascii') + b';')
+    elif isinstance(obj, float):
+        h.update(b'f' + struct.pack('<d', obj))
+    elif isinstance(obj, str):
+        s = obj.encode('utf-8')
+        h.update(b's' + str(len(s)).encode('ascii') + b':' + s)
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        h.update(b'b' + str(len(obj)).encode('ascii') + b':')
+        h.update(obj)
+    elif isinstance(obj, (list, tuple)):
+        h.update(b'l' + str(len(obj)).encode('ascii') + b':')
+        for item in obj:
+            _feed(h, item)
+    elif isinstance(obj, dict):
+        h.update(b'd' + str(len(obj)).encode('ascii') + b':')
+        for k in sorted(obj):
+            _feed(h, k)
+            _feed(h, obj[k])
+    elif hasattr(obj, 'dtype') and hasattr(obj, 'tobytes'):
+        import numpy
+        a = numpy.ascontiguousarray(obj)
+        h.update(b'a' + a.dtype.str.encode('ascii') + str(a.shape).encode('ascii') + b':')
+        h.update(memoryview(a).cast('B'))
+    else:
+        raise TypeError("can't compute a cache key for " + type(obj).__name__)
+
+def canonicalKey(*parts):
+    '''
+    Hash of parts, independent of the order of dict keys and equal for
+    numpy arrays and lists holding the same numbers of the same type.
+    '''
+    h = hashlib.sha256()
+    _feed(h, parts)
+    return h.hexdigest()
+
+
+class LRUCache(object):
+    '''
+    In-memory cache bounded by the total size of its values,
+    the least recently used entries are evicted first.
+    '''
+
+    def __init__(self, maxBytes, sizeof=len):
+        self.maxBytes = maxBytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, size, expires = entry
+            if expires is not None and expires < time.time():
+                del self._entries[key]
+                self.bytes -= size
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, ttl=None):
+        size = self.sizeof(value)
+        if size > self.maxBytes:
+            return
+        expires = time.time() + ttl if ttl is not None else None
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (value, size, expires)
+            self.bytes += size
+            while self.bytes > self.maxBytes:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+
+    def remove(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry[1]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCache(object):
+    '''
+    Cache storing pickled values as files in directory, bounded by the
+    total file size. The access time is tracked by the file's mtime.
+    '''
+
+    def __init__(self, directory, maxBytes):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.bytes = 0
+        self._index = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith('.tmp'):
+                os.remove(path)
+                continue
+            st = os.stat(path)
+            self._index[name] = (st.st_size, st.st_mtime)
+            self.bytes += st.st_size
+
+    def get(self, key):
+        entry = self.load(key)
+        return entry[0] if entry is not None else None
+
+    def load(self, key):
+        # Returns (value, time of expiry or None) or None
+        path = os.path.join(self.directory, key)
+        try:
+            with open(path, 'rb') as f:
+                expires, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+        if expires is not None and expires < time.time():
+            self.remove(key)
+            return None
+
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        with self._lock:
+            if key in self._index:
+                self._index[key] = (self._index[key][0], now)
+        return value, expires
+
+    def put(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl is not None else None
+        data = pickle.dumps((expires, value), pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.maxBytes:
+            return
+
+        path = os.path.join(self.directory, key)
+        tmp = path + '.%d.%d.tmp' % (os.getpid(), threading.get_ident())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        with self._lock:
+            old = self._index.get(key)
+            if old is not None:
+                self.bytes -= old[0]
+            self._index[key] = (len(data), time.time())
+            self.bytes += len(data)
+            if self.bytes > self.maxBytes:
+                self._evict()
+
+    def remove(self, key):
+        with self._lock:
+            entry = self._index.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry[0]
+        try:
+            os.remove(os.path.join(self.directory, key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        for key in sorted(self._index, key=lambda k: self._index[k][1]):
+            if self.bytes <= self.maxBytes:
+                break
+            self.bytes -= self._index.pop(key)[0]
+            try:
+                os.remove(os.path.join(self.directory, key))
+            except OSError:
+                pass
+
+
+class Cache(object):
+    '''
+    Two level cache, an LRUCache in memory in front of an optional
+    DiskCache. Counts hits and misses.
+    '''
+
+    def __init__(self, maxBytes, directory=None, diskBytes=0, sizeof=len):
+        self.memory = LRUCache(maxBytes, sizeof)
+        self.disk = DiskCache(directory, diskBytes) if directory else None
+        self.hits = 0
+        self.diskHits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        if self.disk is not None:
+            entry = self.disk.load(key)
+            if entry is not None:
+                value, expires = entry
+                self.hits += 1
+                self.diskHits += 1
+                self.memory.put(key, value, expires - time.time() if expires is not None else None)
+                return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key, value, ttl=None):
+        self.memory.put(key, value, ttl)
+        if self.disk is not None:
+            self.disk.put(key, value, ttl)
+
+    def stats(self):
+        return {                                                \
+                 'hits'     : self.hits,                        \
+                 'diskHits' : self.diskHits,                    \
+                 'misses'   : self.misses,                      \
+                 'entries'  : len(self.memory),                 \
+                 'bytes'    : self.memory.bytes                 \
+               }
@@ -0,0 +1,198 @@
+import itertools
+import math
+import os
+import queue
+import re
+import selectors
+import subprocess
+import time
+
+from JXGCache import canonicalKey
+from JXGMetrics import metrics, HELP
+import JXGPolynomial
+
+HELP['jxg_cocoa_wait_seconds'] = 'Time spent waiting for an idle CoCoA session'
+HELP['jxg_cocoa_restarts_total'] = 'Number of CoCoA sessions replaced after a timeout, a crash or too many requests'
+
+# Up to this many renamings of the eliminated variables are tried to find
+# the canonical form of a system, and not more than this many terms are
+# renamed in total
+MAX_RENAMINGS = 720
+MAX_RENAMED_TERMS = 50000
+
+# Line printed by the scripts after the results
+END_MARKER = re.compile(rb'resultsend\r?\n')
+
+
+class CoCoAError(Exception): pass
+
+class CoCoATimeout(CoCoAError): pass
+
+
+class Session(object):
+    '''
+    A running CoCoA interpreter. Scripts are written to its stdin, the
+    reply is read up to the line "resultsend" every script has to print
+    last.
+    '''
+
+    def __init__(self, cmd):
+        # stderr is merged, a separate pipe nobody reads could fill up and block CoCoA
+        self.process = subprocess.Popen([cmd], stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.STDOUT, shell=False)
+        self.requests = 0
+
+    def run(self, script, timeout):
+        deadline = time.monotonic() + timeout
+        self.requests += 1
+        try:
+            self.process.stdin.write(script.encode('utf-8') + b'\n')
+            self.process.stdin.flush()
+        except OSError:
+            raise CoCoAError("CoCoA session died")
+
+        fd = self.process.stdout.fileno()
+        out = bytearray()
+        with selectors.DefaultSelector() as sel:
+            sel.register(fd, selectors.EVENT_READ)
+            while END_MARKER.search(out) is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or len(sel.select(remaining)) == 0:
+                    raise CoCoATimeout("CoCoA didn't answer within %s seconds" % timeout)
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    raise CoCoAError("CoCoA session died")
+                out += chunk
+        return out.decode('utf-8', 'replace')
+
+    def close(self):
+        # This is only tested with linux/unix
+        # and works ONLY if the cocoa script cd-ing
+        # to the cocoa dir and starting cocoa executes
+        # it with
+        # $ exec ./cocoa_text
+        self.process.kill()
+        self.process.wait()
+        self.process.stdin.close()
+        self.process.stdout.close()
+
+
+class SessionPool(object):
+    '''
+    Keeps up to size warm CoCoA sessions. A session that timed out or
+    crashed is thrown away, a new one is started on demand. Sessions are
+    also recycled after maxRequests scripts.
+    '''
+
+    def __init__(self, cmd, size=1, maxRequests=500):
+        self.cmd = cmd
+        self.size = size
+        self.maxRequests = maxRequests
+        # Holds the idle sessions and a None for every session not started yet,
+        # warm sessions are put back last and so taken first
+        self._idle = queue.LifoQueue()
+        for i in range(size):
+            self._idle.put(None)
+
+    def run(self, script, timeout):
+        start = time.perf_counter()
+        session = self._idle.get()
+        metrics.observe('jxg_cocoa_wait_seconds', time.perf_counter() - start)
+
+        if session is None:
+            try:
+                session = Session(self.cmd)
+            except OSError as e:
+                self._idle.put(None)
+                raise CoCoAError("can't start CoCoA: " + e.__str__())
+
+        try:
+            output = session.run(script, timeout)
+        except BaseException:
+            self._discard(session)
+            raise
+
+        if session.requests >= self.maxRequests:
+            self._discard(session)
+        else:
+            self._idle.put(session)
+        return output
+
+    def _discard(self, session):
+        metrics.inc('jxg_cocoa_restarts_total')
+        session.close()
+        self._idle.put(None)
+
+    def idle(self):
+        return sum(1 for s in list(self._idle.queue) if s is not None)
+
+    def close(self):
+        sessions = []
+        while len(sessions) < self.size:
+            sessions.append(self._idle.get())
+        for session in sessions:
+            if session is not None:
+                session.close()
+            self._idle.put(None)
+
+
+def polynomials(output):
+    '''
+    Extracts the polynomials printed between "resultsbegin" and
+    "resultsend", None if there are no results.
+    '''
+    if re.search('resultsbegin', output) is None:
+        return None
+    result = re.split('resultsend', re.split('resultsbegin', output)[1])[0]
+    result = re.split('-------------------------------', re.split('-------------------------------', result)[1])[0]
+    result = result.replace("\r", "")
+    return re.split('\n', result)
+
+
+def _signature(polys, name):
+    # Invariant of an eliminated variable under renaming the others
+    return sorted(tuple(sorted(dict(mono).get(name, 0) for mono in p)) for p in polys)
+
+def canonicalSystem(polys, number):
+    '''
+    Canonical form of the system of polynomials polys in which
+    u[1]..u[number] are eliminated. Systems differing in whitespace, order
+    of terms and generators, constant factors of the generators or by a
+    renaming of the eliminated variables get the same form.
+    '''
+    polys = [JXGPolynomial.parse(p) if isinstance(p, str) else p for p in polys]
+    polys = [p for p in polys if len(p) > 0]
+    eliminated = ['u[%d]' % (i + 1) for i in range(int(number))]
+
+    # Variables with different signatures can't be renamed into each other,
+    # only the permutations inside groups of equal signatures are tried.
+    signatures = dict((name, _signature(polys, name)) for name in eliminated)
+    groups = [list(g) for k, g in itertools.groupby(sorted(eliminated, key=lambda n: signatures[n]), key=lambda n: signatures[n])]
+    count = 1
+    for g in groups:
+        count *= math.factorial(len(g))
+    if count > MAX_RENAMINGS or count * sum(map(len, polys)) > MAX_RENAMED_TERMS:
+        groups = [[name] for g in groups for name in g]
+
+    best = None
+    for perm in itertools.product(*[itertools.permutations(g) for g in groups]):
+        order = [name for g in perm for name in g]
+        names = dict((name, eliminated[i]) for i, name in enumerate(order))
+        form = sorted(set(JXGPolynomial.toString(JXGPolynomial.monic(JXGPolynomial.rename(p, names))) for p in polys))
+        if best is None or form < best:
+            best = form
+    return best if best is not None else []
+
+def eliminationKey(polys, number, ordering='', parameters=()):
+    '''
+    Cache key of the elimination of u[1]..u[number] from the comma
+    separated polynomials polys in a ring with the given term ordering and
+    the additional indeterminates parameters. Falls back to the polynomials
+    with whitespace removed if they can't be parsed.
+    '''
+    try:
+        form = canonicalSystem(JXGPolynomial.parseSystem(polys), number)
+    except JXGPolynomial.PolynomialError:
+        form = ''.join(polys.split())
+    if len(parameters) > 0:
+        return canonicalKey('elimination', ordering, number, form, list(parameters))
+    return canonicalKey('elimination', ordering, number, form)
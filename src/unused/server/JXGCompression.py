@@ -0,0 +1,71 @@
+# ZIP compression
+import zlib
+# Base64 en-/decoding
+import base64
+import time
+
+
+class CompressionPolicy(object):
+    '''
+    Decides how a serialized response is sent to the client.
+
+    Clients list what they accept in the form field "accept":
+
+      identity   uncompressed payloads are fine
+      binary     the body may be raw bytes instead of base64 text
+      fast       prefer a fast over a strong compression
+
+    Clients not sending anything (JXG.Server before the accept field
+    existed) always get a base64 encoded zlib stream.
+    '''
+
+    def __init__(self, threshold=1024, levels=None, fast=False, fastLevel=1):
+        # Payloads smaller than threshold bytes are sent uncompressed
+        self.threshold = threshold
+        # List of (max payload size, zlib level), the last entry has no limit
+        self.levels = levels or [(64 * 1024, 9), (1024 * 1024, 6), (None, 1)]
+        # Use fastLevel for every payload
+        self.fast = fast
+        self.fastLevel = fastLevel
+
+    def level(self, size, fast=False):
+        if self.fast or fast:
+            return self.fastLevel
+        for limit, level in self.levels:
+            if limit is None or size <= limit:
+                return level
+        return self.levels[-1][1]
+
+    def encode(self, payload, accept):
+        size = len(payload)
+        headers = {}
+
+        if 'identity' in accept and size < self.threshold:
+            headers['X-JXG-Encoding'] = 'identity'
+            body = payload
+            level = 0
+            duration = 0.0
+        else:
+            level = self.level(size, 'fast' in accept)
+            duration = time.time()
+            body = zlib.compress(payload, level)
+            duration = time.time() - duration
+            # JXG.Util.Unzip only recognizes the header written with level 9.
+            # FLEVEL is informational only, 0x78 0xda is a valid header for
+            # every level.
+            body = b'\x78\xda' + body[2:]
+            headers['X-JXG-Encoding'] = 'zlib'
+
+        headers['X-JXG-Compress-Level'] = str(level)
+        headers['X-JXG-Compress-Time'] = '%.6f' % duration
+        headers['X-JXG-Compress-Ratio'] = '%.4f' % (len(body) / float(size) if size > 0 else 1.0)
+
+        if 'binary' in accept:
+            headers['X-JXG-Transfer'] = 'binary'
+            headers['Content-Type'] = 'application/octet-stream'
+        else:
+            body = base64.b64encode(body)
+            headers['X-JXG-Transfer'] = 'base64'
+            headers['Content-Type'] = 'text/plain'
+
+        return body, headers
@@ -0,0 +1,406 @@
+'''
+Zero level sets of functions sampled on a grid by marching squares.
+
+Only needs numpy, so it can be loaded into Pyodide too (see
+examples/wasm/python.html).
+'''
+
+import math
+
+import numpy
+
+# Cells per row and column of a tile
+TILE_CELLS = 128
+
+# Most tiles a viewport may be covered with
+MAX_TILES = 1024
+
+# Corners of a cell, a corner's bit is set if its value is positive
+_BL, _BR, _TR, _TL = 1, 2, 4, 8
+
+# Segments of the cells per case, as pairs of the cell edges crossed:
+# 0 bottom, 1 right, 2 top, 3 left. The saddles 5 and 10 are resolved
+# by the value in the center of the cell.
+_SEGMENTS = {                                   \
+    _BL                 : ((3, 0),),            \
+    _BR                 : ((0, 1),),            \
+    _BL | _BR           : ((3, 1),),            \
+    _TR                 : ((1, 2),),            \
+    _BR | _TR           : ((0, 2),),            \
+    _BL | _BR | _TR     : ((3, 2),),            \
+    _TL                 : ((3, 2),),            \
+    _BL | _TL           : ((0, 2),),            \
+    _BL | _BR | _TL     : ((1, 2),),            \
+    _TR | _TL           : ((3, 1),),            \
+    _BL | _TR | _TL     : ((0, 1),),            \
+    _BR | _TR | _TL     : ((3, 0),)             \
+}
+
+# Saddles: segments if the center is positive, if it isn't
+_SADDLES = {                                                    \
+    _BL | _TR : (((0, 1), (3, 2)), ((3, 0), (1, 2))),           \
+    _BR | _TL : (((3, 0), (1, 2)), ((0, 1), (3, 2)))            \
+}
+
+
+def _edges(ci, cj, cases, center, ny, nx):
+    # Returns the start and end edge ids of all segments of the cells ci, cj.
+    # Horizontal edges (i, j)-(i, j+1) have the ids i*(nx-1)+j, vertical
+    # edges (i, j)-(i+1, j) the ids nh+i*nx+j.
+    nh = ny * (nx - 1)
+    ids = (ci * (nx - 1) + cj,                  \
+           nh + ci * nx + cj + 1,               \
+           (ci + 1) * (nx - 1) + cj,            \
+           nh + ci * nx + cj)
+
+    starts, ends = [], []
+    def add(mask, segments):
+        for a, b in segments:
+            starts.append(ids[a][mask])
+            ends.append(ids[b][mask])
+
+    for case, segments in _SEGMENTS.items():
+        add(cases == case, segments)
+    for case, (positive, negative) in _SADDLES.items():
+        mask = cases == case
+        add(mask & (center > 0), positive)
+        add(mask & ~(center > 0), negative)
+
+    if len(starts) == 0:
+        return numpy.zeros(0, dtype=numpy.intp), numpy.zeros(0, dtype=numpy.intp)
+    return numpy.concatenate(starts), numpy.concatenate(ends)
+
+
+def _points(nodes, x, y, z):
+    # Crossing points of the edges nodes, linearly interpolated
+    ny, nx = z.shape
+    nh = ny * (nx - 1)
+    points = numpy.empty((len(nodes), 2))
+
+    h = nodes < nh
+    i, j = numpy.divmod(nodes[h], nx - 1)
+    z0, z1 = z[i, j], z[i, j + 1]
+    t = z0 / (z0 - z1)
+    points[h, 0] = x[j] + t * (x[j + 1] - x[j])
+    points[h, 1] = y[i]
+
+    v = ~h
+    i, j = numpy.divmod(nodes[v] - nh, nx)
+    z0, z1 = z[i, j], z[i + 1, j]
+    t = z0 / (z0 - z1)
+    points[v, 0] = x[j]
+    points[v, 1] = y[i] + t * (y[i + 1] - y[i])
+    return points
+
+
+def _stitch(starts, ends, count):
+    # Joins the segments into polylines, every node belongs to at most two
+    # segments. Returns lists of node indices, closed lines repeat their first node.
+    neighbours = numpy.full((count, 2), -1, dtype=numpy.intp)
+    nodes = numpy.concatenate((starts, ends))
+    others = numpy.concatenate((ends, starts))
+    order = numpy.argsort(nodes, kind='stable')
+    nodes, others = nodes[order], others[order]
+    second = numpy.zeros(len(nodes), dtype=numpy.intp)
+    second[1:] = nodes[1:] == nodes[:-1]
+    neighbours[nodes, second] = others
+
+    neighbours = neighbours.tolist()
+    visited = [False] * count
+    degree = [2 - n.count(-1) for n in neighbours]
+    lines = []
+
+    def walk(start):
+        line = [start]
+        visited[start] = True
+        prev, node = -1, start
+        while True:
+            a, b = neighbours[node]
+            nxt = b if a == prev else a
+            if nxt == -1:
+                break
+            if visited[nxt]:
+                if nxt == start:
+                    line.append(start)
+                break
+            visited[nxt] = True
+            line.append(nxt)
+            prev, node = node, nxt
+        return line
+
+    # Open lines first, starting at their ends
+    for node in range(count):
+        if degree[node] == 1 and not visited[node]:
+            lines.append(walk(node))
+    for node in range(count):
+        if not visited[node]:
+            lines.append(walk(node))
+    return lines
+
+
+def zeroContours(x, y, z):
+    '''
+    Polylines where the function sampled as z crosses zero. x and y are the
+    coordinates of the grid's columns and rows, either as vectors or as
+    meshgrids, z has a row per y. Returns a list of arrays of shape (n, 2)
+    holding the points, closed curves end with their first point. Cells
+    with NaN values are skipped.
+    '''
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    z = numpy.asarray(z, dtype=float)
+    if x.ndim == 2:
+        x = x[0, :]
+    if y.ndim == 2:
+        y = y[:, 0]
+    ny, nx = z.shape
+    if nx < 2 or ny < 2:
+        return []
+
+    ci, cj = numpy.indices((ny - 1, nx - 1))
+    return _contours(x, y, z, ci.ravel(), cj.ravel())
+
+
+def _contours(x, y, z, ci, cj):
+    # Marching squares on the cells ci, cj of the grid only
+    ny, nx = z.shape
+    z00, z01, z11, z10 = z[ci, cj], z[ci, cj + 1], z[ci + 1, cj + 1], z[ci + 1, cj]
+    cases = (z00 > 0) * _BL + (z01 > 0) * _BR + (z11 > 0) * _TR + (z10 > 0) * _TL
+    center = z00 + z01 + z11 + z10
+    cases[numpy.isnan(center)] = 0
+
+    starts, ends = _edges(ci, cj, cases, center, ny, nx)
+    if len(starts) == 0:
+        return []
+
+    nodes, inverse = numpy.unique(numpy.concatenate((starts, ends)), return_inverse=True)
+    points = _points(nodes, x, y, z)
+    lines = _stitch(inverse[:len(starts)], inverse[len(starts):], len(nodes))
+
+    # A zero in a grid point gives several crossings in the same point
+    result = []
+    for line in lines:
+        pa = points[line]
+        keep = numpy.ones(len(pa), dtype=bool)
+        keep[1:] = (pa[1:] != pa[:-1]).any(axis=1)
+        if keep.sum() > 1:
+            result.append(pa[keep])
+    return result
+
+
+def adaptiveContours(f, xs, xe, ys, ye, tolerance, coarse=32, maxSize=1024):
+    '''
+    Like zeroContours, but samples the function f(x, y), taking and
+    returning arrays, adaptively. A coarse x coarse grid covering the
+    rectangle [xs, xe] x [ys, ye] is refined by quadtree subdivision down to
+    cells not bigger than tolerance, but only cells with a sign change or
+    values small compared to their variation, which suggests a zero nearby,
+    and their neighbours are subdivided. The finest grid has at most
+    maxSize cells per row and column.
+    '''
+    levels = 0
+    while coarse * 2 ** (levels + 1) <= maxSize and max(abs(xe - xs), abs(ye - ys)) / (coarse * 2 ** levels) > tolerance:
+        levels += 1
+    size = coarse * 2 ** levels
+    x = numpy.linspace(xs, xe, size + 1)
+    y = numpy.linspace(ys, ye, size + 1)
+    z = numpy.empty((size + 1, size + 1))
+    known = numpy.zeros((size + 1, size + 1), dtype=bool)
+
+    def evaluate(i, j):
+        # Every point is evaluated once, corners are shared by the cells
+        i, j = numpy.divmod(numpy.unique(i * (size + 1) + j), size + 1)
+        missing = ~known[i, j]
+        i, j = i[missing], j[missing]
+        if len(i) > 0:
+            z[i, j] = numpy.broadcast_to(f(x[j], y[i]), i.shape)
+            known[i, j] = True
+
+    def corners(active, b):
+        ai, aj = numpy.nonzero(active)
+        return ai * b, aj * b, (ai + 1) * b, (aj + 1) * b
+
+    b = 2 ** levels
+    active = numpy.ones((coarse, coarse), dtype=bool)
+    i0, j0, i1, j1 = corners(active, b)
+    evaluate(numpy.concatenate((i0, i0, i1, i1)), numpy.concatenate((j0, j1, j0, j1)))
+
+    while b > 1:
+        i0, j0, i1, j1 = corners(active, b)
+        values = numpy.stack((z[i0, j0], z[i0, j1], z[i1, j0], z[i1, j1]))
+        with numpy.errstate(invalid='ignore'):
+            lo, hi = values.min(axis=0), values.max(axis=0)
+            near = (lo <= 0) & (hi > 0) | (numpy.abs(values).min(axis=0) <= hi - lo)
+
+        flagged = numpy.zeros_like(active)
+        flagged[i0 // b, j0 // b] = near
+        # Neighbours too, a curve may leave a block through an edge without
+        # a sign change at its corners
+        flagged[1:, :] |= flagged[:-1, :].copy()
+        flagged[:-1, :] |= flagged[1:, :].copy()
+        flagged[:, 1:] |= flagged[:, :-1].copy()
+        flagged[:, :-1] |= flagged[:, 1:].copy()
+
+        active = flagged.repeat(2, axis=0).repeat(2, axis=1)
+        b //= 2
+        i0, j0, i1, j1 = corners(active, b)
+        evaluate(numpy.concatenate((i0, i0, i1, i1)), numpy.concatenate((j0, j1, j0, j1)))
+
+    ci, cj = numpy.nonzero(active)
+    return _contours(x, y, z, ci, cj)
+
+
+def joinPolylines(lines):
+    '''
+    Joins polylines sharing end points, e.g. the pieces of a curve crossing
+    several tiles. Returns new arrays.
+    '''
+    ends = {}
+    for k, line in enumerate(lines):
+        for end in (0, -1):
+            ends.setdefault(tuple(line[end]), []).append(k)
+
+    used = [False] * len(lines)
+    def follow(point):
+        # Next unused line starting or ending at point, oriented to start there
+        for k in ends.get(point, ()):
+            if not used[k]:
+                used[k] = True
+                line = lines[k]
+                return line if tuple(line[0]) == point else line[::-1]
+        return None
+
+    joined = []
+    for k, line in enumerate(lines):
+        if used[k]:
+            continue
+        used[k] = True
+        parts = [line]
+        while True:
+            nxt = follow(tuple(parts[-1][-1]))
+            if nxt is None:
+                break
+            parts.append(nxt[1:])
+        head = []
+        while True:
+            prev = follow(tuple((head[-1] if head else parts[0])[0]))
+            if prev is None:
+                break
+            head.append(prev[::-1][:-1])
+        joined.append(numpy.concatenate(head[::-1] + parts))
+    return joined
+
+
+def tileLevel(tolerance, tileCells=TILE_CELLS):
+    '''
+    Zoom level of the tiles whose cells are not bigger than tolerance,
+    tiles of level l have the size 2^l.
+    '''
+    return math.floor(math.log2(tolerance * tileCells))
+
+
+def tileRange(xs, xe, ys, ye, level, maxTiles=MAX_TILES):
+    '''
+    Iterator over the columns and rows of the tiles of level covering
+    [xs, xe] x [ys, ye], the bounds may be given in either order. Raises
+    ValueError if these are more than maxTiles tiles.
+    '''
+    xs, xe = min(xs, xe), max(xs, xe)
+    ys, ye = min(ys, ye), max(ys, ye)
+    size = 2.0 ** level
+    columns = range(math.floor(xs / size), math.ceil(xe / size))
+    rows = range(math.floor(ys / size), math.ceil(ye / size))
+    if len(columns) * len(rows) > maxTiles:
+        raise ValueError("%d tiles of level %d are needed, at most %d are allowed" % (len(columns) * len(rows), level, maxTiles))
+    return ((tx, ty) for ty in rows for tx in columns)
+
+
+def contourTiles(f, level, tiles, tileCells=TILE_CELLS):
+    '''
+    The polylines of f in each of the tiles, computed by adaptiveContours.
+    '''
+    size = 2.0 ** level
+    return [adaptiveContours(f, tx * size, (tx + 1) * size, ty * size, (ty + 1) * size, size / tileCells, 16, tileCells) \
+            for tx, ty in tiles]
+
+
+def tiledContours(f, key, xs, xe, ys, ye, tolerance, cache=None, tileCells=TILE_CELLS, maxTiles=MAX_TILES):
+    '''
+    Like adaptiveContours, but computed per tile. Tiles are squares fixed
+    in the plane, their size is a power of two such that their cells are
+    not bigger than tolerance. The polylines of a tile are stored in cache,
+    any object with get(key) and put(key, value) methods, under (key, zoom
+    level, column, row), so panning and zooming back only compute the tiles
+    not seen before. key has to identify the function f. Raises ValueError
+    if more than maxTiles tiles are needed.
+    '''
+    level = tileLevel(tolerance, tileCells)
+
+    lines = []
+    for tile in tileRange(xs, xe, ys, ye, level, maxTiles):
+        k = (key, level) + tile
+        found = cache.get(k) if cache is not None else None
+        if found is None:
+            found = contourTiles(f, level, [tile], tileCells)[0]
+            if cache is not None:
+                cache.put(k, found)
+        lines.extend(found)
+
+    # Neighbouring tiles share the grid points on their border, so the
+    # pieces of a curve end in exactly the same points
+    return joinPolylines(lines)
+
+
+def transform(points, scale=1.0, rotation=0.0, dx=0.0, dy=0.0):
+    '''
+    Rotates the points of shape (n, 2) by rotation around the origin,
+    scales them by scale and moves them by (dx, dy).
+    '''
+    c = scale * math.cos(rotation)
+    s = scale * math.sin(rotation)
+    return points @ numpy.array([[c, s], [-s, c]]) + (dx, dy)
+
+
+def simplify(points, tolerance):
+    '''
+    Removes points of a polyline by the Douglas-Peucker algorithm, the
+    result doesn't deviate more than tolerance from points.
+    '''
+    n = len(points)
+    if n < 3 or tolerance <= 0:
+        return points
+
+    keep = numpy.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        p = points[a]
+        d = points[b] - p
+        rest = points[a + 1:b] - p
+        length = math.hypot(d[0], d[1])
+        if length == 0:
+            dist = numpy.hypot(rest[:, 0], rest[:, 1])
+        else:
+            dist = numpy.abs(d[0] * rest[:, 1] - d[1] * rest[:, 0]) / length
+        k = int(numpy.argmax(dist))
+        if dist[k] > tolerance:
+            k += a + 1
+            keep[k] = True
+            stack.append((a, k))
+            stack.append((k, b))
+    return points[keep]
+
+
+def flatten(lines):
+    '''
+    The x and y coordinates of all polylines in two arrays, every polyline
+    is followed by a NaN.
+    '''
+    if len(lines) == 0:
+        return numpy.zeros(0), numpy.zeros(0)
+    gap = numpy.full((1, 2), numpy.nan)
+    points = numpy.concatenate([p for pa in lines for p in (pa, gap)])
+    return numpy.ascontiguousarray(points[:, 0]), numpy.ascontiguousarray(points[:, 1])
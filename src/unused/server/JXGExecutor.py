@@ -0,0 +1,207 @@
+import concurrent.futures
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import traceback
+
+import JXG
+from JXGMetrics import metrics
+from JXGRegistry import registry
+
+
+class DeadlineExceeded(Exception): pass
+
+class WorkerError(Exception): pass
+
+
+def _worker_main(conn):
+    # Every worker leads its own process group, on timeout the whole group,
+    # including processes started by the handler (e.g. CoCoA), is killed.
+    if hasattr(os, 'setsid'):
+        os.setsid()
+    # The server handles ^C, not the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Observations are sent to the server together with the results
+    metrics.buffered = True
+
+    while True:
+        try:
+            func, args = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            result = (True, func(*args))
+        except Exception as e:
+            result = (False, e.__str__() or traceback.format_exc(limit=1))
+        conn.send(result)
+
+
+class _Worker(object):
+
+    def __init__(self, context):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+
+    def kill(self):
+        try:
+            if hasattr(os, 'killpg'):
+                try:
+                    os.killpg(self.process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    # A fresh worker may not lead its group yet
+                    self.process.kill()
+            else:
+                self.process.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+        self.process.join()
+        self.conn.close()
+
+
+class ProcessPool(object):
+    '''
+    A bounded pool of worker processes. Jobs are module level functions
+    with picklable arguments. A job not finished before its deadline gets
+    its worker killed, the worker is replaced by a fresh one.
+    '''
+
+    def __init__(self, size=None):
+        self.size = size or os.cpu_count() or 1
+        self._context = multiprocessing.get_context('spawn')
+        self._idle = queue.LifoQueue()
+        self._started = 0
+        self._lock = threading.Lock()
+
+    def call(self, func, args=(), timeout=None, labels=None):
+        start = time.perf_counter()
+        worker = self._acquire()
+        if labels is not None:
+            metrics.observe('jxg_phase_seconds', time.perf_counter() - start, phase='queue', **labels)
+        try:
+            worker.conn.send((func, args))
+            if not worker.conn.poll(timeout):
+                worker.kill()
+                worker = _Worker(self._context)
+                raise DeadlineExceeded("deadline of %s seconds exceeded" % timeout)
+            ok, value = worker.conn.recv()
+        except (EOFError, OSError, BrokenPipeError):
+            worker.kill()
+            worker = _Worker(self._context)
+            raise WorkerError("worker process died")
+        finally:
+            self._idle.put(worker)
+
+        if not ok:
+            raise WorkerError(value)
+        return value
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle.empty() and self._started < self.size:
+                self._started += 1
+                return _Worker(self._context)
+        return self._idle.get()
+
+    def shutdown(self):
+        with self._lock:
+            while not self._idle.empty():
+                self._idle.get().kill()
+            self._started = 0
+
+
+def _run_handler(module, name, id, args):
+    # Runs in the worker process, the plugin is imported there once
+    h = registry.handler(module, name)
+    resp = JXG.Response(id, streaming=True)
+    args = iter(args)
+    h.method(*[resp if slot is None else next(args) for slot in h.slots])
+
+    if resp._type == 'error':
+        return 'error', resp._message, metrics.drain()
+    # Streamed frames are computed here, within the deadline, and sent as list
+    stream = None
+    if resp._stream is not None:
+        stream = (resp._stream[0], list(resp._stream[1]))
+    return 'response', (resp._data, resp._fields, resp._handler, stream), metrics.drain()
+
+
+class Executor(object):
+    '''
+    Runs the handlers. Handlers declared as cpubound run in the process pool
+    with their deadline, all others in the calling thread. The frames a
+    cpubound handler streams are all computed before its response is sent.
+    '''
+
+    def __init__(self, workers=None):
+        self.workers = workers
+        # No process pool, e.g. for one-shot CGI requests
+        self.inline = False
+        self._pool = None
+        self._threads = None
+        self._lock = threading.Lock()
+
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPool(self.workers)
+            return self._pool
+
+    def map(self, func, args, timeout=None):
+        '''
+        Calls the module level function func with each of the argument
+        tuples in args in the process pool, as many at once as there are
+        workers. Returns the results in the order of args, raises the
+        exception of the first failed call.
+        '''
+        return list(self.imap(func, args, timeout))
+
+    def imap(self, func, args, timeout=None):
+        '''
+        Like map(), but generates the results in the order of args as soon
+        as they are available. All calls are started at once.
+        '''
+        if self.inline:
+            for a in args:
+                yield func(*a)
+            return
+
+        pool = self.pool()
+        with self._lock:
+            if self._threads is None:
+                self._threads = concurrent.futures.ThreadPoolExecutor(pool.size)
+        futures = [self._threads.submit(pool.call, func, a, timeout) for a in args]
+        for f in futures:
+            yield f.result()
+
+    def execute(self, h, params, resp, labels=None):
+        if not h.cpubound or self.inline:
+            h.method(*params)
+            return
+
+        args = [p for p, slot in zip(params, h.slots) if slot is not None]
+        try:
+            type, value, events = self.pool().call(_run_handler, (h.module, h.name, resp._id, args), h.timeout, labels)
+        except DeadlineExceeded:
+            metrics.inc('jxg_timeouts_total', module=h.module, handler=h.name)
+            resp.error("timeout, handler \"" + h.module + "." + h.name + "\" didn't finish within %s seconds" % h.timeout)
+            return
+
+        metrics.replay(events)
+        if type == 'error':
+            resp.error(value)
+            return
+
+        data, fields, handlers, stream = value
+        resp._data.update(data)
+        resp._fields.extend(fields)
+        resp._handler.extend(handlers)
+        if stream is not None:
+            resp.addStream(*stream)
+
+
+executor = Executor()
@@ -0,0 +1,144 @@
+import contextlib
+import threading
+import time
+
+# Upper bounds of the histogram buckets for durations in seconds and sizes in bytes
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+HELP = {                                                                                                \
+         'jxg_phase_seconds'      : 'Time spent per request phase',                                     \
+         'jxg_request_bytes'      : 'Size of the decoded request payload',                              \
+         'jxg_response_bytes'     : 'Size of the response body sent to the client',                     \
+         'jxg_requests_total'     : 'Number of handled requests',                                       \
+         'jxg_errors_total'       : 'Number of requests answered with an error',                        \
+         'jxg_timeouts_total'     : 'Number of handlers killed because of their deadline'               \
+       }
+
+
+class Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i in range(0, len(self.buckets)):
+            if value <= self.buckets[i]:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _format(name, labels, extra=()):
+    items = list(labels) + list(extra)
+    if len(items) == 0:
+        return name
+    s = ','.join('%s="%s"' % (k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in items)
+    return name + '{' + s + '}'
+
+
+class Metrics(object):
+    '''
+    Histograms, counters and gauges, rendered in the Prometheus text
+    exposition format. Worker processes run in buffered mode, their
+    observations are sent to the server with the handler's result and
+    replayed there.
+    '''
+
+    def __init__(self):
+        self.buffered = False
+        self._events = []
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = []
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, buckets=TIME_BUCKETS, **labels):
+        if self.buffered:
+            self._events.append(('observe', name, value, buckets, labels))
+            return
+        key = (name, _labels(labels))
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = Histogram(buckets)
+            h.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        if self.buffered:
+            self._events.append(('inc', name, value, None, labels))
+            return
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    @contextlib.contextmanager
+    def timer(self, phase, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('jxg_phase_seconds', time.perf_counter() - start, phase=phase, **labels)
+
+    def addGauges(self, func):
+        # func returns a list of (name, type, labels dict, value), it's
+        # called on every rendering
+        self._gauges.append(func)
+
+    def drain(self):
+        events, self._events = self._events, []
+        return events
+
+    def replay(self, events):
+        for kind, name, value, buckets, labels in events:
+            if kind == 'observe':
+                self.observe(name, value, buckets, **labels)
+            else:
+                self.inc(name, value, **labels)
+
+    def render(self):
+        lines = []
+        typed = set()
+
+        def header(name, type):
+            if name not in typed:
+                typed.add(name)
+                if name in HELP:
+                    lines.append('# HELP %s %s' % (name, HELP[name]))
+                lines.append('# TYPE %s %s' % (name, type))
+
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            histograms = [(k, list(h.buckets), list(h.counts), h.sum, h.count) for k, h in histograms]
+
+        for (name, labels), buckets, counts, total, count in histograms:
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, n in zip(buckets, counts):
+                cumulative += n
+                lines.append('%s %d' % (_format(name + '_bucket', labels, [('le', repr(float(bound)))]), cumulative))
+            lines.append('%s %d' % (_format(name + '_bucket', labels, [('le', '+Inf')]), count))
+            lines.append('%s %s' % (_format(name + '_sum', labels), repr(total)))
+            lines.append('%s %d' % (_format(name + '_count', labels), count))
+
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append('%s %s' % (_format(name, labels), value))
+
+        for func in self._gauges:
+            for name, type, labels, value in func():
+                header(name, type)
+                lines.append('%s %s' % (_format(name, _labels(labels)), value))
+
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
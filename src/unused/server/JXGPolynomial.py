@@ -0,0 +1,303 @@
+'''
+Polynomials as written by JSXGraph and printed by CoCoA, e.g.
+"(u[1])*(x)-3/2*y^2+0.5". A polynomial is a dict mapping monomials to
+their Fraction coefficients, a monomial is a sorted tuple of
+(variable, exponent) pairs, () is the constant monomial.
+'''
+
+import fractions
+import functools
+import re
+
+import numpy
+
+# Expanding larger powers is left to CoCoA
+MAX_EXPONENT = 64
+# Products of terms spent on expanding a polynomial, e.g. (x+y+u[1])^20,
+# bigger expansions are refused
+MAX_PRODUCTS = 20000
+
+_TOKEN = re.compile(r'\s*(?:(\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)|([A-Za-z_]\w*)|(\*\*|[-+*/^()\[\],]))')
+
+
+class PolynomialError(ValueError): pass
+
+
+def _tokens(text):
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = _TOKEN.match(text, pos)
+        if m is None:
+            raise PolynomialError("unexpected character %r in polynomial" % text[pos])
+        pos = m.end()
+        if m.group(1) is not None:
+            yield ('num', fractions.Fraction(m.group(1)))
+        elif m.group(2) is not None:
+            yield ('name', m.group(2))
+        else:
+            yield ('op', m.group(3))
+    yield ('end', None)
+
+
+def _add(p, q, sign=1):
+    r = dict(p)
+    for mono, c in q.items():
+        c = r.get(mono, 0) + sign * c
+        if c == 0:
+            r.pop(mono, None)
+        else:
+            r[mono] = c
+    return r
+
+def _mulMono(a, b):
+    exps = dict(a)
+    for v, e in b:
+        exps[v] = exps.get(v, 0) + e
+    return tuple(sorted(exps.items()))
+
+def _mul(p, q, budget=None):
+    if budget is not None:
+        budget.spend(len(p) * len(q))
+    r = {}
+    for ma, ca in p.items():
+        for mb, cb in q.items():
+            mono = _mulMono(ma, mb)
+            c = r.get(mono, 0) + ca * cb
+            if c == 0:
+                r.pop(mono, None)
+            else:
+                r[mono] = c
+    return r
+
+def _pow(p, n, budget=None):
+    r = {(): fractions.Fraction(1)}
+    for i in range(n):
+        r = _mul(r, p, budget)
+    return r
+
+def _constant(c):
+    return {(): c} if c != 0 else {}
+
+
+class _Budget(object):
+    # Products of terms left for expanding a polynomial
+
+    def __init__(self, products):
+        self.products = products
+
+    def spend(self, products):
+        self.products -= products
+        if self.products < 0:
+            raise PolynomialError("polynomial is too big to be expanded")
+
+
+class _Parser(object):
+
+    def __init__(self, text):
+        self.tokens = _tokens(text)
+        # Shared by all polynomials of a system
+        self.budget = _Budget(MAX_PRODUCTS)
+        self.next()
+
+    def next(self):
+        self.kind, self.value = next(self.tokens)
+
+    def expect(self, op):
+        if self.kind != 'op' or self.value != op:
+            raise PolynomialError("expected %r in polynomial" % op)
+        self.next()
+
+    def system(self):
+        polys = [self.expr()]
+        while self.kind == 'op' and self.value == ',':
+            self.next()
+            polys.append(self.expr())
+        if self.kind != 'end':
+            raise PolynomialError("unexpected %r in polynomial" % self.value)
+        return polys
+
+    def expr(self):
+        p = self.term()
+        while self.kind == 'op' and self.value in '+-':
+            sign = 1 if self.value == '+' else -1
+            self.next()
+            p = _add(p, self.term(), sign)
+        return p
+
+    def term(self):
+        p = self.unary()
+        while self.kind == 'op' and self.value in '*/':
+            op = self.value
+            self.next()
+            q = self.unary()
+            if op == '*':
+                p = _mul(p, q, self.budget)
+            elif len(q) == 1 and () in q:
+                p = dict((mono, c / q[()]) for mono, c in p.items())
+            else:
+                raise PolynomialError("division by a non constant polynomial")
+        return p
+
+    def unary(self):
+        if self.kind == 'op' and self.value in '+-':
+            sign = 1 if self.value == '+' else -1
+            self.next()
+            return dict((mono, sign * c) for mono, c in self.unary().items())
+        return self.power()
+
+    def power(self):
+        p = self.atom()
+        if self.kind == 'op' and self.value in ('^', '**'):
+            self.next()
+            if self.kind != 'num' or self.value.denominator != 1:
+                raise PolynomialError("exponents have to be non negative integers")
+            n = int(self.value)
+            if n > MAX_EXPONENT:
+                raise PolynomialError("exponent %d is too big" % n)
+            self.next()
+            p = _pow(p, n, self.budget)
+        return p
+
+    def atom(self):
+        if self.kind == 'num':
+            c = self.value
+            self.next()
+            return _constant(c)
+        if self.kind == 'name':
+            name = self.value
+            self.next()
+            if self.kind == 'op' and self.value == '[':
+                self.next()
+                if self.kind != 'num' or self.value.denominator != 1:
+                    raise PolynomialError("indices have to be integers")
+                name += '[%d]' % self.value
+                self.next()
+                self.expect(']')
+            return {((name, 1),): fractions.Fraction(1)}
+        if self.kind == 'op' and self.value == '(':
+            self.next()
+            p = self.expr()
+            self.expect(')')
+            return p
+        raise PolynomialError("unexpected end of polynomial" if self.kind == 'end' else "unexpected %r in polynomial" % self.value)
+
+
+def parse(text):
+    '''
+    Parses a single polynomial, raises PolynomialError on syntax errors.
+    '''
+    polys = _Parser(text).system()
+    if len(polys) != 1:
+        raise PolynomialError("expected a single polynomial")
+    return polys[0]
+
+def parseSystem(text):
+    '''
+    Parses a comma separated list of polynomials.
+    '''
+    return _Parser(text).system()
+
+def variables(poly):
+    return set(v for mono in poly for v, e in mono)
+
+def rename(poly, names):
+    '''
+    Renames the variables by the dict names, others are kept.
+    '''
+    return dict((tuple(sorted((names.get(v, v), e) for v, e in mono)), c) for mono, c in poly.items())
+
+def substitute(poly, values):
+    '''
+    Replaces the variables in the dict values by their numbers, floats are
+    taken by their shortest decimal representation.
+    '''
+    values = dict((v, fractions.Fraction(repr(float(c))) if isinstance(c, float) else fractions.Fraction(c)) for v, c in values.items())
+    r = {}
+    for mono, c in poly.items():
+        rest = []
+        for v, e in mono:
+            if v in values:
+                c *= values[v] ** e
+            else:
+                rest.append((v, e))
+        r = _add(r, _constant(c) if len(rest) == 0 else {tuple(rest): c})
+    return r
+
+def monic(poly):
+    '''
+    Divides by the coefficient of the greatest monomial, so polynomials
+    differing by a constant factor become equal.
+    '''
+    if len(poly) == 0:
+        return poly
+    lead = poly[max(poly)]
+    return dict((mono, c / lead) for mono, c in poly.items())
+
+def toString(poly):
+    '''
+    Canonical string of poly, the terms are ordered by their monomials.
+    '''
+    if len(poly) == 0:
+        return '0'
+    terms = []
+    for mono in sorted(poly):
+        c = poly[mono]
+        term = str(c) if len(mono) == 0 else '*'.join([str(c)] + [v if e == 1 else '%s^%d' % (v, e) for v, e in mono])
+        terms.append(term)
+    return ' + '.join(terms)
+
+
+class Evaluator(object):
+    '''
+    A polynomial in x and y compiled for evaluation on numpy arrays. The
+    coefficients are kept as a matrix, row a holding the coefficients of
+    x^a as polynomial in y. Evaluation computes the powers of y once and
+    runs Horner's scheme in x.
+    '''
+
+    def __init__(self, poly, xname='x', yname='y'):
+        others = variables(poly) - set((xname, yname))
+        if len(others) > 0:
+            raise PolynomialError("not a polynomial in %s and %s: %s" % (xname, yname, ', '.join(sorted(others))))
+
+        degx = max([dict(mono).get(xname, 0) for mono in poly] + [0])
+        degy = max([dict(mono).get(yname, 0) for mono in poly] + [0])
+        self.coefficients = numpy.zeros((degx + 1, degy + 1))
+        for mono, c in poly.items():
+            exps = dict(mono)
+            self.coefficients[exps.get(xname, 0), exps.get(yname, 0)] = float(c)
+        # Only the non zero coefficients of each row are used
+        self._rows = [[(b, c) for b, c in enumerate(row) if c != 0] for row in self.coefficients.tolist()]
+
+    def __call__(self, x, y):
+        x, y = numpy.broadcast_arrays(numpy.asarray(x, dtype=float), numpy.asarray(y, dtype=float))
+
+        # powers[b] is y^b, y^0 is never needed
+        powers = [None, y]
+        for b in range(2, self.coefficients.shape[1]):
+            powers.append(powers[b - 1] * y)
+
+        result = numpy.zeros(x.shape)
+        tmp = numpy.empty(x.shape)
+        for a in range(len(self._rows) - 1, -1, -1):
+            if a < len(self._rows) - 1:
+                numpy.multiply(result, x, out=result)
+            for b, c in self._rows[a]:
+                if b == 0:
+                    numpy.add(result, c, out=result)
+                elif c == 1:
+                    numpy.add(result, powers[b], out=result)
+                else:
+                    numpy.multiply(powers[b], c, out=tmp)
+                    numpy.add(result, tmp, out=result)
+        return result
+
+
+@functools.lru_cache(maxsize=256)
+def compile(text, xname='x', yname='y'):
+    '''
+    Evaluator of the polynomial text in xname and yname, e.g. as printed
+    by CoCoA. Compiled polynomials are cached.
+    '''
+    return Evaluator(parse(text), xname, yname)
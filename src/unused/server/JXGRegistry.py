@@ -0,0 +1,127 @@
+import inspect
+import threading
+
+from JXGAdmission import Limiter
+from JXGServerModule import JXGServerModule
+
+
+class RegistryError(Exception): pass
+
+
+class Handler(object):
+    '''
+    A plugin method callable via the exec action. The mapping of the JSON
+    fields to the method's parameters is computed once at registration.
+    '''
+
+    def __init__(self, module, name, method):
+        self.module = module
+        self.name = name
+        self.method = method
+
+        options = getattr(method, 'jxgOptions', {})
+        self.cpubound = options.get('cpubound', False)
+        self.timeout = options.get('timeout')
+        self.cacheable = options.get('cacheable', False)
+        self.ttl = options.get('ttl')
+
+        # One slot per parameter, None is the slot of the response object
+        self.slots = []
+        self.defaults = {}
+        for p in inspect.signature(method).parameters.values():
+            if p.name == 'resp':
+                self.slots.append(None)
+            else:
+                self.slots.append(p.name)
+                if p.default is not inspect.Parameter.empty:
+                    self.defaults[p.name] = p.default
+
+        self.parameters = [s for s in self.slots if s is not None]
+
+    def bind(self, req, resp):
+        params = []
+        for slot in self.slots:
+            if slot is None:
+                params.append(resp)
+                continue
+            try:
+                params.append(req.getValue(slot))
+            except KeyError:
+                if slot not in self.defaults:
+                    raise RegistryError("missing parameter \"" + slot + "\" for handler \"" + self.module + "." + self.name + "\"")
+                params.append(self.defaults[slot])
+        return params
+
+
+class Plugin(object):
+
+    def __init__(self, name, cls):
+        self.name = name
+        self.instance = cls()
+        if not getattr(self.instance, 'isJXGServerModule', False):
+            raise RegistryError("not a jxg server module: \"" + name + "\"")
+        self.limiter = Limiter(name, self.instance.maxConcurrency, self.instance.queueDepth, self.instance.queueTimeout)
+
+        self.handlers = {}
+        for attr in dir(cls):
+            if attr.startswith('_') or attr == 'init' or hasattr(JXGServerModule, attr):
+                continue
+            method = getattr(self.instance, attr)
+            if callable(method):
+                self.handlers[attr] = Handler(name, attr, method)
+
+
+class Registry(object):
+    '''
+    Imports every plugin once and keeps one instance of its
+    JXGServerModule subclass together with the handler dispatch table.
+    '''
+
+    def __init__(self):
+        self._plugins = {}
+        self._lock = threading.Lock()
+
+    def plugin(self, name):
+        plugin = self._plugins.get(name)
+        if plugin is not None:
+            return plugin
+
+        with self._lock:
+            if name not in self._plugins:
+                self._plugins[name] = self._load(name)
+            return self._plugins[name]
+
+    def plugins(self):
+        return list(self._plugins.values())
+
+    def handler(self, module, name):
+        handler = self.plugin(module).handlers.get(name)
+        if handler is None:
+            raise RegistryError("handler \"" + name + "\" is undefined in module \"" + module + "\"")
+        return handler
+
+    def _load(self, name):
+        try:
+            mod = __import__(name, None, None, [''])
+        except Exception as e:
+            raise RegistryError("error loading jxg server module: \"" + name + "\": " + e.__str__())
+
+        # Only consider classes defined in the plugin itself, not the ones
+        # imported from other plugins
+        classes = [c for c in vars(mod).values()
+                   if inspect.isclass(c) and issubclass(c, JXGServerModule)
+                   and c is not JXGServerModule and c.__module__ == mod.__name__]
+        if len(classes) == 0:
+            raise RegistryError("error loading module \"" + name + "\"")
+        if len(classes) > 1:
+            raise RegistryError("more than one jxg server module in \"" + name + "\"")
+
+        try:
+            return Plugin(name, classes[0])
+        except RegistryError:
+            raise
+        except Exception as e:
+            raise RegistryError("error loading jxg server module: \"" + name + "\": " + e.__str__())
+
+
+registry = Registry()
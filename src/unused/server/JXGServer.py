@@ -1,94 +1,495 @@
 #!/usr/bin/env python
 
-# ZIP compression
-import zlib
 # Base64 en-/decoding
 import base64
-# CGI variables handling
-import cgi
+# Form decoding, replaces the cgi module which is gone since python 3.13
+import urllib.parse
+
+import argparse
+import asyncio
+import concurrent.futures
+import os
+import sys
+import time
 
 import JXG
-import inspect
+from JXGAdmission import Busy
+from JXGCache import Cache, canonicalKey
+from JXGCompression import CompressionPolicy
+from JXGExecutor import executor
+from JXGMetrics import metrics, SIZE_BUCKETS
+from JXGRegistry import registry, RegistryError
+
+# Largest request body accepted by the long-lived server
+MAX_BODY = 64 * 1024 * 1024
+
+# Largest number of handler calls in a single batch action and the
+# number of threads running the calls of parallel batches
+MAX_BATCH = 64
+batch_pool = concurrent.futures.ThreadPoolExecutor(max_workers=8)
 
+compression = CompressionPolicy()
 
-# Base plugin
-from JXGServerModule import JXGServerModule
+# Results of cacheable handlers, (content, size of the serialized response)
+# tuples. The content is encoded for every request, so the response carries
+# the request's id.
+result_cache = Cache(64 * 1024 * 1024, sizeof=lambda entry: entry[1])
 
-def print_httpheader():
-    print("""\
-Content-Type: text/plain\n
-""")
+# Threads running the requests. Handlers declared as cpubound are passed on
+# to the process pool of the executor, the thread just waits for them.
+request_pool = concurrent.futures.ThreadPoolExecutor(max_workers=64)
+
+def print_httpheader(headers):
+    for name in headers:
+        print(name + ": " + headers[name])
+    print()
 
 
 def default_action(req, resp):
-    action = req.getvalue('action', 'empty')
+    action = req.getValue('action', 'empty')
     resp.error("action \"" + action + "\" is undefined")
     return resp.dump()
 
-def import_module(plugin, resp):
+def load_module(req, resp):
+    plugin = req.getValue("module", 'none')
     try:
-        __import__(plugin, None, None, [''])
+        tp = registry.plugin(plugin)
+    except RegistryError as e:
+        resp.error(e.__str__())
+        return resp.dump()
 
-        tp = JXGServerModule.__subclasses__()
-        if len(tp) == 0:
-            resp.error("error loading module \"" + plugin + "\"")
-            return tp
-        tp = tp[0]()
+    tp.instance.init(resp)
+    return resp.dump()
 
-        if not tp.isJXGServerModule:
-            resp.error("not a jxg server module: \"" + plugin + "\"")
-            return tp
-    except Exception as e:
-        resp.error("error loading jxg server module: \"" + plugin + "\": " + e.__str__())
-        return
+def call_handler(module, handler, req, resp, action='exec'):
+    start = time.perf_counter()
+    try:
+        h = registry.handler(module, handler)
+    except RegistryError as e:
+        resp.error(e.__str__())
+        return None
 
-    return tp
+    labels = {'action': action, 'module': h.module, 'handler': h.name}
+    metrics.observe('jxg_phase_seconds', time.perf_counter() - start, phase='lookup', **labels)
 
-def load_module(req, resp):
-    plugin = req.getValue("module", 'none')
-    tp = import_module(plugin, resp)
+    try:
+        with metrics.timer('bind', **labels):
+            params = h.bind(req, resp)
+    except RegistryError as e:
+        resp.error(e.__str__())
+        return labels
 
-    if resp._type != 'error':
-        tp.init(resp)
-    return resp.dump()
+    # Waits for a free slot of the module, or is refused at once
+    limiter = registry.plugin(h.module).limiter
+    try:
+        with metrics.timer('admission', **labels):
+            limiter.acquire()
+    except Busy as e:
+        resp.error(e.__str__())
+        return labels
+
+    try:
+        with metrics.timer('handler', **labels):
+            executor.execute(h, params, resp, labels)
+    except Exception as e:
+        resp.error("error in handler \"" + module + "." + handler + "\": " + e.__str__())
+    finally:
+        # Streamed frames are computed later, they keep the slot until done
+        if resp._stream is not None and resp._type != 'error':
+            resp._stream = (resp._stream[0], limiter.hold(resp._stream[1]))
+        else:
+            limiter.release()
+    return labels
 
 def exec_module(req, resp):
     handler = req.getValue('handler', 'none')
     module = req.getValue('module', 'none')
 
-    m = import_module(module, resp)
-    if resp._type == 'error':
+    labels = call_handler(module, handler, req, resp)
+    if labels is None:
+        return resp.dump()
+    with metrics.timer('dump', **labels):
         return resp.dump()
 
-    method = getattr(m, handler)
-    params = ()
-    args = inspect.getargspec(method)
-    for i in range(0, len(args.args)):
-        if args.args[i] == 'self':
-            pass
-        elif args.args[i] == 'resp':
-            params += (resp, )
-        else:
-            params += (req.getValue(args.args[i]), )
+def batch_call(id, call):
+    sub = JXG.Response(id)
+    try:
+        module = call['module']
+        handler = call['handler']
+        args = call.get('args', {})
+        if not isinstance(args, dict):
+            raise TypeError
+    except (KeyError, TypeError, AttributeError):
+        sub.error("batch entry \"" + id + "\" needs a module, a handler and an object of args")
+    else:
+        call_handler(module, handler, JXG.Request('exec', id, None, values=args), sub, 'batch')
 
-    method(*params)
+    if sub._type == 'error':
+        return {'type': 'error', 'message': sub._message}
+    return {'type': 'response', 'data': sub._data}
 
-    return resp.dump()
+def batch_module(req, resp):
+    try:
+        calls = req.getValue('calls')
+    except KeyError:
+        calls = None
+    if not isinstance(calls, list):
+        resp.error("batch needs a list of calls")
+        return resp.dump()
+    if len(calls) > MAX_BATCH:
+        resp.error("too many calls in batch, at most %d are allowed" % MAX_BATCH)
+        return resp.dump()
+
+    try:
+        parallel = req.getValue('parallel')
+    except KeyError:
+        parallel = False
 
-# Get Data from post/get parameters
-form = cgi.FieldStorage();
+    ids = []
+    for i in range(0, len(calls)):
+        id = calls[i].get('id') if isinstance(calls[i], dict) else None
+        ids.append(str(id) if id is not None else str(i))
 
-action = form.getfirst('action', 'empty')
-id = form.getfirst('id', 'none')
-data = base64.b64decode(form.getfirst('dataJSON', ''))
+    if parallel:
+        results = batch_pool.map(batch_call, ids, calls)
+    else:
+        results = map(batch_call, ids, calls)
+
+    for id, result in zip(ids, results):
+        resp.addData(id, result)
+    return resp.dump()
 
-actions_map = {                         \
-                 'load': load_module,   \
-                 'exec': exec_module    \
+def metrics_module(req, resp):
+    resp.addData('metrics', metrics.render())
+    return resp.dump()
+
+actions_map = {                             \
+                 'load': load_module,       \
+                 'exec': exec_module,       \
+                 'batch': batch_module,     \
+                 'metrics': metrics_module  \
               }
-ret = actions_map.get(action, default_action)(JXG.Request(action, id, data), JXG.Response(id))
 
-print_httpheader()
+def parse_form(query, body):
+    # Same semantics as cgi.FieldStorage().getfirst() for
+    # application/x-www-form-urlencoded GET and POST data
+    form = {}
+    for source in (body, query):
+        if isinstance(source, bytes):
+            source = source.decode('latin-1')
+        for key, value in urllib.parse.parse_qsl(source, keep_blank_values=True):
+            form.setdefault(key, value)
+    return form
+
+def decode_data(value):
+    # JXG.Server.callServer() uses escape() which leaves '+' untouched,
+    # form decoding turns it into a blank.
+    return base64.b64decode(value.replace(' ', '+'))
+
+def request_handler(req):
+    # The handler called by an exec request, None if there is none
+    try:
+        return registry.handler(req.getValue('module'), req.getValue('handler'))
+    except (KeyError, TypeError, RegistryError):
+        return None
+
+def result_key(h, req, accept):
+    # Cache key of an exec request, None if it must not be cached
+    if h is None or not h.cacheable:
+        return None
+    try:
+        params = [p for p in h.bind(req, None) if p is not None]
+    except RegistryError:
+        return None
+
+    # The cached result is encoded per request, only a streamed response
+    # looks different
+    return canonicalKey(h.module, h.name, params, 'stream' in accept)
+
+def handle(form):
+    action = form.get('action', 'empty')
+    id = form.get('id', 'none')
+    accept = set(form.get('accept', '').split(','))
+
+    labels = {'action': action if action in actions_map else 'undefined', 'module': '', 'handler': ''}
+    resp = JXG.Response(id, 'typed' in accept, 'stream' in accept)
+
+    key = None
+    hit = None
+    try:
+        with metrics.timer('decode', **labels):
+            data = decode_data(form.get('dataJSON', ''))
+            binary = decode_data(form.get('dataBin', ''))
+            req = JXG.Request(action, id, data, binary)
+            req.getValues()
+        metrics.observe('jxg_request_bytes', len(data) + len(binary), SIZE_BUCKETS, **labels)
+
+        if action == 'exec':
+            h = request_handler(req)
+            if h is not None:
+                labels['module'] = h.module
+                labels['handler'] = h.name
+            key = result_key(h, req, accept)
+
+        if key is not None:
+            hit = result_cache.get(key)
+
+        if hit is not None:
+            content = hit[0]
+            resp._data, resp._fields, resp._handler = content['data'], content['fields'], content['handler']
+            ret = resp.dump()
+        else:
+            ret = actions_map.get(action, default_action)(req, resp)
+    except Exception as e:
+        resp.error("invalid request: " + e.__str__())
+        ret = resp.dump()
+
+    metrics.inc('jxg_requests_total', **labels)
+    if resp._type == 'error':
+        metrics.inc('jxg_errors_total', **labels)
+    elif resp._stream is not None:
+        return stream_response(ret, resp, accept, labels), stream_headers(accept)
+
+    start = time.perf_counter()
+    body, headers = encode_response(ret, accept)
+    duration = time.perf_counter() - start
+    compressed = float(headers['X-JXG-Compress-Time'])
+    metrics.observe('jxg_phase_seconds', compressed, phase='compress', **labels)
+    metrics.observe('jxg_phase_seconds', max(duration - compressed, 0.0), phase='encode', **labels)
+    metrics.observe('jxg_response_bytes', len(body), SIZE_BUCKETS, **labels)
+
+    if key is not None and resp._type != 'error':
+        if hit is None:
+            content = {'data': resp._data, 'fields': resp._fields, 'handler': resp._handler}
+            result_cache.put(key, (content, len(ret)), h.ttl)
+        headers['X-JXG-Cache'] = 'miss' if hit is None else 'hit'
+    return body, headers
+
+def encode_response(ret, accept):
+    if isinstance(ret, str):
+        ret = ret.encode('utf-8')
+    return compression.encode(ret, accept)
+
+def stream_message(ret, accept):
+    # Every message of a stream is compressed on its own and preceded by
+    # a line holding its length and encoding
+    body, headers = encode_response(ret, accept)
+    return ('%d %s\n' % (len(body), headers['X-JXG-Encoding'])).encode('ascii') + body
+
+def stream_headers(accept):
+    binary = 'binary' in accept
+    return {                                                                            \
+             'Content-Type': 'application/octet-stream' if binary else 'text/plain',     \
+             'X-JXG-Transfer': 'binary' if binary else 'base64',                        \
+             'X-JXG-Stream': 'frames'                                                   \
+           }
+
+def stream_response(ret, resp, accept, labels):
+    # The response followed by a message of type 'frame' for every value
+    # of the stream, computed while the client reads the ones before. An
+    # error ends the stream with a message of type 'error'.
+    name, frames = resp._stream
+    frames = iter(frames)
+    try:
+        message = stream_message(ret, accept)
+        size = len(message)
+        yield message
+        while True:
+            try:
+                value = next(frames)
+            except StopIteration:
+                break
+            except Exception as e:
+                metrics.inc('jxg_errors_total', **labels)
+                resp.error("error in stream \"" + name + "\": " + e.__str__())
+                message = stream_message(resp.dump(), accept)
+                size += len(message)
+                yield message
+                break
+            message = stream_message(resp.dumpFrame(value), accept)
+            size += len(message)
+            yield message
+        metrics.observe('jxg_response_bytes', size, SIZE_BUCKETS, **labels)
+    finally:
+        # Also when the client went away, frees what the frames hold
+        if hasattr(frames, 'close'):
+            frames.close()
+
+def cache_gauges():
+    stats = result_cache.stats()
+    return [                                                                            \
+             ('jxg_cache_hits_total', 'counter', {}, stats['hits']),                    \
+             ('jxg_cache_disk_hits_total', 'counter', {}, stats['diskHits']),           \
+             ('jxg_cache_misses_total', 'counter', {}, stats['misses']),                \
+             ('jxg_cache_entries', 'gauge', {}, stats['entries']),                      \
+             ('jxg_cache_bytes', 'gauge', {}, stats['bytes'])                           \
+           ]
+
+metrics.addGauges(cache_gauges)
+
+def admission_gauges():
+    gauges = []
+    for plugin in registry.plugins():
+        if plugin.limiter.concurrency is None:
+            continue
+        labels = {'module': plugin.name}
+        gauges.append(('jxg_queue_depth', 'gauge', labels, plugin.limiter.waiting))
+        gauges.append(('jxg_running', 'gauge', labels, plugin.limiter.running))
+    return gauges
+
+metrics.addGauges(admission_gauges)
+
+############################
+#
+# Long-lived server
+#
+############################
+
+async def read_request(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    method, target, version = line.decode('latin-1').split()
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY:
+        raise ValueError("request body too large")
+    body = await reader.readexactly(length) if length > 0 else b''
+    return method, target, version, headers, body
+
+def write_response(writer, status, body, keep_alive, headers=None):
+    # body None starts a chunked response, see write_stream()
+    headers = headers or {}
+    head = 'HTTP/1.1 %s\r\n' % status
+    head += 'Content-Type: %s\r\n' % headers.get('Content-Type', 'text/plain')
+    if body is None:
+        head += 'Transfer-Encoding: chunked\r\n'
+        body = b''
+    else:
+        head += 'Content-Length: %d\r\n' % len(body)
+    for name in headers:
+        if name != 'Content-Type':
+            head += '%s: %s\r\n' % (name, headers[name])
+    head += 'Access-Control-Allow-Origin: *\r\n'
+    head += 'Access-Control-Expose-Headers: %s\r\n' % ', '.join(h for h in headers if h.startswith('X-JXG-'))
+    head += 'Connection: %s\r\n\r\n' % ('keep-alive' if keep_alive else 'close')
+    writer.write(head.encode('latin-1') + body)
+
+async def write_stream(writer, chunks):
+    # The chunks are computed in the request threads, each one is sent
+    # as soon as it's there
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            chunk = await loop.run_in_executor(request_pool, next, chunks, None)
+            if chunk is None:
+                break
+            writer.write(b'%x\r\n' % len(chunk) + chunk + b'\r\n')
+            await writer.drain()
+        writer.write(b'0\r\n\r\n')
+    finally:
+        # Stops computing the frames if the client went away
+        chunks.close()
+
+async def handle_connection(reader, writer):
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                request = await read_request(reader)
+            except (ValueError, asyncio.LimitOverrunError):
+                write_response(writer, '400 Bad Request', b'', False)
+                break
+            if request is None:
+                break
+
+            method, target, version, headers, body = request
+            keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+            path, _, query = target.partition('?')
+
+            if method not in ('GET', 'POST'):
+                write_response(writer, '405 Method Not Allowed', b'', keep_alive)
+            elif method == 'GET' and path == '/metrics':
+                write_response(writer, '200 OK', metrics.render().encode('utf-8'), keep_alive,
+                               {'Content-Type': 'text/plain; version=0.0.4'})
+            else:
+                # Plugins are plain blocking python code, keep them off the event loop
+                payload, rheaders = await loop.run_in_executor(request_pool, handle, parse_form(query, body))
+                if isinstance(payload, bytes):
+                    write_response(writer, '200 OK', payload, keep_alive, rheaders)
+                else:
+                    write_response(writer, '200 OK', None, keep_alive, rheaders)
+                    await write_stream(writer, payload)
+
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(host, port):
+    server = await asyncio.start_server(handle_connection, host, port)
+    async with server:
+        await server.serve_forever()
+
+def run_cgi():
+    # Starting a process pool for a single request doesn't pay off
+    executor.inline = True
+    length = int(os.environ.get('CONTENT_LENGTH') or 0)
+    body = sys.stdin.buffer.read(length) if length > 0 else b''
+    ret, headers = handle(parse_form(os.environ.get('QUERY_STRING', ''), body))
+
+    print_httpheader(headers)
+    sys.stdout.flush()
+    if isinstance(ret, bytes):
+        sys.stdout.buffer.write(ret)
+        return
+    for chunk in ret:
+        sys.stdout.buffer.write(chunk)
+        sys.stdout.buffer.flush()
+
+def main():
+    if 'GATEWAY_INTERFACE' in os.environ:
+        run_cgi()
+        return
+
+    parser = argparse.ArgumentParser(description='JSXGraph server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--compress-threshold', type=int, default=compression.threshold,
+                        help='responses smaller than this number of bytes are sent uncompressed to clients accepting it')
+    parser.add_argument('--fast', action='store_true', help='always use the fastest zlib level')
+    parser.add_argument('--cache-size', type=int, default=64,
+                        help='memory used by the cache of handler results in MB')
+    parser.add_argument('--cache-dir', default=None,
+                        help='directory of the on-disk cache of handler results, no disk cache if not given')
+    parser.add_argument('--cache-disk-size', type=int, default=1024,
+                        help='disk space used by the on-disk cache of handler results in MB')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='size of the process pool running cpubound handlers, defaults to the number of cpus')
+    args = parser.parse_args()
+
+    executor.workers = args.workers
+
+    global result_cache
+    result_cache = Cache(args.cache_size * 1024 * 1024, args.cache_dir, args.cache_disk_size * 1024 * 1024,
+                         sizeof=lambda entry: entry[1])
+
+    compression.threshold = args.compress_threshold
+    compression.fast = args.fast
 
-print(base64.b64encode(zlib.compress(ret, 9)))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    asyncio.run(serve(args.host, args.port))
 
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,35 @@
 import JXG
 
+def handlerOptions(cpubound=False, timeout=None, cacheable=False, ttl=None):
+    '''
+    Declares how the server runs a handler. cpubound handlers run in the
+    server's process pool and are killed if they don't finish within
+    timeout seconds. The responses of cacheable handlers are cached for
+    ttl seconds (or until evicted if ttl is None), keyed by the handler's
+    arguments. Only handlers whose result depends on nothing but their
+    arguments may be cacheable.
+    '''
+    def decorate(method):
+        method.jxgOptions = {                                   \
+                              'cpubound'  : cpubound,           \
+                              'timeout'   : timeout,            \
+                              'cacheable' : cacheable,          \
+                              'ttl'       : ttl                 \
+                            }
+        return method
+    return decorate
+
 class JXGServerModule(object):
 
+    # Admission control: at most maxConcurrency calls of the module's
+    # handlers run at once (None for no limit), up to queueDepth more wait
+    # at most queueTimeout seconds for a free slot. All others are refused
+    # with a "busy, retry" error. Plugins override these in their class or
+    # their __init__.
+    maxConcurrency = None
+    queueDepth = 0
+    queueTimeout = 10.0
+
     def __init__(self):
         self.isJXGServerModule = True
 
@@ -1,4 +1,4 @@
-from JXGServerModule import JXGServerModule
+from JXGServerModule import JXGServerModule, handlerOptions
 from rpy import r
 import JXG
 import io, gzip
@@ -17,26 +17,31 @@ class RStats(JXGServerModule):
         resp.addHandler(self.all, 'function(data) { }')
         return
 
+    @handlerOptions(cacheable=True)
     def mean(self, resp, x):
         y = r.mean(x);
         resp.addData('mean', y)
         return
 
+    @handlerOptions(cacheable=True)
     def sd(self, resp, x):
         y = r.sd(x);
         resp.addData('sd', y)
         return
 
+    @handlerOptions(cacheable=True)
     def median(self, resp, x):
         y = r.median(x);
         resp.addData('median', y)
         return
 
+    @handlerOptions(cacheable=True)
     def mad(self, resp, x):
         y = r.mad(x);
         resp.addData('mad', y)
         return
 
+    @handlerOptions(cacheable=True)
     def all(self, resp, x):
         self.mean(resp, x)
         self.sd(resp, x)
@@ -1,4 +1,4 @@
-from JXGServerModule import JXGServerModule
+from JXGServerModule import JXGServerModule, handlerOptions
 import JXG
 import urllib.request, urllib.error, urllib.parse, http.client, io, gzip
 import datetime, math, random
@@ -46,6 +46,7 @@ class YahooFinance(JXGServerModule):
         resp.addData('price', datalist[1])
         return
 
+    @handlerOptions(cacheable=True, ttl=60)
     def getMinMax(self, resp, share):
         data = self._getData(share)
         datalist = data.split(',')
@@ -68,6 +69,7 @@ class YahooFinance(JXGServerModule):
         resp.addData('price', price)
         return
 
+    @handlerOptions(cacheable=True)
     def getFakeMinMax(self, resp, share):
         if share=='^DJI':
             smax = self.djmax
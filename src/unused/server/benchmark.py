@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+'''
+Load test of the JSXGraph server protocol.
+
+Starts JXGServer.py on a free local port (or uses --url) and replays
+requests built exactly like JXG.Server.callServer does from a number of
+concurrent clients. Reports latency percentiles, throughput and bytes on
+the wire per scenario and writes them as JSON for comparing versions.
+
+Every scenario is measured twice: cold, every request has arguments of its
+own, so cacheable handlers really compute, and warm, the requests repeat
+the arguments of the warm-up, so cacheable handlers are answered from the
+server's result cache:
+
+    python3 benchmark.py --clients 16 --requests 2000 --output before.json
+'''
+
+import argparse
+import base64
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+
+# name: (weight, module, handler, function building the handler's arguments)
+SCENARIOS = {                                                                                                   \
+    'calcTest'        : (4, 'jxgtestplugin', 'calcTest', lambda rnd: {'x': rnd.randint(0, 1000)}),              \
+    'fft256'          : (4, 'fft', 'fft', lambda rnd: {'x': [rnd.uniform(-1, 1) for i in range(256)]}),        \
+    'fft4096'         : (2, 'fft', 'fft', lambda rnd: {'x': [rnd.uniform(-1, 1) for i in range(4096)]}),       \
+    'fft65536'        : (1, 'fft', 'fft', lambda rnd: {'x': [rnd.uniform(-1, 1) for i in range(65536)]}),      \
+    'rstatsAll'       : (2, 'RStats', 'all', lambda rnd: {'x': [rnd.gauss(0, 1) for i in range(500)]}),        \
+    'fakeSharePrice'  : (4, 'YahooFinance', 'getFakeCurrentSharePrice', lambda rnd: {'share': rnd.choice(['^DJI', '^GDAXI'])}), \
+    'fakeMinMax'      : (2, 'YahooFinance', 'getFakeMinMax', lambda rnd: {'share': rnd.choice(['^DJI', '^GDAXI'])})  \
+}
+
+
+def percentile(values, p):
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100.0
+    f = int(k)
+    c = min(f + 1, len(values) - 1)
+    return values[f] + (values[c] - values[f]) * (k - f)
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def form_body(action, data, accept, rnd):
+    # Same encoding as JXG.Server.callServer(): escape() keeps '+' and '/'
+    id = action + str(rnd.randint(0, 4095))
+    body = 'action=' + action + '&id=' + id + '&dataJSON='
+    body += urllib.parse.quote(base64.b64encode(json.dumps(data).encode('utf-8')).decode('ascii'), safe='@*_+-./')
+    if accept:
+        body += '&accept=' + accept
+    return body.encode('ascii')
+
+
+class Client(threading.Thread):
+
+    def __init__(self, host, port, path, requests):
+        threading.Thread.__init__(self, daemon=True)
+        self.host = host
+        self.port = port
+        self.path = path
+        self.requests = requests
+        self.results = []
+
+    def run(self):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=120)
+        for name, body in self.requests:
+            start = time.perf_counter()
+            try:
+                conn.request('POST', self.path, body, {'Content-Type': 'application/x-www-form-urlencoded'})
+                r = conn.getresponse()
+                payload = r.read()
+                ok = r.status == 200 and self._ok(r, payload)
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection(self.host, self.port, timeout=120)
+                payload = b''
+                ok = False
+            self.results.append((name, time.perf_counter() - start, len(body), len(payload), ok))
+        conn.close()
+
+    def _ok(self, r, payload):
+        # Only decodes what's needed to tell errors from responses
+        if r.getheader('X-JXG-Transfer', 'base64') == 'base64':
+            payload = base64.b64decode(payload)
+        if r.getheader('X-JXG-Encoding', 'zlib') == 'zlib':
+            payload = zlib.decompress(payload)
+        if payload[:4] == b'JXGB':
+            return True
+        return json.loads(payload.decode('utf-8')).get('type') == 'response'
+
+
+def payload(name, rnd):
+    module, handler, args = SCENARIOS[name][1:]
+    return dict(args(rnd), module=module, handler=handler)
+
+def build_requests(names, count, payloads, accept, rnd):
+    # The requests repeat the payloads given per scenario, every request
+    # gets a new payload if payloads is None. A run with the same seed
+    # replays exactly the same requests.
+    weights = [SCENARIOS[n][0] for n in names]
+    requests = []
+    for i in range(count):
+        name = rnd.choices(names, weights)[0]
+        data = payload(name, rnd) if payloads is None else rnd.choice(payloads[name])
+        requests.append((name, form_body('exec', data, accept, rnd)))
+    return requests
+
+def measure(host, port, path, requests, clients):
+    # Sends the requests from concurrent clients, returns the results and
+    # the seconds it took
+    clients = [Client(host, port, path, requests[i::clients]) for i in range(clients)]
+    start = time.perf_counter()
+    for c in clients:
+        c.start()
+    for c in clients:
+        c.join()
+    return [r for c in clients for r in c.results], time.perf_counter() - start
+
+def loadable(host, port, path, names, rnd):
+    # Drops scenarios whose plugin can't be loaded, e.g. RStats without rpy
+    ok = []
+    conn = http.client.HTTPConnection(host, port, timeout=60)
+    for name in names:
+        conn.request('POST', path, form_body('load', {'module': SCENARIOS[name][1]}, '', rnd),
+                     {'Content-Type': 'application/x-www-form-urlencoded'})
+        r = conn.getresponse()
+        payload = json.loads(zlib.decompress(base64.b64decode(r.read())).decode('utf-8'))
+        if payload['type'] == 'response':
+            ok.append(name)
+        else:
+            print("skipping scenario " + name + ": " + payload['message'], file=sys.stderr)
+    conn.close()
+    return ok
+
+def summary(results, duration):
+    latencies = [r[1] for r in results]
+    return {                                                            \
+             'requests'      : len(results),                            \
+             'errors'        : sum(1 for r in results if not r[4]),     \
+             'rps'           : len(results) / duration if duration > 0 else None, \
+             'p50'           : percentile(latencies, 50),               \
+             'p90'           : percentile(latencies, 90),               \
+             'p99'           : percentile(latencies, 99),               \
+             'max'           : max(latencies) if latencies else None,   \
+             'bytesSent'     : sum(r[2] for r in results),              \
+             'bytesReceived' : sum(r[3] for r in results)               \
+           }
+
+def start_server(port, args):
+    cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'JXGServer.py'),
+           '--port', str(port)] + args
+    proc = subprocess.Popen(cmd)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("server didn't start")
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test of the JSXGraph server')
+    parser.add_argument('--url', default=None, help='URL of a running server, by default a local one is started')
+    parser.add_argument('--server-args', default='', help='extra arguments of the started JXGServer.py')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=1000, help='total number of measured requests')
+    parser.add_argument('--warmup', type=int, default=50, help='requests per scenario sent before measuring')
+    parser.add_argument('--distinct', type=int, default=16,
+                        help='number of distinct payloads per scenario repeated by the warm requests')
+    parser.add_argument('--scenarios', default=','.join(sorted(SCENARIOS)))
+    parser.add_argument('--accept', default='typed,identity,binary',
+                        help='value of the accept field, empty for the legacy protocol')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=None, help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    proc = None
+    if args.url is None:
+        port = free_port()
+        proc = start_server(port, args.server_args.split())
+        host, path = '127.0.0.1', '/JXGServer.py'
+    else:
+        url = urllib.parse.urlsplit(args.url)
+        host, port, path = url.hostname, url.port or 80, url.path or '/JXGServer.py'
+
+    try:
+        names = loadable(host, port, path, [n for n in args.scenarios.split(',') if n in SCENARIOS], rnd)
+        if len(names) == 0:
+            print("no scenario left", file=sys.stderr)
+            return 1
+
+        # The warm-up sends every payload of the warm requests at least
+        # once, so they are all in the cache
+        payloads = dict((name, [payload(name, rnd) for i in range(args.distinct)]) for name in names)
+        warmup = [(name, form_body('exec', data, args.accept, rnd)) for name in names for data in payloads[name]]
+        warmup += build_requests(names, max(args.warmup * len(names) - len(warmup), 0), payloads, args.accept, rnd)
+        Client(host, port, path, warmup).run()
+
+        cold = measure(host, port, path, build_requests(names, args.requests, None, args.accept, rnd), args.clients)
+        warm = measure(host, port, path, build_requests(names, args.requests, payloads, args.accept, rnd), args.clients)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    report = {                                                          \
+               'timestamp' : time.strftime('%Y-%m-%dT%H:%M:%S'),        \
+               'python'    : platform.python_version(),                 \
+               'settings'  : vars(args)                                 \
+             }
+    for phase, (results, duration) in (('cold', cold), ('warm', warm)):
+        report[phase] = {                                               \
+                          'duration'  : duration,                       \
+                          'total'     : summary(results, duration),     \
+                          'scenarios' : {}                              \
+                        }
+        for name in names:
+            report[phase]['scenarios'][name] = summary([r for r in results if r[0] == name], duration)
+
+    for phase, title in (('cold', 'cold, distinct arguments'), ('warm', 'warm, repeated arguments')):
+        print(title)
+        print('%-16s %8s %7s %9s %9s %9s %9s %12s %12s' % ('scenario', 'requests', 'errors', 'rps', 'p50 ms', 'p90 ms', 'p99 ms', 'sent', 'received'))
+        for name, s in sorted(report[phase]['scenarios'].items()) + [('total', report[phase]['total'])]:
+            if s['requests'] == 0:
+                continue
+            print('%-16s %8d %7d %9.1f %9.2f %9.2f %9.2f %12d %12d' % (name, s['requests'], s['errors'], s['rps'],
+                  s['p50'] * 1000, s['p90'] * 1000, s['p99'] * 1000, s['bytesSent'], s['bytesReceived']))
+        print()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
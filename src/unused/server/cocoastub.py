@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+'''
+Stand-in for CoCoA speaking the protocol of the JSXGraph scripts, for
+running geoloci.py and the CoCoA session pool without CoCoA:
+
+    JXG_COCOA=/path/to/cocoastub.py python3 JXGServer.py
+
+Every script is answered when its "resultsend" line arrives. The results
+are the generators of the ideal not containing eliminated variables, or
+the unit circle. COCOA_STUB_DELAY delays each answer by some seconds,
+COCOA_STUB_CRASH makes the stub exit when the script contains the text.
+'''
+
+import os
+import re
+import sys
+import time
+
+def answer(script):
+    m = re.search(r'Ideal\((.*?)\);', script, re.S)
+    gens = [g.strip() for g in m.group(1).split(',')] if m else []
+    gens = [g for g in gens if g and 'u[' not in g]
+    if len(gens) == 0:
+        gens = ['x^2 + y^2 - 1']
+    return 'resultsbegin\n-------------------------------\n' + '\n'.join(gens) + '\n-------------------------------\nresultsend\n'
+
+def main():
+    delay = float(os.environ.get('COCOA_STUB_DELAY', 0))
+    crash = os.environ.get('COCOA_STUB_CRASH')
+    script = ''
+    for line in sys.stdin:
+        script += line
+        if '"resultsend"' not in line:
+            continue
+        if crash and crash in script:
+            return 1
+        time.sleep(delay)
+        sys.stdout.write(answer(script))
+        sys.stdout.flush()
+        script = ''
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
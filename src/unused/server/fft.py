@@ -1,8 +1,10 @@
-from JXGServerModule import JXGServerModule
+from JXGServerModule import JXGServerModule, handlerOptions
+from JXGCache import LRUCache, canonicalKey
+from JXGMetrics import metrics, HELP
 import numpy
 import numpy.fft
 import wave, struct, uuid
-import os, subprocess
+import os, subprocess, mmap, threading
 import io, gzip, base64
 import datetime, math, random
 
@@ -15,9 +17,216 @@ import datetime, math, random
 #import matplotlib
 #import matplotlib.pyplot as plt
 
+HELP['jxg_audio_cache_total'] = 'Lookups of decoded recordings and their spectra in the cache of fft'
+
+def bandGain(n, bands):
+    '''
+    Gains of the n coefficients of a spectrum for the list of bands
+    (s, e, factor): the coefficients outside of [s, e) are multiplied by
+    factor, several bands multiply.
+    '''
+    gain = numpy.ones(n)
+    for s, e, factor in bands:
+        gain[:max(int(s), 0)] *= factor
+        gain[max(int(e), 0):] *= factor
+    return gain
+
+def readWav(fname):
+    '''
+    The samples of the 16 bit PCM wav file fname as int16 array mapped
+    from the file, the channels interleaved, together with the sample rate
+    and the number of channels.
+    '''
+    with open(fname, 'rb') as f:
+        # The mapping stays valid after closing the file, it's unmapped
+        # together with the last array using it
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mm[0:4] != b'RIFF' or mm[8:12] != b'WAVE':
+        raise ValueError("not a wav file: " + os.path.basename(fname))
+
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(mm):
+        chunk = mm[pos:pos + 4]
+        size = struct.unpack_from('<I', mm, pos + 4)[0]
+        pos += 8
+        if chunk == b'fmt ':
+            fmt = struct.unpack_from('<HHIIHH', mm, pos)
+        elif chunk == b'data':
+            if fmt is None:
+                break
+            # 0xFFFE is WAVE_FORMAT_EXTENSIBLE, e.g. written by sox
+            tag, channels, rate, byterate, align, bits = fmt
+            if tag not in (1, 0xFFFE) or bits != 16:
+                raise ValueError("only 16 bit PCM wav files are supported: " + os.path.basename(fname))
+            count = min(size, len(mm) - pos) // 2
+            return numpy.frombuffer(mm, dtype='<i2', count=count, offset=pos), rate, channels
+        # Chunks are padded to an even size
+        pos += size + (size & 1)
+    raise ValueError("no audio data in wav file: " + os.path.basename(fname))
+
+# Window functions of the spectrogram
+WINDOWS = {                                 \
+            'hann'     : numpy.hanning,     \
+            'hamming'  : numpy.hamming,     \
+            'blackman' : numpy.blackman,    \
+            'rect'     : numpy.ones         \
+          }
+
+def monoBlocks(data, nchannels, size):
+    '''
+    Generates the int16 samples data with nchannels interleaved channels as
+    float blocks of size samples, the channels averaged. Only one block at
+    a time is decoded.
+    '''
+    end = len(data) - len(data) % nchannels
+    for start in range(0, end, size * nchannels):
+        block = data[start:min(start + size * nchannels, end)]
+        if nchannels > 1:
+            block = block.reshape(-1, nchannels).mean(axis=1)
+        yield block / 8192.
+
+def windows(blocks, size, hop):
+    '''
+    Generates the windows of size samples starting every hop samples in the
+    stream of blocks, as 2d arrays holding the windows completed by a block.
+    '''
+    rest = numpy.zeros(0)
+    for block in blocks:
+        buf = numpy.concatenate((rest, block))
+        count = (len(buf) - size) // hop + 1 if len(buf) >= size else 0
+        if count > 0:
+            yield numpy.lib.stride_tricks.sliding_window_view(buf, size)[::hop]
+        rest = buf[count * hop:]
+
+def spectra(windows, window, nfft):
+    '''
+    Generates the magnitudes of the spectra of the windows, each row has
+    nfft // 2 + 1 coefficients.
+    '''
+    for w in windows:
+        yield numpy.abs(numpy.fft.rfft(w * window, nfft)).astype(numpy.float32)
+
+class Pyramid(object):
+    '''
+    Minima and maxima of the int16 samples data over blocks of 1, 8, 64,
+    ... frames, the channels combined. Level 0 of a mono recording is the
+    data itself.
+    '''
+
+    FACTOR = 8
+
+    def __init__(self, data, nchannels):
+        self.frames = len(data) // nchannels
+        data = data[:self.frames * nchannels]
+        if nchannels > 1:
+            data = data.reshape(-1, nchannels)
+            level = (data.min(axis=1), data.max(axis=1))
+        else:
+            level = (data, data)
+
+        self.blocks = [1]
+        self.levels = [level]
+        while len(level[0]) > 1024:
+            mins, maxs = level
+            n = len(mins) // self.FACTOR * self.FACTOR
+            # The incomplete block at the end is a block of its own
+            level = (numpy.append(mins[:n].reshape(-1, self.FACTOR).min(axis=1), mins[n:].min(initial=32767)),
+                     numpy.append(maxs[:n].reshape(-1, self.FACTOR).max(axis=1), maxs[n:].max(initial=-32768)))
+            if n == len(mins):
+                level = (level[0][:-1], level[1][:-1])
+            self.blocks.append(self.blocks[-1] * self.FACTOR)
+            self.levels.append(level)
+        self.nbytes = sum(mins.nbytes + maxs.nbytes for mins, maxs in self.levels)
+
+    def envelope(self, start, end, width):
+        '''
+        Minima and maxima of the frames start to end in width buckets, at
+        most one bucket per frame, and the range actually covered.
+        '''
+        start = max(0, start)
+        end = min(self.frames, end)
+        width = min(max(int(width), 1), end - start)
+        if width <= 0:
+            empty = numpy.zeros(0, dtype=numpy.int16)
+            return empty, empty, start, start
+
+        # The coarsest level with blocks not longer than a bucket, the
+        # buckets start at the blocks containing their first frame
+        perBucket = (end - start) / width
+        k = max(k for k, b in enumerate(self.blocks) if b <= perBucket)
+        mins, maxs = self.levels[k]
+        block = self.blocks[k]
+        edges = start + (end - start) * numpy.arange(width, dtype=numpy.int64) // width
+        last = -(-end // block)
+        return numpy.minimum.reduceat(mins[:last], edges // block), numpy.maximum.reduceat(maxs[:last], edges // block), start, end
+
+class _FilterSession(object):
+
+    def __init__(self, spectrum, length, samplerate):
+        self.spectrum = spectrum
+        self.length = length
+        self.samplerate = samplerate
+        # The output as the client has it after the last update, the
+        # baseline of the deltas
+        self.output = None
+        self.lock = threading.Lock()
+
+    def nbytes(self):
+        return self.spectrum.nbytes + 8 * self.length
+
 class FFT(JXGServerModule):
 
     def __init__(self):
+
+        ############################
+        #
+        # Config lines
+        #
+        ############################
+
+        # Directory of the recordings, name.wav and name.ogg
+        self.audio_dir = os.environ.get('JXG_AUDIO_DIR', '/share8/home/michael/www-store/audio/')
+
+        # Memory for decoded recordings and their spectra, the least
+        # recently used ones are dropped first
+        self.audio_cache_size = 256 * 1024 * 1024
+
+        # Memory for the spectra of open filter sessions and the seconds an
+        # unused session is kept
+        self.session_cache_size = 256 * 1024 * 1024
+        self.session_ttl = 30 * 60
+
+        # Samples of a filter session's output changing less than this are
+        # considered unchanged by updates returning the delta, that's half
+        # the resolution of the 16 bit recordings
+        self.delta_tolerance = 0.5 / 8192
+
+        # Rows of the spectrogram per message, the file is read in blocks
+        # of that many hops
+        self.spectrogram_rows = 256
+        # Largest window and FFT size of the spectrogram
+        self.spectrogram_max_size = 65536
+
+        # Number of oggenc processes encoding at once, the seconds each may
+        # take and the memory for encoded audio, keyed by the samples
+        self.encoder_processes = 2
+        self.encoder_timeout = 30
+        self.encoded_cache_size = 64 * 1024 * 1024
+
+        # Calls beyond these limits are refused as busy, see JXGServerModule
+        self.maxConcurrency = 16
+        self.queueDepth = 64
+
+        ############################
+
+        # Keyed by the kind of entry, the file and its mtime and size, so a
+        # changed file is read again
+        self.recordings = LRUCache(self.audio_cache_size, sizeof=lambda entry: entry[0].nbytes)
+        self._stamps = {}
+        self.sessions = LRUCache(self.session_cache_size, sizeof=lambda session: session.nbytes())
+        self.encoders = threading.BoundedSemaphore(self.encoder_processes)
+        self.encoded = LRUCache(self.encoded_cache_size)
         JXGServerModule.__init__(self)
 
     def init(self, resp):
@@ -27,46 +236,70 @@ class FFT(JXGServerModule):
         resp.addHandler(self.makeAudio, 'function(data) { }')
         resp.addHandler(self.loadAudio, 'function(data) { }')
         resp.addHandler(self.sampleifft, 'function(data) { }')
+        resp.addHandler(self.openFilter, 'function(data) { }')
+        resp.addHandler(self.updateFilter, 'function(data) { }')
+        resp.addHandler(self.closeFilter, 'function(data) { }')
+        resp.addHandler(self.spectrogram, 'function(data) { }')
+        resp.addHandler(self.waveform, 'function(data) { }')
         return
 
+    @handlerOptions(cpubound=True, timeout=30, cacheable=True)
     def fft(self, resp, x):
-        y = numpy.fft.rfft(x)
-        y = list(map(abs, y));
+        y = numpy.abs(numpy.fft.rfft(x))
         resp.addData('y', y)
         return
 
     def _real(self, val):
         return val.real
 
+    @handlerOptions(cpubound=True, timeout=30, cacheable=True)
     def ifft(self, resp, x):
         y = numpy.fft.irfft(x)
-        y = list(map(self._real, y));
         resp.addData('y', y)
         return
 
     def _set0(val):
         return 0
 
+    def _recording(self, name, kind):
+        # (array, sample rate, number of channels) of the recording name,
+        # kind 'samples' are the samples as floats, 'spectrum' their rfft,
+        # 'pyramid' their Pyramid
+        fname = os.path.join(self.audio_dir, os.path.basename(name) + '.wav')
+        st = os.stat(fname)
+        stamp = (st.st_mtime_ns, st.st_size)
+        old = self._stamps.get(fname, stamp)
+        if old != stamp:
+            # The file changed, the entries of the old one are useless
+            for k in ('samples', 'spectrum', 'pyramid'):
+                self.recordings.remove((k, fname) + old)
+        self._stamps[fname] = stamp
+        key = (kind, fname) + stamp
+        entry = self.recordings.get(key)
+        if entry is not None:
+            metrics.inc('jxg_audio_cache_total', kind=kind, result='hit')
+            return entry
+        metrics.inc('jxg_audio_cache_total', kind=kind, result='miss')
+
+        if kind == 'pyramid':
+            data, framerate, nchannels = readWav(fname)
+            entry = (Pyramid(data, nchannels), framerate, nchannels)
+        elif kind == 'spectrum':
+            samples, framerate, nchannels = self._recording(name, 'samples')
+            entry = (numpy.fft.rfft(samples), framerate, nchannels)
+        else:
+            data, framerate, nchannels = readWav(fname)
+            entry = (data / 8192., framerate, nchannels)
+        self.recordings.put(key, entry)
+        return entry
+
     def sampleifft(self, resp, name, s, e, factor):
-        # read wav
-        pathtowavefiles = '/share8/home/michael/www-store/audio/'
-        fname = pathtowavefiles + os.path.basename(name) + '.wav'
-        w = wave.open(fname, 'r')
-        (nchannels, sampwidth, framerate, nframes, comptype, compname) = w.getparams()
-        frames = w.readframes(nframes*nchannels)
-        out = [value/8192. for value in struct.unpack_from("%dh" % nframes * nchannels, frames)]
-        w.close()
-        # apply fft
-        x = numpy.fft.rfft(out)
+        # The spectrum of the recording is computed once
+        x, framerate, nchannels = self._recording(name, 'spectrum')
         # filters
-        l = len(x)
-        for i in range(0, s):
-            x[i] = x[i] * factor
-        for i in range(e, l):
-            x[i] = x[i] * factor
+        x = x * bandGain(len(x), [(s, e, factor)])
         #ifft
         y = numpy.fft.irfft(x)
-        y = list(map(self._real, y));
         resp.addData('y', y)
         self.makeAudio(resp, 'ogg', framerate, y)
         return
@@ -74,57 +307,187 @@ class FFT(JXGServerModule):
     # s: 0 < Start < len(x)/2
     # e: 0 < End < len(x)/2
     def cutoutrange(self, resp, x, s, e, factor):
-        l = len(x)
-        for i in range(0, s):
-            x[i] = x[i] * factor
-        for i in range(e, l):
-            x[i] = x[i] * factor
-        resp.addData('y', x)
+        x = numpy.asarray(x)
+        resp.addData('y', x * bandGain(len(x), [(s, e, factor)]))
+        return
+
+    # Interactive filtering: openFilter keeps the spectrum of the signal x
+    # or the recording name on the server and returns a handle, every
+    # updateFilter only sends the bands. Sessions live in the server
+    # process, they are gone after session_ttl seconds without an update.
+    def openFilter(self, resp, name=None, x=None, samplerate=None):
+        if name is not None:
+            spectrum, samplerate, nchannels = self._recording(name, 'spectrum')
+            length = len(self._recording(name, 'samples')[0])
+        elif x is not None:
+            x = numpy.asarray(x, dtype=float)
+            spectrum = numpy.fft.rfft(x)
+            length = len(x)
+        else:
+            resp.error("openFilter needs the name of a recording or a signal x")
+            return
+
+        session = _FilterSession(spectrum, length, samplerate)
+        handle = uuid.uuid4().hex
+        self.sessions.put(handle, session, self.session_ttl)
+        resp.addData('session', handle)
+        resp.addData('length', length)
+        resp.addData('coefficients', len(spectrum))
+        return
+
+    # bands is (s, e, factor) or a list of them, see bandGain(). With delta
+    # set only the samples which changed since the last update are sent,
+    # their positions in 'index' and their values in 'y'.
+    def updateFilter(self, resp, session, bands, delta=False, audio=False):
+        handle = session
+        session = self.sessions.get(handle)
+        if session is None:
+            resp.error("filter session \"" + str(handle) + "\" is unknown or expired")
+            return
+
+        if len(bands) == 3 and not isinstance(bands[0], (list, tuple)):
+            bands = [bands]
+        try:
+            gain = bandGain(len(session.spectrum), bands)
+        except (TypeError, ValueError):
+            resp.error("bands have to be (start, end, factor) or a list of them")
+            return
+
+        y = numpy.fft.irfft(session.spectrum * gain, session.length)
+        index = None
+        with session.lock:
+            # session.output is the signal as the client has it, a delta
+            # only updates the samples it sends
+            if delta and session.output is not None:
+                index = numpy.flatnonzero(numpy.abs(y - session.output) > self.delta_tolerance)
+                # An index costs about as much as a sample
+                if 2 * len(index) < len(y):
+                    session.output[index] = y[index]
+                else:
+                    index = None
+            if index is None:
+                session.output = y.copy()
+        self.sessions.put(handle, session, self.session_ttl)
+        if audio and session.samplerate is not None:
+            self.makeAudio(resp, 'ogg', session.samplerate, y)
+
+        if index is not None:
+            resp.addData('delta', True)
+            resp.addData('index', index.astype(numpy.int32))
+            resp.addData('y', y[index])
+        else:
+            resp.addData('delta', False)
+            resp.addData('y', y)
         return
 
-    def loadAudio(self, resp, type, name):
-        pathtowavefiles = '/share8/home/michael/www-store/audio/'
-        fname = pathtowavefiles + os.path.basename(name) + '.wav'
-        fogg = pathtowavefiles + os.path.basename(name) + '.ogg'
+    def closeFilter(self, resp, session):
+        self.sessions.remove(session)
+        return
+
+    def loadAudio(self, resp, type, name, width=None):
+        fogg = os.path.join(self.audio_dir, os.path.basename(name) + '.ogg')
         # read ogg
-        f = open(fogg, 'r')
-        audio = f.read()
-        audio = "data:audio/ogg;base64," + base64.b64encode(audio)
+        with open(fogg, 'rb') as f:
+            audio = f.read()
+        audio = "data:audio/ogg;base64," + base64.b64encode(audio).decode('ascii')
         resp.addData('audioB64', audio)
+        # With the width of the board in pixels only the envelope is sent
+        if width is not None:
+            self.waveform(resp, name, width)
+            return
         # read wav
-        w = wave.open(fname, 'r')
-        (nchannels, sampwidth, framerate, nframes, comptype, compname) = w.getparams()
-        frames = w.readframes(nframes*nchannels)
-        out = [value/8192. for value in struct.unpack_from("%dh" % nframes * nchannels, frames)]
-        w.close()
-        step = math.floor(len(out)/7500);
-        #resp.addData('audioData',  [out[i] for i in range(len(out)) if i % step == 0]);
+        out, framerate, nchannels = self._recording(name, 'samples')
+        nframes = len(out) // nchannels
         resp.addData('audioData',  out);
         resp.addData('seconds', (nframes*1.0)/framerate)
         resp.addData('samplerate', framerate)
         return
 
+    # Minima and maxima of the recording name between start and end seconds
+    # in width buckets, e.g. one per pixel, in 'min' and 'max'. Zoomed in
+    # far enough, every frame gets a bucket of its own. 'start' and 'end'
+    # are the seconds covered.
+    def waveform(self, resp, name, width, start=0, end=None):
+        pyramid, framerate, nchannels = self._recording(name, 'pyramid')
+        s = int(math.floor(start * framerate))
+        e = pyramid.frames if end is None else int(math.ceil(end * framerate))
+        mins, maxs, s, e = pyramid.envelope(s, e, width)
+
+        resp.addData('min', (mins / 8192.).astype(numpy.float32))
+        resp.addData('max', (maxs / 8192.).astype(numpy.float32))
+        resp.addData('start', (s*1.0)/framerate)
+        resp.addData('end', (e*1.0)/framerate)
+        resp.addData('seconds', (pyramid.frames*1.0)/framerate)
+        resp.addData('samplerate', framerate)
+        return
+
+    # Short-time Fourier transform of the recording name, windows of size
+    # samples every hop samples, zero padded to nfft. The magnitudes are sent
+    # in 'frames', blocks of rows streamed to clients accepting streams.
+    # The recording is read block by block, the memory used doesn't depend
+    # on its length.
+    def spectrogram(self, resp, name, size=1024, hop=256, nfft=None, window='hann'):
+        try:
+            size, hop = int(size), int(hop)
+            nfft = int(nfft) if nfft else size
+        except (TypeError, ValueError, OverflowError):
+            resp.error("size, hop and nfft of a spectrogram have to be integers")
+            return
+        if not (0 < size <= nfft <= self.spectrogram_max_size) or hop <= 0:
+            resp.error("spectrogram needs 0 < size <= nfft <= %d and hop > 0" % self.spectrogram_max_size)
+            return
+        if window not in WINDOWS:
+            resp.error("unknown window \"" + str(window) + "\", use one of " + ", ".join(sorted(WINDOWS)))
+            return
+
+        fname = os.path.join(self.audio_dir, os.path.basename(name) + '.wav')
+        data, framerate, nchannels = readWav(fname)
+        nframes = len(data) // nchannels
+
+        resp.addData('samplerate', framerate)
+        resp.addData('seconds', (nframes*1.0)/framerate)
+        resp.addData('rows', (nframes - size) // hop + 1 if nframes >= size else 0)
+        resp.addData('frequencies', nfft // 2 + 1)
+        resp.addData('hop', hop)
+
+        rows = windows(monoBlocks(data, nchannels, hop * self.spectrogram_rows), size, hop)
+        resp.addStream('frames', spectra(rows, WINDOWS[window](size), nfft))
+        return
+
     def makeAudio(self, resp, type, samplerate, data):
-        fname = '/tmp/'+str(uuid.uuid4())
-        fogg = fname + '.ogg'
-        w = wave.open(fname, 'w')
-        w.setnchannels(1)
-        w.setsampwidth(2)
-        w.setframerate(samplerate)
-        w.setnframes(len(data))
-        for s in data:
-            if s < -4:
-                s = -4
-            if s > 4:
-                s = 4
-            w.writeframes(struct.pack('h', int(s*4000)))
-        w.close()
-        ogg_process = subprocess.Popen(["oggenc", fname, "-Q", "-o", fogg], stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.PIPE, shell=False)
-        output = ogg_process.communicate('')[0]
-        f = open(fogg, 'r')
-        audio = f.read()
-        audio = "data:audio/ogg;base64," + base64.b64encode(audio)
+        # Clipped to [-4, 4] and scaled to 16 bit in one go
+        pcm = (numpy.clip(numpy.asarray(data, dtype=float), -4, 4) * 4000).astype('<i2')
+
+        key = canonicalKey('ogg', int(samplerate), pcm)
+        audio = self.encoded.get(key)
+        if audio is None:
+            w = io.BytesIO()
+            with wave.open(w, 'wb') as f:
+                f.setnchannels(1)
+                f.setsampwidth(2)
+                f.setframerate(samplerate)
+                f.writeframes(pcm.tobytes())
+
+            # The wav is piped into oggenc, the ogg read from its output,
+            # at most encoder_processes of them run at once
+            with self.encoders:
+                try:
+                    ogg_process = subprocess.Popen(["oggenc", "-Q", "-"], stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.PIPE, shell=False)
+                except OSError as e:
+                    resp.error("can't start oggenc: " + e.__str__())
+                    return
+                try:
+                    output, errors = ogg_process.communicate(w.getvalue(), self.encoder_timeout)
+                except subprocess.TimeoutExpired:
+                    ogg_process.kill()
+                    ogg_process.communicate()
+                    resp.error("oggenc didn't finish within %s seconds" % self.encoder_timeout)
+                    return
+            if ogg_process.returncode != 0:
+                resp.error("oggenc failed: " + errors.decode('utf-8', 'replace'))
+                return
+
+            audio = "data:audio/ogg;base64," + base64.b64encode(output).decode('ascii')
+            self.encoded.put(key, audio)
         resp.addData('audioB64', audio)
-        os.remove(fname)
-        os.remove(fogg)
         return
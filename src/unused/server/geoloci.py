@@ -1,29 +1,21 @@
-from JXGServerModule import JXGServerModule
+from JXGServerModule import JXGServerModule, handlerOptions
+from JXGCoCoA import SessionPool, CoCoAError, CoCoATimeout, eliminationKey, polynomials as cocoaPolynomials
+from JXGCache import Cache, LRUCache
+from JXGContour import tileLevel, tileRange, contourTiles, joinPolylines, transform, simplify, flatten
+from JXGExecutor import executor, DeadlineExceeded, WorkerError
+from JXGPolynomial import PolynomialError, compile as compilePolynomial, parse as parsePolynomial, substitute, \
+                          toString as polyString, variables as polyVariables
+from JXGMetrics import metrics, HELP
 import JXG
 
-import numpy
+import math
 import os
-
-# Should be changed to something more persistent but must be writable by
-# the webserver (usually user www-data)
-if not 'MPLCONFIGDIR' in os.environ:
-    os.environ['MPLCONFIGDIR'] = '/tmp/'
-#    os.environ['MPLCONFIGDIR'] = 'C:/xampp/tmp'
-
-import matplotlib
-matplotlib.use('Agg')
-from matplotlib.pyplot import *
-from matplotlib.contour import *
-
-import subprocess
-import signal
-import time
 import re
-import zlib
-import base64
+import tempfile
+import time
 import io
-import cgi
-import math
+
+HELP['jxg_elimination_cache_total'] = 'Lookups of elimination results in the cache of geoloci'
 
 class JXGGeoLociModule(JXGServerModule):
 
@@ -36,16 +28,62 @@ class JXGGeoLociModule(JXGServerModule):
         ############################
 
         # Command to start cocoa
-        self.cmd_cocoa = "/share8/opt/cocoa/cocoa"
+        self.cmd_cocoa = os.environ.get('JXG_COCOA', "/share8/opt/cocoa/cocoa")
         # If you're using Windows
         #cmd_cocoa = r"C:\cocoa\cocoa.bat"
 
+        # Number of CoCoA sessions kept running between requests
+        self.cocoa_sessions = int(os.environ.get('JXG_COCOA_SESSIONS', 2))
+
+        # Elimination results are kept on disk, shared by all processes
+        # and server runs. Must be writable by the server.
+        self.elimination_cache_dir = os.environ.get('JXG_ELIMINATION_CACHE', os.path.join(tempfile.gettempdir(), 'jxg-elimination'))
+        self.elimination_cache_size = 64 * 1024 * 1024
+
+        # Curves are sampled finer until the cells are at most this many
+        # pixels of the board wide
+        self.pixel_tolerance = 1.0
+
+        # Boards are taken to be at most this many pixels wide and high
+        self.max_board_size = 4096
+
+        # Points of the curves closer than this many pixels to the line
+        # through their neighbours are left out, 0 keeps all points
+        self.simplify_tolerance = 0.5
+
+        # Memory for the curves of tiles already computed, panning and
+        # zooming only computes the tiles not seen before
+        self.tile_cache_size = 32 * 1024 * 1024
+
+        # Tiles not in the cache are computed in the process pool, in jobs
+        # of at most this many tiles of one curve
+        self.tiles_per_job = 16
+        # A viewport needing more tiles is sampled coarser
+        self.max_tiles = 1024
+        # Seconds the process pool has for computing the tiles
+        self.contour_timeout = 30
+
+        # Largest number of frames computed by a single lociSweep request
+        self.max_frames = 500
+
+        # Admission control: at most this many loci are computed at once, a
+        # burst of more requests waits (up to queueDepth of them, for at most
+        # queueTimeout seconds) or is refused as busy
+        self.maxConcurrency = 4
+        self.queueDepth = 16
+        self.queueTimeout = 10
+
         # Shouldn't be changed, except you know what you're doing
         self.debug = False
 
         ############################
 
-        self.debugOutput = io.StringIO()
+        self.cocoa = SessionPool(self.cmd_cocoa, self.cocoa_sessions)
+        try:
+            self.eliminations = Cache(1024 * 1024, self.elimination_cache_dir, self.elimination_cache_size, sizeof=lambda polys: sum(map(len, polys)))
+        except OSError:
+            self.eliminations = Cache(1024 * 1024, sizeof=lambda polys: sum(map(len, polys)))
+        self.tiles = LRUCache(self.tile_cache_size, sizeof=lambda lines: sum(pa.nbytes for pa in lines) + 64)
 
         JXGServerModule.__init__(self)
         return
@@ -53,23 +91,20 @@ class JXGGeoLociModule(JXGServerModule):
 
     def init(self, resp):
         resp.addHandler(self.lociCoCoA, 'function(data) { }')
+        resp.addHandler(self.lociSweep, 'function(data) { }')
         return
 
-    def lociCoCoA(self, resp, xs, xe, ys, ye, number, polys, sf, rot, transx, transy):
-        self.output = ''
-        self.cococa_process = None
+    def _script(self, polys, number, parameter=None):
         cinput = ""
-        c = math.cos(rot)
-        s = math.sin(rot)
-        tx = 0;
 
         # Variable code begins here
         # Here indeterminates of polynomial ring have to be adjusted
 
+        ring = "x,y" if parameter is None else parameter + ",x,y"
         if number > 0:
-            cinput += "Use R ::= QQ[u[1..%s],x,y], Xel;" % number
+            cinput += "Use R ::= QQ[u[1..%s],%s], Xel;" % (number, ring)
         else:
-            cinput += "Use R ::= QQ[x,y];"
+            cinput += "Use R ::= QQ[%s];" % ring
 
         # Of course the polynomials generating the ideal must be adjusted
         cinput += "I := Ideal(%s);" % polys
@@ -94,75 +129,165 @@ class JXGGeoLociModule(JXGServerModule):
         cinput += "EndFor;\n"
         cinput += "Print \"resultsend\", NewLine;"
         #cinput =  "Ciao;"
+        return cinput
+
+    def _eliminate(self, polys, number, parameter, debugOutput):
+        # The polynomials printed by CoCoA, None if there are none. Raises
+        # CoCoAError if CoCoA fails.
+        cinput = self._script(polys, number, parameter)
 
         if self.debug:
-            print("Starting CoCoA with input<br />", file=self.debugOutput)
-            print(cinput + '<br />', file=self.debugOutput)
+            print("Starting CoCoA with input<br />", file=debugOutput)
+            print(cinput + '<br />', file=debugOutput)
 
         # The suicide pill for the CoCoA process:
         # If not done within the following amount
-        # of seconds, the subprocess will be terminated
+        # of seconds, the session will be killed and replaced
 
         time_left = 30
 
-        class TimeoutException(Exception): pass
+        # The result only depends on the system, not on the viewport or the
+        # transformation, equal systems are recognized by their canonical form
+        key = eliminationKey(polys, number, 'Xel', () if parameter is None else (parameter,))
 
-        def time_limit(seconds):
-            def signal_handler(signum, frame):
-                raise TimeoutException("Timed out!")
-            signal.signal(signal.SIGALRM, signal_handler)
-            signal.alarm(seconds)
+        polynomials = self.eliminations.get(key)
+        if polynomials is not None:
+            metrics.inc('jxg_elimination_cache_total', result='hit')
+            return polynomials
 
-        #global cocoa_process
-        #global output
+        metrics.inc('jxg_elimination_cache_total', result='miss')
+        try:
+            output = self.cocoa.run(cinput, time_left)
+        except CoCoATimeout:
+            if self.debug:
+                print("Timed out!", file=debugOutput)
+            raise
+
+        if self.debug:
+            print("Reading and Parsing CoCoA output" + '<br />', file=debugOutput)
+            print(output + '<br />', file=debugOutput)
+
+        # Extract results
+        polynomials = cocoaPolynomials(output)
+        if polynomials is not None:
+            self.eliminations.put(key, polynomials)
+        return polynomials
+
+    def _boardSize(self, width, height):
+        # width and height of the board in pixels, positive numbers
+        width, height = float(width), float(height)
+        if not (width > 0 and height > 0):
+            raise ValueError("width and height have to be positive")
+        return width, height
+
+    def _frames(self, frames, xs, xe, ys, ye, width, height, sf, rot, transx, transy):
+        # Generates the curves of every frame, a list of (polynomial,
+        # compiled polynomial) pairs, as x and y arrays separated by NaN
+
+        # The corners of the board may come rotated, e.g. from
+        # JXG.Math.Symbolic.geometricLocusByGroebnerBase
+        xs, xe = min(xs, xe), max(xs, xe)
+        ys, ye = min(ys, ye), max(ys, ye)
+
+        # Size of a pixel in the coordinates of the polynomials
+        width = min(max(width, 1), self.max_board_size)
+        height = min(max(height, 1), self.max_board_size)
+        pixel = max(abs(xe - xs) / width, abs(ye - ys) / height)
+        if pixel <= 0:
+            # An empty viewport shows no curves
+            for curves in frames:
+                yield flatten([])
+            return
+        level = tileLevel(self.pixel_tolerance * pixel)
+        while True:
+            try:
+                tiles = list(tileRange(xs, xe, ys, ye, level, self.max_tiles))
+                break
+            except ValueError:
+                level += 1
+
+        # Tiles are looked up in the cache here, the missing ones of all
+        # curves of all frames are computed in parallel. A curve appearing
+        # in several frames is computed once, by the jobs of its first frame.
+        found = {}
+        jobs = []
+        owners = []
+        for i, curves in enumerate(frames):
+            for p, f in curves:
+                if p in found:
+                    continue
+                found[p] = {}
+                missing = []
+                for tile in tiles:
+                    tileLines = self.tiles.get((p, level) + tile)
+                    if tileLines is None:
+                        missing.append(tile)
+                    else:
+                        found[p][tile] = tileLines
+                for n in range(0, len(missing), self.tiles_per_job):
+                    jobs.append((f, level, missing[n:n + self.tiles_per_job]))
+                    owners.append((i, p))
+
+        # Merged in the order of the frames, curves and tiles, independent
+        # of the order the jobs finished in. A frame is done as soon as the
+        # jobs up to its last one are.
+        results = executor.imap(contourTiles, jobs, self.contour_timeout)
+        j = 0
+        for i, curves in enumerate(frames):
+            while j < len(jobs) and owners[j][0] == i:
+                p = owners[j][1]
+                for tile, tileLines in zip(jobs[j][2], next(results)):
+                    self.tiles.put((p, level) + tile, tileLines)
+                    found[p][tile] = tileLines
+                j += 1
+
+            lines = []
+            for p, f in curves:
+                # Neighbouring tiles share the grid points on their border, so
+                # the pieces of a curve end in exactly the same points
+                for pa in joinPolylines([pa for tile in tiles for pa in found[p][tile]]):
+                    pa = simplify(pa, self.simplify_tolerance * pixel)
+                    lines.append(transform(pa, sf, rot, transx, transy))
+
+            # The curves separated by NaN, sent as 'null' to clients not
+            # accepting typed arrays
+            yield flatten(lines)
+
+    # Runs in the server's request threads, so all requests share the CoCoA
+    # sessions and the tiles. The contouring is done in the process pool.
+    @handlerOptions(cacheable=True)
+    def lociCoCoA(self, resp, xs, xe, ys, ye, number, polys, sf, rot, transx, transy, width=500, height=500):
+        try:
+            width, height = self._boardSize(width, height)
+        except (TypeError, ValueError) as e:
+            resp.error("invalid board size: " + e.__str__())
+            return
 
-        def callCoCoA():
-            # Global variables aren't that nice, but this time they're useful
-            #global cocoa_process, output
-            self.cocoa_process = subprocess.Popen([self.cmd_cocoa], stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.PIPE, shell=False)
-            self.output = self.cocoa_process.communicate(cinput)[0]
+        debugOutput = io.StringIO()
 
         calc_time = time.time()
         try:
-            time_limit(time_left)
-            callCoCoA()
-        except TimeoutException as msg:
-            # This is only tested with linux/unix
-            # and works ONLY if the cocoa script cd-ing
-            # to the cocoa dir and starting cocoa executes
-            # it with
-            # $ exec ./cocoa_text
-            # This is NOT YET TESTED WITH WINDOWS! (though
-            # sharing tests would be nice).
-            self.cocoa_process.kill()
-            if self.debug:
-                print("Timed out!", file=self.debugOutput)
+            polynomials = self._eliminate(polys, number, None, debugOutput)
+        except CoCoATimeout:
             resp.error("Timeout, maybe the system of polynomial is too big or there's an error in it.")
             return
+        except CoCoAError as e:
+            resp.error(e.__str__())
+            return
+        if polynomials is None:
+            return
 
         calc_time = time.time() - calc_time
         resp.addData('exectime', calc_time)
 
-        if self.debug:
-            print("Reading and Parsing CoCoA output" + '<br />', file=self.debugOutput)
-            print(self.output + '<br />', file=self.debugOutput)
-
-        # Extract results
-        if re.search('resultsbegin', self.output) is None:
-            return
-        result = re.split('resultsend', re.split('resultsbegin', self.output)[1])[0]
-        result = re.split('-------------------------------', re.split('-------------------------------', result)[1])[0]
-        result = result.replace("^", "**")
-        result = result.replace("\r", "")
-        polynomials = re.split('\n', result)
+        polynomials = [p.replace("^", "**") for p in polynomials]
 
         if self.debug:
-            print("Found the following polynomials:" + '<br />', file=self.debugOutput)
+            print("Found the following polynomials:" + '<br />', file=debugOutput)
             for i in range(0,len(polynomials)):
-                print("Polynomial ", i+1, ": " + polynomials[i] + '<br />', file=self.debugOutput)
+                print("Polynomial ", i+1, ": " + polynomials[i] + '<br />', file=debugOutput)
 
-        datax = []
-        datay = []
+        curves = []
         polynomialsReturn = []
 
         for i in range(0,len(polynomials)):
@@ -171,40 +296,126 @@ class JXGGeoLociModule(JXGServerModule):
             if ((not "x" in polynomials[i]) and (not "y" in polynomials[i])) or ("W" in polynomials[i]):
                 continue
 
-            polynomialsReturn.append(polynomials[i])
-            x, y = numpy.meshgrid(numpy.linspace(xs, xe, 500), numpy.linspace(ys, ye, 500))
-
-            z = eval(polynomials[i])
-            C = contour(x, y, z, [0])
-
-            if self.debug:
-                savefig('/tmp/test%s.png' % i)
-
-            for i in range(0, len(C.collections[0].get_paths())):
-                pa = C.collections[0].get_paths()[i].to_polygons()[0]
+            # Parsed once, the compiled polynomial is cached
+            try:
+                curves.append((polynomials[i], compilePolynomial(polynomials[i])))
+            except PolynomialError:
+                continue
 
-                for i in range(0,len(pa)):
-                    tx = pa[i, 0]
-                    pa[i, 0] = c*pa[i,0] - s*pa[i,1]
-                    pa[i, 1] = s*tx + c*pa[i,1]
-                    datax.append(sf*pa[i,0] + transx)
-                    datay.append(sf*pa[i,1] + transy)
+            polynomialsReturn.append(polynomials[i])
 
-                datax.append('null')
-                datay.append('null')
+        try:
+            datax, datay = next(self._frames([curves], xs, xe, ys, ye, width, height, sf, rot, transx, transy))
+        except DeadlineExceeded:
+            resp.error("Timeout, the curves couldn't be computed within %s seconds." % self.contour_timeout)
+            return
+        except WorkerError as e:
+            resp.error(e.__str__())
+            return
 
         resp.addData('datax', datax)
         resp.addData('datay', datay)
         resp.addData('polynomial', polynomialsReturn)
 
         if self.debug:
-            print(", ".join(map(str, datax)) + '<br />', file=self.debugOutput)
-            print(", ".join(map(str, datay)) + '<br />', file=self.debugOutput)
+            print(", ".join(map(str, datax)) + '<br />', file=debugOutput)
+            print(", ".join(map(str, datay)) + '<br />', file=debugOutput)
             print("Content-Type: text/plain\n\n")
             print()
             print()
-            print(self.debugOutput.getvalue())
+            print(debugOutput.getvalue())
+
+        debugOutput.close()
+
+        return
+
+    def _sweepValues(self, values):
+        # values is a list of numbers or a range {start, end, step}
+        if isinstance(values, dict):
+            start, end, step = float(values['start']), float(values['end']), float(values['step'])
+            if step == 0 or (end - start) / step < 0:
+                raise ValueError("the range from %s to %s can't be swept in steps of %s" % (start, end, step))
+            count = int(math.floor((end - start) / step + 1e-9)) + 1
+            values = [round(start + i * step, 12) for i in range(min(count, self.max_frames + 1))]
+        else:
+            values = [float(v) for v in values]
+        if len(values) > self.max_frames:
+            raise ValueError("too many frames, at most %d are allowed" % self.max_frames)
+        return values
+
+    # The loci of a system depending on the parameter, one frame for every
+    # value of the parameter, e.g. for animations. The parameter is kept as
+    # indeterminate, so the elimination is done only once for all frames.
+    def lociSweep(self, resp, xs, xe, ys, ye, number, polys, parameter, values, sf, rot, transx, transy, width=500, height=500):
+        debugOutput = io.StringIO()
+
+        if re.match(r'^[a-z]\w*$', parameter) is None or parameter in ('x', 'y', 'u'):
+            resp.error("\"" + parameter + "\" can't be used as parameter")
+            return
+        try:
+            values = self._sweepValues(values)
+        except (KeyError, TypeError, ValueError) as e:
+            resp.error("invalid values: " + e.__str__())
+            return
+        try:
+            width, height = self._boardSize(width, height)
+        except (TypeError, ValueError) as e:
+            resp.error("invalid board size: " + e.__str__())
+            return
+
+        calc_time = time.time()
+        try:
+            polynomials = self._eliminate(polys, number, parameter, debugOutput)
+        except CoCoATimeout:
+            resp.error("Timeout, maybe the system of polynomial is too big or there's an error in it.")
+            return
+        except CoCoAError as e:
+            resp.error(e.__str__())
+            return
+        if polynomials is None:
+            return
+
+        calc_time = time.time() - calc_time
+        resp.addData('exectime', calc_time)
+
+        # Polynomials in x, y and the parameter
+        generators = []
+        polynomialsReturn = []
+        for p in polynomials:
+            try:
+                poly = parsePolynomial(p)
+            except PolynomialError:
+                continue
+            if len(polyVariables(poly) & set(('x', 'y'))) == 0:
+                continue
+            generators.append(poly)
+            polynomialsReturn.append(p)
+
+        frames = []
+        for t in values:
+            curves = []
+            for poly in generators:
+                poly = substitute(poly, {parameter: t})
+                if len(polyVariables(poly) & set(('x', 'y'))) == 0:
+                    continue
+                text = polyString(poly)
+                try:
+                    curves.append((text, compilePolynomial(text)))
+                except PolynomialError:
+                    continue
+            frames.append(curves)
+
+        resp.addData('polynomial', polynomialsReturn)
+        resp.addData('values', values)
+
+        curves = self._frames(frames, xs, xe, ys, ye, width, height, sf, rot, transx, transy)
+        try:
+            resp.addStream('frames', ({'value': t, 'datax': datax, 'datay': datay} for t, (datax, datay) in zip(values, curves)))
+        except DeadlineExceeded:
+            resp.error("Timeout, the curves couldn't be computed within %s seconds." % self.contour_timeout)
+        except WorkerError as e:
+            resp.error(e.__str__())
 
-        self.debugOutput.close()
+        debugOutput.close()
 
         return
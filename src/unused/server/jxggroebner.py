@@ -9,31 +9,25 @@ import os
 #
 ############################
 
-# Should be changed to something more persistent but must be writable by
-# the webserver
-if not 'MPLCONFIGDIR' in os.environ:
-    os.environ['MPLCONFIGDIR'] = '/tmp'
-# Example for Windows using XAMPP
-#    os.environ['MPLCONFIGDIR'] = 'C:/xampp/tmp'
-
 # Command to start cocoa
 cmd_cocoa = "cocoa"
 # If you're using Windows
 #cmd_cocoa = r"C:\cocoa\cocoa.bat"
 
+# Elimination results are kept on disk between runs, this directory must be
+# writable by the webserver
+elimination_cache_dir = os.path.join('/tmp', 'jxg-groebner')
+elimination_cache_size = 64 * 1024 * 1024
+
 # Shouldn't be changed, except you know what you're doing
 debug = False
 
 ############################
 
-import matplotlib
-matplotlib.use('Agg')
-from matplotlib.pyplot import *
-from matplotlib.contour import *
-
-import subprocess
-import signal
-import re
+from JXGCoCoA import SessionPool, CoCoAError, eliminationKey, polynomials as cocoaPolynomials
+from JXGCache import DiskCache
+from JXGContour import adaptiveContours, simplify
+from JXGPolynomial import PolynomialError, compile as compilePolynomial
 import zlib
 import base64
 import io
@@ -66,7 +60,7 @@ ye = float(form.getfirst('ye', '5'))
 
 # Clean them up
 number = int(cgi.escape(number))
-polys = base64.b64decode(cgi.escape(polys))
+polys = base64.b64decode(cgi.escape(polys)).decode('utf-8')
 
 cinput = ""
 
@@ -105,68 +99,44 @@ if debug:
     print("Starting CoCoA with input<br />", file=debugOutput)
     print(cinput + '<br />', file=debugOutput)
 
-#cocoa = subprocess.Popen([cmd_cocoa], stdout=subprocess.PIPE, stdin=subprocess.PIPE)
-
 # The suicide pill for the CoCoA process:
 # If not done within the following amount
-# of seconds, the subprocess will be terminated
+# of seconds, the session will be killed
 
 time_left = 20
 
-class TimeoutException(Exception): pass
-
-def time_limit(seconds):
-    def signal_handler(signum, frame):
-        raise TimeoutException("Timed out!")
-    signal.signal(signal.SIGALRM, signal_handler)
-    signal.alarm(seconds)
-
-cocoa_process = None
-output = ''
-
-def callCoCoA():
-    # Global variables aren't that nice, but this time is see no way out
-    global cocoa_process, output
-    cocoa_process = subprocess.Popen([cmd_cocoa], stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.PIPE, shell=False)
-    #cocoa_process.stdin.write(input)
-    output = cocoa_process.communicate(cinput)[0]
-    #cocoa_process.stdin.close()
-
-
-try:
-    time_limit(time_left)
-    callCoCoA()
-except TimeoutException as msg:
-    # This is only tested with linux/unix
-    # and works ONLY if the cocoa script cd-ing
-    # to the cocoa dir and starting cocoa executes
-    # it with
-    # $ exec ./cocoa_text
-    # This is NOT YET TESTED WITH WINDOWS! (though
-    # sharing tests would be nice).
-    cocoa_process.kill()
-    #cocoa_process.terminate()
-    #cocoa_process.send_signal(signal.SIGTERM)
-    #subprocess.Popen(["killall", "cocoa_text"])
-    #os.system('killall -9 cocoa_text')
+# The result only depends on the system, equal systems are recognized by
+# their canonical form
+key = eliminationKey(polys, number)
+eliminations = DiskCache(elimination_cache_dir, elimination_cache_size)
+polynomials = eliminations.get(key)
+
+# A CGI script lives for one request only, so the pool holds a single
+# session. Warm sessions pay off in JXGServer.py (see geoloci.py).
+if polynomials is None:
+    cocoa = SessionPool(cmd_cocoa, 1)
+    try:
+        output = cocoa.run(cinput, time_left)
+    except CoCoAError:
+        if debug:
+            print("Timed out!", file=debugOutput)
+        exit()
+    finally:
+        cocoa.close()
+
     if debug:
-        print("Timed out!", file=debugOutput)
-    exit()
+        print("Reading and Parsing CoCoA output" + '<br />', file=debugOutput)
+        print(output + '<br />', file=debugOutput)
+
+    # Extract results
+    polynomials = cocoaPolynomials(output)
+    eliminations.put(key, polynomials)
 
 #cocoa = os.popen("echo \"" + input + "\" | " + cmd_cocoa)
 
 #output = cocoa.read()
 
-if debug:
-    print("Reading and Parsing CoCoA output" + '<br />', file=debugOutput)
-    print(output + '<br />', file=debugOutput)
-
-# Extract results
-result = re.split('resultsend', re.split('resultsbegin', output)[1])[0]
-result = re.split('-------------------------------', re.split('-------------------------------', result)[1])[0]
-result = result.replace("^", "**")
-result = result.replace("\r", "")
-polynomials = re.split('\n', result)
+polynomials = [p.replace("^", "**") for p in polynomials]
 
 if debug:
     print("Found the following polynomials:" + '<br />', file=debugOutput)
@@ -182,20 +152,18 @@ for i in range(0,len(polynomials)):
     if ((not "x" in polynomials[i]) and (not "y" in polynomials[i])) or ("W" in polynomials[i]):
         continue
 
-    polynomialsReturn = polynomialsReturn + polynomials[i] + ";"
-    x, y = numpy.meshgrid(numpy.linspace(xs, xe, 200), numpy.linspace(ys, ye, 200))
-
-    z = eval(polynomials[i])
-    C = contour(x, y, z, [0])
-
-    if debug:
-        savefig('/tmp/test%s.png' % i)
+    try:
+        f = compilePolynomial(polynomials[i])
+    except PolynomialError:
+        continue
 
-    for i in range(0, len(C.collections[0].get_paths())):
-        pa = C.collections[0].get_paths()[i].to_polygons()[0]
+    polynomialsReturn = polynomialsReturn + polynomials[i] + ";"
 
-        for i in range(0,len(pa)):
-            print(pa[i,0], ",", pa[i,1], ";", file=data)
+    # Sampled as fine as a 200x200 grid, but only close to the curve
+    cell = max(abs(xe - xs), abs(ye - ys)) / 200
+    for pa in adaptiveContours(f, xs, xe, ys, ye, cell):
+        pa = simplify(pa, cell / 2)
+        numpy.savetxt(data, pa, fmt='%s', delimiter=' , ', newline=' ;\n')
 
         print(";", file=data)
 
@@ -79,7 +79,9 @@ JXG.Server = {
      */
     callServer: function (action, callback, data, sync) {
         var fileurl, passdata, AJAX,// params, k,
-            id, dataJSONStr;
+            id, dataJSONStr, binary,
+            // raw binary responses are read via the x-user-defined charset
+            binaryResponse = !!(window.XMLHttpRequest && XMLHttpRequest.prototype.overrideMimeType);
 
         sync = sync || false;
 
@@ -90,7 +92,8 @@ JXG.Server = {
         //     }
         // }
 
-        dataJSONStr = Type.toJSON(data);
+        binary = { parts: [], length: 0 };
+        dataJSONStr = Type.toJSON(this._packTypedArrays(data, binary));
 
         // generate id
         do {
@@ -110,26 +113,22 @@ JXG.Server = {
             "&id=" +
             id +
             "&dataJSON=" +
-            escape(Base64.encode(dataJSONStr));
+            escape(Base64.encode(dataJSONStr)) +
+            "&accept=typed,identity" +
+            (binaryResponse ? ",binary" : "");
+        if (binary.length > 0) {
+            passdata += "&dataBin=" + encodeURIComponent(this._encodeBinary(binary));
+        }
 
-        this.cbp = function (d) {
+        this.cbp = function (d, transfer, encoding) {
             /*jslint evil:true*/
-            var str, data, tmp, inject, paramlist, id, i, j;
+            var data, tmp, inject, paramlist, id, i, j;
 
-            str = new Zip.Unzip(Base64.decodeAsArray(d)).unzip();
-            if (Type.isArray(str) && str.length > 0) {
-                str = str[0][0];
-            }
-
-            if (!Type.exists(str)) {
+            data = this._decode(d, transfer, encoding);
+            if (!Type.exists(data)) {
                 return;
             }
 
-            data =
-                window.JSON && window.JSON.parse
-                    ? window.JSON.parse(str)
-                    : new Function("return " + str)();
-
             if (data.type === 'error') {
                 this.handleError(data);
             } else if (data.type === 'response') {
@@ -215,7 +214,7 @@ JXG.Server = {
         // We are using our own XMLHttpRequest object in here because of a/sync and POST
         if (window.XMLHttpRequest) {
             AJAX = new XMLHttpRequest();
-            AJAX.overrideMimeType("text/plain; charset=iso-8859-1");
+            AJAX.overrideMimeType("text/plain; charset=" + (binaryResponse ? "x-user-defined" : "iso-8859-1"));
         } else {
             AJAX = new ActiveXObject('Microsoft.XMLHTTP');
         }
@@ -231,7 +230,11 @@ JXG.Server = {
                 AJAX.onreadystatechange = (function (cb) {
                     return function () {
                         if (AJAX.readyState === 4 && AJAX.status === 200) {
-                            cb(AJAX.responseText);
+                            cb(
+                                AJAX.responseText,
+                                AJAX.getResponseHeader('X-JXG-Transfer'),
+                                AJAX.getResponseHeader('X-JXG-Encoding')
+                            );
                             return true;
                         }
                         return false;
@@ -242,7 +245,11 @@ JXG.Server = {
             // send the data
             AJAX.send(passdata);
             if (sync) {
-                this.cb(AJAX.responseText);
+                this.cb(
+                    AJAX.responseText,
+                    AJAX.getResponseHeader('X-JXG-Transfer'),
+                    AJAX.getResponseHeader('X-JXG-Encoding')
+                );
                 return true;
             }
         }
@@ -250,6 +257,195 @@ JXG.Server = {
         return false;
     },
 
+    /**
+     * Decodes a message sent by the server.
+     * @param {String} d The message as received.
+     * @param {String} transfer Value of the header X-JXG-Transfer, 'binary' or 'base64'.
+     * @param {String} encoding Value of the header X-JXG-Encoding, 'identity' or 'zlib'.
+     * @returns {Object} The message, undefined if it can't be decoded.
+     * @private
+     */
+    _decode: function (d, transfer, encoding) {
+        /*jslint evil:true*/
+        var str, i, bytes;
+
+        // Servers not sending these headers always send base64 encoded zlib streams
+        if (transfer === 'binary') {
+            bytes = [];
+            for (i = 0; i < d.length; i++) {
+                bytes[i] = d.charCodeAt(i) & 0xff;
+            }
+        } else {
+            bytes = Base64.decodeAsArray(d);
+        }
+
+        if (encoding === 'identity') {
+            str = this._bytesToString(bytes);
+        } else {
+            str = new Zip.Unzip(bytes).unzip();
+            if (Type.isArray(str) && str.length > 0) {
+                str = str[0][0];
+            }
+        }
+
+        if (!Type.exists(str)) {
+            return;
+        }
+
+        if (str.substring(0, 4) === 'JXGB') {
+            return this._unpackTypedArrays(str);
+        }
+        return window.JSON && window.JSON.parse
+            ? window.JSON.parse(str)
+            : new Function("return " + str)();
+    },
+
+    /**
+     * Replaces typed arrays (Float64Array, Float32Array, Int32Array and Int16Array) in the data sent to the server by
+     * references into a binary block. On the server these fields are decoded directly into numpy arrays.
+     * @param {*} obj The data sent to the server.
+     * @param {Object} binary Collects the blocks of the typed arrays in <tt>parts</tt>, the total
+     * length in bytes is stored in <tt>length</tt>.
+     * @returns {*} A copy of obj with the typed arrays replaced.
+     * @private
+     */
+    _packTypedArrays: function (obj, binary) {
+        var k, type, pad, res;
+
+        if (obj instanceof Float64Array) {
+            type = 'float64';
+        } else if (obj instanceof Float32Array) {
+            type = 'float32';
+        } else if (obj instanceof Int32Array) {
+            type = 'int32';
+        } else if (obj instanceof Int16Array) {
+            type = 'int16';
+        }
+
+        if (Type.exists(type)) {
+            // The server expects little-endian data
+            if (new Uint8Array(new Uint16Array([1]).buffer)[0] !== 1) {
+                return Array.prototype.slice.call(obj);
+            }
+
+            // Align every block to 8 bytes
+            pad = (8 - (binary.length % 8)) % 8;
+            if (pad > 0) {
+                binary.parts.push(new Uint8Array(pad));
+                binary.length += pad;
+            }
+            res = { __jxgtyped__: type, offset: binary.length, shape: [obj.length] };
+            binary.parts.push(new Uint8Array(obj.buffer, obj.byteOffset, obj.byteLength));
+            binary.length += obj.byteLength;
+
+            return res;
+        }
+
+        if (Type.isArray(obj)) {
+            res = [];
+            for (k = 0; k < obj.length; k++) {
+                res[k] = this._packTypedArrays(obj[k], binary);
+            }
+            return res;
+        }
+
+        if (Type.exists(obj) && typeof obj === 'object') {
+            res = {};
+            for (k in obj) {
+                if (obj.hasOwnProperty(k)) {
+                    res[k] = this._packTypedArrays(obj[k], binary);
+                }
+            }
+            return res;
+        }
+
+        return obj;
+    },
+
+    /**
+     * Decodes a response holding typed arrays. It consists of the bytes 'JXGB', the length of the JSON header as
+     * little-endian uint32, the JSON header and the binary blocks of the arrays, each aligned to 8 bytes.
+     * In the header, the arrays are replaced by references into the binary blocks.
+     * @param {String} str The unzipped response, one character per byte.
+     * @returns {Object} The response with the references replaced by Float64Array, Float32Array, Int32Array
+     * or Int16Array objects. Multidimensional arrays are flattened, their dimensions are stored in the
+     * property <tt>shape</tt>.
+     * @private
+     */
+    _unpackTypedArrays: function (str) {
+        var i, len, start, bytes,
+            types = {
+                float64: Float64Array,
+                float32: Float32Array,
+                int32: Int32Array,
+                int16: Int16Array
+            };
+
+        len = str.charCodeAt(4) | (str.charCodeAt(5) << 8) | (str.charCodeAt(6) << 16) | (str.charCodeAt(7) << 24);
+        start = 8 + len + ((8 - ((8 + len) % 8)) % 8);
+
+        bytes = new Uint8Array(str.length - start);
+        for (i = start; i < str.length; i++) {
+            bytes[i - start] = str.charCodeAt(i) & 0xff;
+        }
+
+        return JSON.parse(str.substring(8, 8 + len), function (key, value) {
+            var k, n, arr;
+
+            if (Type.exists(value) && Type.exists(value.__jxgtyped__)) {
+                n = 1;
+                for (k = 0; k < value.shape.length; k++) {
+                    n *= value.shape[k];
+                }
+                arr = new types[value.__jxgtyped__](bytes.buffer, value.offset, n);
+                if (value.shape.length > 1) {
+                    arr.shape = value.shape;
+                }
+                return arr;
+            }
+            return value;
+        });
+    },
+
+    /**
+     * Converts an array of bytes into a string holding one character per byte.
+     * @param {Array} bytes
+     * @returns {String}
+     * @private
+     */
+    _bytesToString: function (bytes) {
+        var i,
+            chunk = 8192,
+            str = [];
+
+        for (i = 0; i < bytes.length; i += chunk) {
+            str.push(String.fromCharCode.apply(null, bytes.slice(i, i + chunk)));
+        }
+
+        return str.join("");
+    },
+
+    /**
+     * Base64 encodes the binary blocks collected by {@link JXG.Server._packTypedArrays}.
+     * @param {Object} binary
+     * @returns {String}
+     * @private
+     */
+    _encodeBinary: function (binary) {
+        var i, j, part,
+            chunk = 8192,
+            str = [];
+
+        for (i = 0; i < binary.parts.length; i++) {
+            part = binary.parts[i];
+            for (j = 0; j < part.length; j += chunk) {
+                str.push(String.fromCharCode.apply(null, part.subarray(j, j + chunk)));
+            }
+        }
+
+        return window.btoa(str.join(""));
+    },
+
     /**
      * Callback for the default action 'load'.
      */
@@ -272,6 +468,143 @@ JXG.Server = {
             { module: module },
             true
         );
+    },
+
+    /**
+     * Calls several handlers of loaded modules within one request to the server.
+     * @param {Array} calls Array of objects, each holding the fields <tt>module</tt> and <tt>handler</tt>,
+     * the handler's arguments in <tt>args</tt> and optionally an <tt>id</tt> and a <tt>callback</tt>.
+     * If no id is given, the index of the call in the array is used.
+     * @param {function} callback Called with an object holding the result of every call, keyed by the ids
+     * of the calls. Each result is either of type 'response' with the data in <tt>data</tt> or of type 'error'
+     * with a <tt>message</tt>.
+     * @param {Boolean} [parallel=false] If the server may execute the calls in parallel.
+     * @param {Boolean} [sync=false] If the call should be synchronous or not.
+     * @returns {Boolean}
+     */
+    callBatch: function (calls, callback, parallel, sync) {
+        var i, id,
+            ids = [],
+            list = [];
+
+        for (i = 0; i < calls.length; i++) {
+            id = Type.exists(calls[i].id) ? String(calls[i].id) : String(i);
+            ids.push(id);
+            list.push({
+                id: id,
+                module: calls[i].module,
+                handler: calls[i].handler,
+                args: calls[i].args || {}
+            });
+        }
+
+        return this.callServer(
+            "batch",
+            JXG.bind(function (data) {
+                var j, res;
+
+                for (j = 0; j < calls.length; j++) {
+                    res = data[ids[j]];
+                    if (!Type.exists(res)) {
+                        continue;
+                    }
+                    if (res.type === 'error') {
+                        this.handleError(res);
+                    } else if (Type.isFunction(calls[j].callback)) {
+                        calls[j].callback(res.data);
+                    }
+                }
+
+                if (Type.isFunction(callback)) {
+                    callback(data);
+                }
+            }, this),
+            { calls: list, parallel: !!parallel },
+            sync
+        );
+    },
+
+    /**
+     * Calls a handler of a loaded module which computes its result in frames, e.g. geoloci's lociSweep.
+     * The frames are passed to onFrame one by one as soon as the server has computed them.
+     * @param {String} module Name of the module.
+     * @param {String} handler Name of the handler.
+     * @param {Object} args The handler's arguments.
+     * @param {function} onFrame Called with the data of every frame.
+     * @param {function} [callback] Called with the data of the response before the first frame.
+     * @returns {Boolean}
+     */
+    callStream: function (module, handler, args, onFrame, callback) {
+        var AJAX, k, passdata, pos,
+            data = { module: module, handler: handler },
+            binary = { parts: [], length: 0 },
+            binaryResponse = !!(window.XMLHttpRequest && XMLHttpRequest.prototype.overrideMimeType),
+            that = this;
+
+        for (k in args) {
+            if (args.hasOwnProperty(k)) {
+                data[k] = args[k];
+            }
+        }
+
+        passdata =
+            "action=exec" +
+            "&id=stream" + Math.floor(Math.random() * 4096) +
+            "&dataJSON=" +
+            escape(Base64.encode(Type.toJSON(this._packTypedArrays(data, binary)))) +
+            "&accept=typed,identity,stream" +
+            (binaryResponse ? ",binary" : "");
+        if (binary.length > 0) {
+            passdata += "&dataBin=" + encodeURIComponent(this._encodeBinary(binary));
+        }
+
+        AJAX = new XMLHttpRequest();
+        AJAX.overrideMimeType("text/plain; charset=" + (binaryResponse ? "x-user-defined" : "iso-8859-1"));
+        AJAX.open("POST", JXG.serverBase + 'JXGServer.py', true);
+        AJAX.setRequestHeader("Content-type", "application/x-www-form-urlencoded");
+
+        // Every message is preceded by a line "<length> <encoding>"
+        pos = 0;
+        AJAX.onreadystatechange = function () {
+            var text, nl, head, len, msg;
+
+            if (AJAX.readyState < 3 || AJAX.status !== 200) {
+                return;
+            }
+
+            text = AJAX.responseText;
+            while (true) {
+                nl = text.indexOf("\n", pos);
+                if (nl < 0) {
+                    return;
+                }
+                head = text.substring(pos, nl).split(" ");
+                len = parseInt(head[0], 10);
+                if (text.length < nl + 1 + len) {
+                    return;
+                }
+                msg = that._decode(
+                    text.substr(nl + 1, len),
+                    AJAX.getResponseHeader('X-JXG-Transfer'),
+                    head[1]
+                );
+                pos = nl + 1 + len;
+
+                if (!Type.exists(msg)) {
+                    continue;
+                }
+                if (msg.type === 'error') {
+                    that.handleError(msg);
+                } else if (msg.type === 'frame') {
+                    onFrame(msg.data);
+                } else if (Type.isFunction(callback)) {
+                    callback(msg.data);
+                }
+            }
+        };
+
+        AJAX.send(passdata);
+        return true;
     }
 };
 
@@ -0,0 +1,148 @@
+'''
+Tests of the admission control of JXGAdmission.py.
+
+    python3 -m pytest src/unused/server
+'''
+
+import gc
+import threading
+import time
+
+import pytest
+
+from JXGAdmission import Limiter, Busy
+
+
+def waiter(limiter, results):
+    # Takes a slot in a thread of its own, records the outcome
+    def run():
+        try:
+            limiter.acquire()
+            results.append('admitted')
+        except Busy as e:
+            results.append(e)
+    t = threading.Thread(target=run)
+    t.start()
+    return t
+
+def settle(limiter, waiting):
+    deadline = time.monotonic() + 5
+    while limiter.waiting != waiting and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert limiter.waiting == waiting
+
+
+############################
+#
+# Limiter
+#
+############################
+
+def test_slots_are_taken_and_released():
+    limiter = Limiter('m', 2)
+    limiter.acquire()
+    limiter.acquire()
+    assert limiter.running == 2
+    limiter.release()
+    limiter.acquire()
+    assert limiter.running == 2
+
+def test_without_concurrency_nothing_is_limited():
+    limiter = Limiter('m')
+    for i in range(100):
+        limiter.acquire()
+    assert limiter.running == 0
+
+def test_calls_are_refused_when_the_queue_is_full():
+    limiter = Limiter('m', 1, depth=0)
+    limiter.acquire()
+    start = time.perf_counter()
+    with pytest.raises(Busy, match='too many requests'):
+        limiter.acquire()
+    assert time.perf_counter() - start < 0.5
+
+def test_waiting_calls_get_the_released_slot():
+    limiter = Limiter('m', 1, depth=1, timeout=5)
+    limiter.acquire()
+    results = []
+    t = waiter(limiter, results)
+    settle(limiter, 1)
+    # The queue is full
+    with pytest.raises(Busy):
+        limiter.acquire()
+
+    limiter.release()
+    t.join()
+    assert results == ['admitted']
+    assert limiter.running == 1 and limiter.waiting == 0
+
+def test_waiting_calls_time_out():
+    limiter = Limiter('m', 1, depth=1, timeout=0.2)
+    limiter.acquire()
+    start = time.perf_counter()
+    with pytest.raises(Busy, match='no free slot within'):
+        limiter.acquire()
+    assert 0.2 <= time.perf_counter() - start < 2
+    assert limiter.running == 1 and limiter.waiting == 0
+
+def test_admit_releases_on_errors():
+    limiter = Limiter('m', 1)
+    with limiter.admit():
+        assert limiter.running == 1
+    with pytest.raises(ValueError):
+        with limiter.admit():
+            raise ValueError
+    assert limiter.running == 0
+
+
+############################
+#
+# Held slots
+#
+############################
+
+@pytest.fixture
+def limiter():
+    limiter = Limiter('m', 1)
+    limiter.acquire()
+    return limiter
+
+def test_held_slots_are_released_when_exhausted(limiter):
+    frames = limiter.hold(range(3))
+    assert next(frames) == 0
+    assert limiter.running == 1
+    assert list(frames) == [1, 2]
+    assert limiter.running == 0
+    # Only once
+    frames.close()
+    assert limiter.running == 0
+
+def test_held_slots_are_released_on_errors(limiter):
+    def failing():
+        yield 1
+        raise ValueError
+    frames = limiter.hold(failing())
+    next(frames)
+    with pytest.raises(ValueError):
+        next(frames)
+    assert limiter.running == 0
+
+def test_held_slots_are_released_when_given_up(limiter):
+    done = []
+    def frames():
+        try:
+            yield 1
+            yield 2
+        finally:
+            done.append(True)
+    held = limiter.hold(frames())
+    next(held)
+    held.close()
+    assert limiter.running == 0 and done == [True]
+
+def test_forgotten_held_slots_are_released(limiter):
+    held = limiter.hold(iter([1, 2]))
+    next(held)
+    del held
+    gc.collect()
+    assert limiter.running == 0
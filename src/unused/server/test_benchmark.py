@@ -0,0 +1,52 @@
+'''
+Tests of the request building of benchmark.py.
+
+    python3 -m pytest src/unused/server
+'''
+
+import json
+import random
+
+import pytest
+
+import benchmark
+from JXGServer import parse_form, decode_data
+
+
+NAMES = ['calcTest', 'fft256']
+
+def decoded(body):
+    form = parse_form('', body)
+    return json.loads(decode_data(form['dataJSON']))
+
+
+def test_percentiles():
+    assert benchmark.percentile([], 50) is None
+    assert benchmark.percentile([3, 1, 2], 50) == 2
+    assert benchmark.percentile([1, 2, 3, 4], 50) == 2.5
+    assert benchmark.percentile([1, 2, 3, 4], 100) == 4
+
+def test_requests_are_encoded_like_callServer():
+    body = benchmark.form_body('exec', {'module': 'fft', 'x': [0.5, -1 / 3]}, 'typed,binary', random.Random(1))
+    form = parse_form('', body)
+    assert form['action'] == 'exec' and form['accept'] == 'typed,binary'
+    assert json.loads(decode_data(form['dataJSON'])) == {'module': 'fft', 'x': [0.5, -1 / 3]}
+
+def test_runs_with_the_same_seed_send_the_same_requests():
+    a = benchmark.build_requests(NAMES, 50, None, '', random.Random(7))
+    b = benchmark.build_requests(NAMES, 50, None, '', random.Random(7))
+    assert a == b
+
+def test_cold_requests_have_arguments_of_their_own():
+    # Only matters for the cacheable handlers
+    requests = benchmark.build_requests(['fft256', 'fft4096'], 200, None, '', random.Random(1))
+    payloads = [json.dumps(decoded(body), sort_keys=True) for name, body in requests]
+    assert len(set(payloads)) == len(payloads)
+
+def test_warm_requests_repeat_the_given_payloads():
+    rnd = random.Random(1)
+    payloads = dict((name, [benchmark.payload(name, rnd) for i in range(4)]) for name in NAMES)
+    for name, body in benchmark.build_requests(NAMES, 100, payloads, '', rnd):
+        data = decoded(body)
+        assert data in payloads[name]
+        assert (data['module'], data['handler']) == tuple(benchmark.SCENARIOS[name][1:3])
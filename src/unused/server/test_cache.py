@@ -0,0 +1,155 @@
+'''
+Tests of the result caches of JXGCache.py.
+
+    python3 -m pytest src/unused/server
+'''
+
+import os
+import time
+
+import numpy
+import pytest
+
+from JXGCache import canonicalKey, LRUCache, DiskCache, Cache
+
+
+class Clock(object):
+    # Replaces time.time() of JXGCache
+
+    def __init__(self, monkeypatch):
+        self.now = 1000.0
+        monkeypatch.setattr(time, 'time', lambda: self.now)
+
+@pytest.fixture
+def clock(monkeypatch):
+    return Clock(monkeypatch)
+
+
+############################
+#
+# Keys
+#
+############################
+
+def test_keys_ignore_the_order_of_dict_keys():
+    assert canonicalKey('m', {'a': 1, 'b': [1, 2]}) == canonicalKey('m', {'b': [1, 2], 'a': 1})
+
+@pytest.mark.parametrize('a, b', [
+    (1, 1.0), (1, True), (0, None), ('1', 1), (b'1', '1'),
+    ([1, 2], [[1, 2]]), (['ab'], ['a', 'b']), ({'a': 1}, [('a', 1)]),
+    (numpy.array([1, 2]), numpy.array([1.0, 2.0])), (numpy.array([1, 2]), numpy.array([[1, 2]])),
+])
+def test_different_values_have_different_keys(a, b):
+    assert canonicalKey(a) != canonicalKey(b)
+
+def test_arrays_are_keyed_by_their_contents():
+    a = numpy.arange(6.0)
+    assert canonicalKey(a) == canonicalKey(numpy.arange(6.0))
+    assert canonicalKey(a[::2]) == canonicalKey(numpy.array([0.0, 2.0, 4.0]))
+
+def test_unknown_types_are_refused():
+    with pytest.raises(TypeError):
+        canonicalKey(object())
+
+
+############################
+#
+# LRUCache
+#
+############################
+
+def test_lru_get_and_put():
+    cache = LRUCache(100)
+    assert cache.get('a') is None
+    cache.put('a', 'x' * 10)
+    assert cache.get('a') == 'x' * 10
+    cache.put('a', 'y' * 20)
+    assert cache.get('a') == 'y' * 20
+    assert len(cache) == 1 and cache.bytes == 20
+    cache.remove('a')
+    assert cache.get('a') is None and cache.bytes == 0
+
+def test_lru_evicts_the_least_recently_used():
+    cache = LRUCache(30)
+    for key in 'abc':
+        cache.put(key, key * 10)
+    cache.get('a')
+    cache.put('d', 'd' * 10)
+    assert cache.get('b') is None
+    assert [cache.get(key) for key in 'acd'] == ['a' * 10, 'c' * 10, 'd' * 10]
+    assert cache.bytes == 30
+
+def test_lru_skips_values_bigger_than_the_cache():
+    cache = LRUCache(30, sizeof=lambda value: value[1])
+    cache.put('a', ('a', 10))
+    cache.put('big', ('big', 31))
+    assert cache.get('big') is None
+    assert cache.get('a') == ('a', 10)
+
+def test_lru_entries_expire(clock):
+    cache = LRUCache(100)
+    cache.put('a', 'a', ttl=10)
+    cache.put('b', 'b')
+    clock.now += 9
+    assert cache.get('a') == 'a'
+    clock.now += 2
+    assert cache.get('a') is None
+    assert cache.get('b') == 'b'
+    assert cache.bytes == 1
+
+
+############################
+#
+# DiskCache and Cache
+#
+############################
+
+def test_disk_entries_survive_a_restart(tmp_path):
+    DiskCache(str(tmp_path), 1024).put('k', {'x': [1, 2]})
+    # Left over by a crashed writer
+    (tmp_path / 'j.1.2.tmp').write_bytes(b'garbage')
+
+    cache = DiskCache(str(tmp_path), 1024)
+    assert cache.get('k') == {'x': [1, 2]}
+    assert not (tmp_path / 'j.1.2.tmp').exists()
+    assert cache.bytes == os.path.getsize(tmp_path / 'k')
+
+def test_disk_evicts_the_least_recently_used(tmp_path, clock):
+    cache = DiskCache(str(tmp_path), 1024)
+    for key in 'abc':
+        clock.now += 1
+        cache.put(key, key * 300)
+    clock.now += 1
+    cache.get('a')
+    clock.now += 1
+    cache.put('d', 'd' * 300)
+    assert cache.get('b') is None
+    assert sorted(os.listdir(tmp_path)) == ['a', 'c', 'd']
+    assert cache.bytes <= 1024
+
+def test_disk_entries_expire(tmp_path, clock):
+    cache = DiskCache(str(tmp_path), 1024)
+    cache.put('a', 'a', ttl=10)
+    clock.now += 11
+    assert cache.get('a') is None
+    assert os.listdir(tmp_path) == [] and cache.bytes == 0
+
+def test_cache_counts_hits_and_misses(tmp_path):
+    cache = Cache(100, str(tmp_path), 1024)
+    assert cache.get('a') is None
+    cache.put('a', 'value')
+    assert cache.get('a') == 'value'
+
+    # A new process only finds the entry on disk, it's then kept in memory
+    cache = Cache(100, str(tmp_path), 1024)
+    assert cache.get('a') == 'value'
+    assert cache.get('a') == 'value'
+    assert cache.stats() == {'hits': 2, 'diskHits': 1, 'misses': 0, 'entries': 1, 'bytes': 5}
+
+def test_cache_keeps_the_expiry_of_disk_entries(tmp_path, clock):
+    Cache(100, str(tmp_path), 1024).put('a', 'value', ttl=10)
+    cache = Cache(100, str(tmp_path), 1024)
+    clock.now += 5
+    assert cache.get('a') == 'value'
+    clock.now += 6
+    assert cache.get('a') is None
@@ -0,0 +1,93 @@
+'''
+Tests of the CoCoA session pool against cocoastub.py.
+
+    python3 -m pytest src/unused/server
+'''
+
+import os
+import threading
+import time
+
+import pytest
+
+from JXGCoCoA import SessionPool, CoCoAError, CoCoATimeout, polynomials
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STUB = os.path.join(HERE, 'cocoastub.py')
+
+
+def script(polys):
+    return 'I := Ideal(%s);\nPrint "resultsend", NewLine;' % polys
+
+def results(output):
+    # The lines between the dashes include empty ones
+    return [p for p in polynomials(output) if p]
+
+def pids(pool):
+    return set(s.process.pid for s in list(pool._idle.queue) if s is not None)
+
+@pytest.fixture
+def pool():
+    pool = SessionPool(STUB, 2, maxRequests=5)
+    yield pool
+    pool.close()
+
+
+def test_sessions_answer_scripts(pool):
+    assert results(pool.run(script('x - u[1], x^2 + y^2 - 4'), 10)) == ['x^2 + y^2 - 4']
+    assert polynomials('no results') is None
+
+def test_sessions_are_kept_warm(pool):
+    assert pool.idle() == 0
+    pool.run(script('x - 1'), 10)
+    started = pids(pool)
+    for i in range(3):
+        pool.run(script('x - %d' % i), 10)
+    assert pool.idle() == 1
+    assert pids(pool) == started
+
+def test_sessions_are_recycled_after_max_requests(pool):
+    pool.run(script('x - 1'), 10)
+    started = pids(pool)
+    for i in range(4):
+        pool.run(script('x - %d' % i), 10)
+    # The 5th request closed the session
+    assert pool.idle() == 0
+    pool.run(script('x - 1'), 10)
+    assert pids(pool).isdisjoint(started)
+
+def test_sessions_run_at_once(pool, monkeypatch):
+    monkeypatch.setenv('COCOA_STUB_DELAY', '0.5')
+    start = time.perf_counter()
+    threads = [threading.Thread(target=pool.run, args=(script('x - 1'), 10)) for i in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert time.perf_counter() - start < 0.9
+    assert pool.idle() == 2
+
+def test_sessions_timing_out_are_replaced(pool, monkeypatch):
+    monkeypatch.setenv('COCOA_STUB_DELAY', '5')
+    start = time.perf_counter()
+    with pytest.raises(CoCoATimeout):
+        pool.run(script('x - 1'), 0.3)
+    assert time.perf_counter() - start < 2
+    assert pool.idle() == 0
+
+    monkeypatch.setenv('COCOA_STUB_DELAY', '0')
+    assert results(pool.run(script('x - 2'), 10)) == ['x - 2']
+
+def test_crashed_sessions_are_replaced(pool, monkeypatch):
+    monkeypatch.setenv('COCOA_STUB_CRASH', 'boom')
+    with pytest.raises(CoCoAError, match='died'):
+        pool.run(script('boom'), 10)
+    assert results(pool.run(script('x - 2'), 10)) == ['x - 2']
+
+def test_missing_cocoa_is_reported():
+    pool = SessionPool(os.path.join(HERE, 'no-such-cocoa'))
+    with pytest.raises(CoCoAError, match="can't start CoCoA"):
+        pool.run(script('x'), 1)
+    # The slot of the session isn't lost
+    with pytest.raises(CoCoAError, match="can't start CoCoA"):
+        pool.run(script('x'), 1)
@@ -0,0 +1,57 @@
+'''
+Tests of the negotiated response compression of JXGCompression.py.
+
+    python3 -m pytest src/unused/server
+'''
+
+import base64
+import os
+import zlib
+
+import pytest
+
+from JXGCompression import CompressionPolicy
+
+
+SMALL = b'{"type": "response", "data": {}}'
+LARGE = b'{"data": [' + b', '.join(b'%d' % i for i in range(100000)) + b']}'
+
+
+def test_legacy_clients_get_base64_zlib():
+    body, headers = CompressionPolicy().encode(SMALL, set(['']))
+    assert headers['X-JXG-Encoding'] == 'zlib' and headers['X-JXG-Transfer'] == 'base64'
+    assert headers['Content-Type'] == 'text/plain'
+    payload = base64.b64decode(body)
+    # The header JXG.Util.Unzip recognizes
+    assert payload[:2] == b'\x78\xda'
+    assert zlib.decompress(payload) == SMALL
+
+def test_small_payloads_are_sent_uncompressed():
+    policy = CompressionPolicy(threshold=1024)
+    body, headers = policy.encode(SMALL, set(['identity', 'binary']))
+    assert body == SMALL
+    assert headers['X-JXG-Encoding'] == 'identity' and headers['X-JXG-Compress-Level'] == '0'
+    assert headers['X-JXG-Transfer'] == 'binary' and headers['Content-Type'] == 'application/octet-stream'
+
+    body, headers = policy.encode(LARGE, set(['identity', 'binary']))
+    assert headers['X-JXG-Encoding'] == 'zlib'
+    assert zlib.decompress(body) == LARGE
+    assert float(headers['X-JXG-Compress-Ratio']) == pytest.approx(len(body) / len(LARGE), abs=1e-4)
+
+@pytest.mark.parametrize('size, level', [(100, 9), (64 * 1024, 9), (64 * 1024 + 1, 6), (1024 * 1024, 6), (1024 * 1024 + 1, 1)])
+def test_the_level_depends_on_the_size(size, level):
+    assert CompressionPolicy().level(size) == level
+
+def test_fast_compression():
+    assert CompressionPolicy().level(100, fast=True) == 1
+    assert CompressionPolicy(fast=True).level(100) == 1
+
+    payload = os.urandom(1000) * 10
+    body, headers = CompressionPolicy().encode(payload, set(['fast', 'binary']))
+    assert headers['X-JXG-Compress-Level'] == '1'
+    assert zlib.decompress(body) == payload
+
+def test_empty_payloads():
+    body, headers = CompressionPolicy().encode(b'', set(['binary']))
+    assert zlib.decompress(body) == b''
+    assert headers['X-JXG-Compress-Ratio'] == '1.0000'
@@ -0,0 +1,244 @@
+'''
+Tests of the zero contours of JXGContour.py.
+
+    python3 -m pytest src/unused/server
+'''
+
+import math
+
+import numpy
+import pytest
+
+from JXGContour import zeroContours, adaptiveContours, tileLevel, tileRange, tiledContours, joinPolylines, TILE_CELLS, \
+                       transform, simplify, flatten
+from JXGCache import LRUCache
+
+
+def closed(line):
+    return len(line) > 3 and numpy.array_equal(line[0], line[-1])
+
+def grid(f, n=41, lo=-1, hi=1):
+    x = numpy.linspace(lo, hi, n)
+    y = numpy.linspace(lo, hi, n)
+    return x, y, f(x[None, :], y[:, None])
+
+
+############################
+#
+# Marching squares
+#
+############################
+
+def test_circle_is_one_closed_curve():
+    lines = zeroContours(*grid(lambda x, y: x**2 + y**2 - 0.5))
+    assert len(lines) == 1
+    assert closed(lines[0])
+    assert numpy.allclose(numpy.hypot(lines[0][:, 0], lines[0][:, 1]), numpy.sqrt(0.5), atol=0.01)
+
+def test_saddle_cells_keep_the_branches_apart():
+    # The cell around the origin has alternating signs at its corners, its
+    # center is negative, so the branches in the 1st and 3rd quadrant of
+    # x*y = c must not be connected
+    lines = zeroContours(*grid(lambda x, y: x * y - 0.001, 20))
+    assert len(lines) == 2
+    for line in lines:
+        assert not closed(line)
+        assert numpy.all(line[:, 0] > 0) or numpy.all(line[:, 0] < 0)
+        assert numpy.all(line[:, 0] * line[:, 1] > 0)
+        # Both ends are on the border of the grid
+        for end in (line[0], line[-1]):
+            assert numpy.isclose(numpy.abs(end).max(), 1)
+
+def test_crossings_are_interpolated():
+    lines = zeroContours(*grid(lambda x, y: x - 0.3 + 0 * y, 11))
+    assert len(lines) == 1
+    assert numpy.allclose(lines[0][:, 0], 0.3)
+    assert numpy.allclose(sorted(lines[0][:, 1]), numpy.linspace(-1, 1, 11))
+
+def test_zeros_in_grid_points_give_no_duplicate_points():
+    lines = zeroContours(*grid(lambda x, y: x + 0 * y, 11))
+    assert len(lines) == 1
+    assert len(lines[0]) == 11
+    assert numpy.allclose(lines[0][:, 0], 0)
+
+def test_meshgrids_are_accepted():
+    x, y, z = grid(lambda x, y: x**2 + y**2 - 0.5)
+    X, Y = numpy.meshgrid(x, y)
+    expected = zeroContours(x, y, z)
+    assert all(numpy.array_equal(a, b) for a, b in zip(zeroContours(X, Y, z), expected))
+
+def test_cells_with_nan_are_skipped():
+    x, y, z = grid(lambda x, y: x**2 + y**2 - 0.5)
+    z[:, x > 0] = numpy.nan
+    lines = zeroContours(x, y, z)
+    assert len(lines) == 1
+    assert not closed(lines[0])
+    assert numpy.all(lines[0][:, 0] <= 0)
+
+@pytest.mark.parametrize('z', [numpy.ones((5, 5)), -numpy.ones((5, 5)), numpy.zeros((1, 5)), numpy.zeros((5, 1))])
+def test_grids_without_zeros(z):
+    assert zeroContours(numpy.arange(z.shape[1]), numpy.arange(z.shape[0]), z) == []
+
+
+############################
+#
+# Adaptive refinement
+#
+############################
+
+class Counted(object):
+    # f(x, y) counting the points it's evaluated at
+
+    def __init__(self, f):
+        self.f = f
+        self.points = 0
+
+    def __call__(self, x, y):
+        self.points += numpy.size(x)
+        return self.f(x, y)
+
+def test_adaptive_circle_is_one_closed_curve():
+    f = Counted(lambda x, y: x**2 + y**2 - 0.5)
+    lines = adaptiveContours(f, -1, 1, -1, 1, 1 / 256)
+    assert len(lines) == 1
+    assert closed(lines[0])
+    assert numpy.allclose(numpy.hypot(lines[0][:, 0], lines[0][:, 1]), numpy.sqrt(0.5), atol=1 / 256)
+    # Only cells near the curve are refined
+    assert f.points < 257 * 257 / 2
+
+def test_adaptive_matches_the_full_grid():
+    f = lambda x, y: x**3 - 2 * x * y + y**2 - 0.1
+    expected = zeroContours(*grid(f, 257))
+    lines = adaptiveContours(f, -1, 1, -1, 1, 2 / 256)
+    assert len(lines) == len(expected)
+    key = lambda pa: tuple(numpy.round(pa[0], 9))
+    for a, b in zip(sorted(lines, key=key), sorted(expected, key=key)):
+        assert numpy.allclose(a, b)
+
+def test_adaptive_finds_curves_between_coarse_samples():
+    # The circle fits into a cell of the coarse grid
+    f = Counted(lambda x, y: (x - 0.013)**2 + (y + 0.021)**2 - 0.02**2)
+    lines = adaptiveContours(f, -1, 1, -1, 1, 1 / 512)
+    assert len(lines) == 1
+    assert closed(lines[0])
+    assert f.points < 513 * 513 / 50
+
+def test_adaptive_grids_are_bounded():
+    f = Counted(lambda x, y: x + 0 * y)
+    adaptiveContours(f, -1, 1, -1, 1, 1e-9, coarse=16, maxSize=64)
+    assert f.points <= 65 * 65
+
+
+############################
+#
+# Tiles
+#
+############################
+
+def test_tile_levels():
+    # Cells of tiles of level l are 2^l / TILE_CELLS wide
+    assert tileLevel(1 / TILE_CELLS) == 0
+    assert tileLevel(1.5 / TILE_CELLS) == 0
+    assert tileLevel(2 / TILE_CELLS) == 1
+    assert tileLevel(0.001) == -3
+
+def test_tile_ranges():
+    assert list(tileRange(0, 2, 0, 1, 0)) == [(0, 0), (1, 0)]
+    assert list(tileRange(-0.5, 0.5, -0.5, 0.5, 0)) == [(-1, -1), (0, -1), (-1, 0), (0, 0)]
+    assert list(tileRange(0.5, -0.5, 0.5, -0.5, 0)) == list(tileRange(-0.5, 0.5, -0.5, 0.5, 0))
+    assert list(tileRange(0, 2, 0, 2, 1)) == [(0, 0)]
+
+def test_tile_ranges_are_capped():
+    tiles = tileRange(-3, 3, -3, 3, -2)
+    assert not isinstance(tiles, list)
+    assert len(list(tiles)) == 24 * 24
+    with pytest.raises(ValueError):
+        tileRange(-3, 3, -3, 3, -6)
+    with pytest.raises(ValueError):
+        tileRange(0, 2, 0, 2, 0, maxTiles=3)
+
+def test_polylines_are_joined_at_shared_ends():
+    a = numpy.array([[0, 0], [1, 0]])
+    b = numpy.array([[2, 0], [1, 0]])
+    c = numpy.array([[2, 0], [2, 1], [0, 0]])
+    d = numpy.array([[5, 5], [6, 6]])
+    lines = joinPolylines([a, b, c, d])
+    assert len(lines) == 2
+    assert closed(lines[0]) and len(lines[0]) == 5
+    assert numpy.array_equal(lines[1], d)
+
+def sizeofTile(lines):
+    return sum(pa.nbytes for pa in lines) + 64
+
+def test_tiles_are_stitched_into_one_closed_curve():
+    f = Counted(lambda x, y: x**2 + y**2 - 0.5)
+    cache = LRUCache(1024 * 1024, sizeof=sizeofTile)
+    lines = tiledContours(f, 'circle', -1, 1, -1, 1, 1 / 256, cache)
+    assert len(lines) == 1
+    assert closed(lines[0])
+    assert numpy.allclose(numpy.hypot(lines[0][:, 0], lines[0][:, 1]), numpy.sqrt(0.5), atol=1 / 256)
+    # Tiles of size 1/2, the empty ones are cached too
+    assert len(cache) == 16
+
+def test_tiles_are_taken_from_the_cache():
+    f = Counted(lambda x, y: x**2 + y**2 - 0.5)
+    cache = LRUCache(1024 * 1024, sizeof=sizeofTile)
+    expected = tiledContours(f, 'circle', -1, 1, -1, 1, 1 / 256, cache)
+    points = f.points
+
+    lines = tiledContours(f, 'circle', -1, 1, -1, 1, 1 / 256, cache)
+    assert f.points == points
+    assert all(numpy.array_equal(a, b) for a, b in zip(lines, expected))
+
+    # Panning by a tile only computes the new column
+    tiledContours(f, 'circle', -0.5, 1.5, -1, 1, 1 / 256, cache)
+    assert f.points > points
+    assert len(cache) == 20
+
+    # Other functions need another key
+    tiledContours(lambda x, y: x - y, 'diagonal', -1, 1, -1, 1, 1 / 256, cache)
+    assert len(cache) == 36
+
+
+############################
+#
+# Output
+#
+############################
+
+def test_transform_rotates_scales_and_moves():
+    points = numpy.array([[1.0, 0.0], [0.0, 2.0]])
+    assert numpy.allclose(transform(points), points)
+    assert numpy.allclose(transform(points, 2, math.pi / 2, 1, -1), [[1, 1], [-3, -1]])
+
+def deviation(points, polyline):
+    # The largest distance of the points to the polyline
+    a, b = polyline[:-1, None], polyline[1:, None]
+    d = b - a
+    t = numpy.clip(numpy.sum((points - a) * d, axis=2) / numpy.maximum(numpy.sum(d * d, axis=2), 1e-300), 0, 1)
+    nearest = a + t[..., None] * d
+    return numpy.hypot(*(points - nearest).transpose(2, 0, 1)).min(axis=0).max()
+
+def test_simplify_keeps_the_shape():
+    t = numpy.linspace(0, 2 * math.pi, 1001)
+    circle = numpy.stack((numpy.cos(t), numpy.sin(t)), axis=1)
+    simple = simplify(circle, 0.01)
+    assert len(simple) < 100
+    assert numpy.array_equal(simple[0], circle[0]) and numpy.array_equal(simple[-1], circle[-1])
+    assert deviation(circle, simple) <= 0.01
+
+def test_simplify_removes_collinear_points():
+    line = numpy.stack((numpy.linspace(0, 1, 50), numpy.linspace(0, 2, 50)), axis=1)
+    assert numpy.array_equal(simplify(line, 1e-9), line[[0, -1]])
+    assert simplify(line, 0) is line
+    assert numpy.array_equal(simplify(line[:2], 1), line[:2])
+
+def test_flatten_separates_the_lines_by_nan():
+    a = numpy.array([[0.0, 1.0], [2.0, 3.0]])
+    b = numpy.array([[4.0, 5.0]])
+    x, y = flatten([a, b])
+    assert numpy.array_equal(x, [0, 2, numpy.nan, 4, numpy.nan], equal_nan=True)
+    assert numpy.array_equal(y, [1, 3, numpy.nan, 5, numpy.nan], equal_nan=True)
+    assert x.flags.c_contiguous and y.flags.c_contiguous
+    x, y = flatten([])
+    assert len(x) == len(y) == 0
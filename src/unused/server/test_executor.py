@@ -0,0 +1,132 @@
+'''
+Tests of the process pool running cpubound handlers and its deadlines.
+
+    python3 -m pytest src/unused/server
+'''
+
+import os
+import time
+
+import pytest
+
+import JXG
+from JXGExecutor import Executor, ProcessPool, DeadlineExceeded, WorkerError
+from JXGRegistry import registry
+from JXGServerModule import JXGServerModule, handlerOptions
+
+
+def square(x):
+    return x * x
+
+def sleep(seconds):
+    time.sleep(seconds)
+    return os.getpid()
+
+def fail(message):
+    raise ValueError(message)
+
+def late(seconds, x):
+    time.sleep(seconds)
+    return x
+
+
+# Loaded by the registry from this module, in the workers too
+class JXGExecutorTestModule(JXGServerModule):
+
+    @handlerOptions(cpubound=True, timeout=10)
+    def everything(self, resp, x):
+        resp.addData('y', 2 * x)
+        resp.addField('JXG.Test', 'x', x)
+        resp.addHandler(self.everything, 'function(data) { }')
+        resp.addStream('frames', (i * x for i in range(3)))
+
+    @handlerOptions(cpubound=True, timeout=10)
+    def failing(self, resp):
+        resp.error("failed on purpose")
+
+    @handlerOptions(cpubound=True, timeout=0.5)
+    def endless(self, resp):
+        time.sleep(10)
+
+
+@pytest.fixture
+def pool():
+    pool = ProcessPool(1)
+    yield pool
+    pool.shutdown()
+
+@pytest.fixture
+def executor():
+    executor = Executor(1)
+    yield executor
+    executor.pool().shutdown()
+
+
+def test_pool_runs_jobs(pool):
+    assert pool.call(square, (7,)) == 49
+
+def test_pool_reports_failed_jobs(pool):
+    with pytest.raises(WorkerError, match='broken'):
+        pool.call(fail, ('broken',))
+    assert pool.call(square, (3,)) == 9
+
+def test_pool_kills_jobs_at_their_deadline(pool):
+    pid = pool.call(sleep, (0,))
+
+    start = time.perf_counter()
+    with pytest.raises(DeadlineExceeded):
+        pool.call(sleep, (10,), 0.5)
+    assert time.perf_counter() - start < 5
+
+    # The worker is replaced by a fresh one
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
+    assert pool.call(sleep, (0,), 10) != pid
+
+def test_imap_keeps_the_order_of_the_jobs():
+    executor = Executor(2)
+    try:
+        # The first job finishes last
+        jobs = [(1, 'a'), (0, 'b'), (0.5, 'c')]
+        start = time.perf_counter()
+        assert list(executor.imap(late, jobs, 10)) == ['a', 'b', 'c']
+        assert time.perf_counter() - start < 5
+        with pytest.raises(WorkerError, match='broken'):
+            executor.map(fail, [('broken',)])
+    finally:
+        executor.pool().shutdown()
+
+def test_inline_imap_calls_the_jobs_in_the_thread():
+    executor = Executor(1)
+    executor.inline = True
+    assert list(executor.imap(late, [(0, 'a'), (0, 'b')])) == ['a', 'b']
+    assert executor._pool is None
+
+def test_cpubound_handlers_keep_fields_handlers_and_streams(executor):
+    h = registry.handler(__name__, 'everything')
+    resp = JXG.Response('test', streaming=True)
+    executor.execute(h, [resp, 5], resp)
+
+    assert resp._type == 'response'
+    assert resp._data == {'y': 10}
+    assert resp._fields == [{'namespace': 'JXG.Test', 'name': 'x', 'value': 5}]
+    assert [h['name'] for h in resp._handler] == ['everything']
+    assert resp._stream[0] == 'frames' and list(resp._stream[1]) == [0, 5, 10]
+
+    resp = JXG.Response('test')
+    executor.execute(h, [resp, 5], resp)
+    assert resp._data == {'y': 10, 'frames': [0, 5, 10]}
+
+def test_cpubound_handlers_report_errors(executor):
+    h = registry.handler(__name__, 'failing')
+    resp = JXG.Response('test')
+    executor.execute(h, [resp], resp)
+    assert resp._type == 'error' and resp._message == "failed on purpose"
+
+def test_cpubound_handlers_are_killed_at_their_deadline(executor):
+    h = registry.handler(__name__, 'endless')
+    resp = JXG.Response('test')
+    start = time.perf_counter()
+    executor.execute(h, [resp], resp)
+    assert time.perf_counter() - start < 5
+    assert resp._type == 'error' and 'timeout' in resp._message
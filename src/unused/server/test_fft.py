@@ -0,0 +1,413 @@
+'''
+Tests of the FFT plugin on recordings written to a temporary directory.
+
+    python3 -m pytest src/unused/server
+'''
+
+import base64
+import io
+import mmap
+import os
+import struct
+import sys
+import time
+import wave
+
+import numpy
+import pytest
+
+import JXG
+
+
+def writeWav(path, samples, samplerate=8000, nchannels=1):
+    with wave.open(str(path), 'wb') as w:
+        w.setnchannels(nchannels)
+        w.setsampwidth(2)
+        w.setframerate(samplerate)
+        w.writeframes(numpy.asarray(samples, dtype='<i2').tobytes())
+
+@pytest.fixture
+def samples():
+    t = numpy.arange(20000) / 8000
+    return numpy.round(8000 * numpy.sin(2 * numpy.pi * 440 * t) + 2000 * numpy.sin(2 * numpy.pi * 1500 * t)).astype(numpy.int16)
+
+@pytest.fixture
+def fft(tmp_path, monkeypatch, samples):
+    writeWav(tmp_path / 'tone.wav', samples)
+    writeWav(tmp_path / 'stereo.wav', numpy.stack((samples, samples // 2), axis=1).ravel(), nchannels=2)
+    monkeypatch.setenv('JXG_AUDIO_DIR', str(tmp_path))
+    import fft
+    return fft.FFT()
+
+def chunk(name, payload):
+    return name + struct.pack('<I', len(payload)) + payload + b'\0' * (len(payload) & 1)
+
+def riff(*chunks):
+    body = b'WAVE' + b''.join(chunks)
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+def fmt(tag=1, channels=1, rate=8000, bits=16):
+    return chunk(b'fmt ', struct.pack('<HHIIHH', tag, channels, rate, rate * channels * bits // 8, channels * bits // 8, bits))
+
+def call(module, handler, *args, streaming=False, **kwargs):
+    resp = JXG.Response('test', streaming=streaming)
+    getattr(module, handler)(resp, *args, **kwargs)
+    assert resp._type == 'response', resp._message
+    return resp
+
+
+############################
+#
+# Recordings
+#
+############################
+
+def test_wav_files_are_mapped(tmp_path, samples):
+    import fft
+    writeWav(tmp_path / 'a.wav', samples, 44100)
+    data, rate, channels = fft.readWav(str(tmp_path / 'a.wav'))
+    assert (rate, channels) == (44100, 1)
+    assert numpy.array_equal(data, samples)
+    assert isinstance(data.base.obj, mmap.mmap) and not data.flags.writeable
+
+def test_wav_chunks_are_skipped(tmp_path):
+    import fft
+    pcm = numpy.arange(-5, 6, dtype='<i2')
+    # An odd chunk before the data, padded to an even size, and the
+    # header of WAVE_FORMAT_EXTENSIBLE
+    (tmp_path / 'a.wav').write_bytes(riff(chunk(b'LIST', b'odd'), fmt(0xFFFE, 2, 22050), chunk(b'data', pcm.tobytes())))
+    data, rate, channels = fft.readWav(str(tmp_path / 'a.wav'))
+    assert (rate, channels) == (22050, 2)
+    assert numpy.array_equal(data, pcm)
+
+@pytest.mark.parametrize('content, message', [
+    (b'not a wav file at all', 'not a wav file'),
+    (riff(fmt(bits=8), chunk(b'data', b'\0' * 10)), 'only 16 bit PCM'),
+    (riff(fmt(tag=3), chunk(b'data', b'\0' * 10)), 'only 16 bit PCM'),
+    (riff(fmt()), 'no audio data'),
+    (riff(chunk(b'data', b'\0' * 10)), 'no audio data'),
+])
+def test_invalid_wav_files_are_refused(tmp_path, content, message):
+    import fft
+    (tmp_path / 'a.wav').write_bytes(content)
+    with pytest.raises(ValueError, match=message):
+        fft.readWav(str(tmp_path / 'a.wav'))
+
+def test_recordings_are_decoded_once(fft, samples):
+    entry = fft._recording('tone', 'samples')
+    assert fft._recording('tone', 'samples') is entry
+    assert numpy.allclose(entry[0], samples / 8192.)
+
+    spectrum = fft._recording('tone', 'spectrum')
+    assert fft._recording('tone', 'spectrum') is spectrum
+    assert numpy.allclose(spectrum[0], numpy.fft.rfft(samples / 8192.))
+
+def test_changed_recordings_are_read_again(fft, tmp_path, samples):
+    old = fft._recording('tone', 'samples')[0]
+    writeWav(tmp_path / 'tone.wav', samples[:1000] // 2)
+    new = fft._recording('tone', 'samples')[0]
+    assert numpy.allclose(new, samples[:1000] // 2 / 8192.)
+    assert len(fft.recordings) == 1 and fft.recordings.bytes == new.nbytes
+    assert len(old) == len(samples)
+
+def test_recordings_are_named_in_the_audio_directory(fft):
+    entry = fft._recording('tone', 'samples')
+    assert fft._recording('../tone', 'samples') is entry
+    assert fft._recording('/elsewhere/tone', 'samples') is entry
+    with pytest.raises(FileNotFoundError):
+        fft._recording('missing', 'samples')
+
+def test_sampleifft_filters_the_recording(fft, samples, monkeypatch):
+    monkeypatch.setattr(fft, 'makeAudio', lambda resp, *args: None)
+    # The coefficients are 0.4 Hz apart, 1500 Hz is removed, 440 Hz kept
+    resp = call(fft, 'sampleifft', 'tone', 0, 2000, 0)
+    y = resp._data['y']
+    spectrum = numpy.abs(numpy.fft.rfft(y))
+    f = numpy.fft.rfftfreq(len(y), 1 / 8000)
+    assert spectrum[numpy.argmin(numpy.abs(f - 440))] > 1000
+    assert spectrum[numpy.argmin(numpy.abs(f - 1500))] < 1e-6
+
+def test_stereo_recordings_keep_their_channels(fft, samples):
+    data, rate, channels = fft._recording('stereo', 'samples')
+    assert channels == 2 and len(data) == 2 * len(samples)
+    assert numpy.allclose(data[1::2], samples // 2 / 8192.)
+
+
+############################
+#
+# Filter sessions
+#
+############################
+
+def session(fft, **kwargs):
+    return call(fft, 'openFilter', **kwargs)._data['session']
+
+def update(fft, handle, bands, **kwargs):
+    return call(fft, 'updateFilter', handle, bands, **kwargs)._data
+
+def test_filters_match_cutoutrange(fft):
+    x = numpy.random.default_rng(1).normal(size=1001)
+    resp = call(fft, 'openFilter', x=x)
+    assert resp._data['length'] == 1001 and resp._data['coefficients'] == 501
+    handle = resp._data['session']
+
+    for bands in [(10, 100, 0.5), [(10, 100, 0.5), (0, 200, 0)]]:
+        data = update(fft, handle, bands)
+        spectrum = numpy.fft.rfft(x)
+        for s, e, factor in ([bands] if len(bands) == 3 else bands):
+            spectrum = call(fft, 'cutoutrange', spectrum, s, e, factor)._data['y']
+        assert data['delta'] is False
+        assert numpy.allclose(data['y'], numpy.fft.irfft(spectrum, 1001))
+
+def test_filters_of_recordings(fft, samples):
+    handle = session(fft, name='tone')
+    y = update(fft, handle, (0, 10001, 1))['y']
+    assert numpy.allclose(y, samples / 8192.)
+
+def test_deltas_update_the_clients_copy(fft):
+    x = numpy.sin(numpy.arange(4096) / 7) + numpy.sin(numpy.arange(4096) / 50)
+    handle = session(fft, x=x)
+    client = update(fft, handle, (0, 2049, 1), delta=True)['y'].copy()
+
+    for bands in [(0, 1000, 0.999), (0, 100, 0), (0, 100, 0.999), (0, 2049, 0.5)]:
+        data = update(fft, handle, bands, delta=True)
+        if data['delta']:
+            assert len(data['index']) == len(data['y']) < len(client) / 2
+            client[data['index']] = data['y']
+        else:
+            client = data['y'].copy()
+        # Small changes aren't sent, but never pile up
+        expected = update(fft, session(fft, x=x), bands)['y']
+        assert numpy.max(numpy.abs(client - expected)) <= fft.delta_tolerance
+
+def test_unchanged_filters_send_empty_deltas(fft):
+    handle = session(fft, x=numpy.arange(100.0))
+    update(fft, handle, (0, 51, 1), delta=True)
+    data = update(fft, handle, (0, 51, 1), delta=True)
+    assert data['delta'] is True and len(data['index']) == 0
+
+def test_closed_sessions_are_gone(fft):
+    handle = session(fft, x=numpy.arange(100.0))
+    call(fft, 'closeFilter', handle)
+    resp = JXG.Response('test')
+    fft.updateFilter(resp, handle, (0, 1, 1))
+    assert resp._type == 'error' and 'unknown or expired' in resp._message
+
+def test_invalid_filters_are_refused(fft):
+    resp = JXG.Response('test')
+    fft.openFilter(resp)
+    assert resp._type == 'error'
+
+    handle = session(fft, x=numpy.arange(100.0))
+    resp = JXG.Response('test')
+    fft.updateFilter(resp, handle, [(0, 1)])
+    assert resp._type == 'error' and 'bands' in resp._message
+
+
+############################
+#
+# spectrogram
+#
+############################
+
+def test_spectrogram_matches_the_stft(fft, samples):
+    resp = call(fft, 'spectrogram', 'tone', size=512, hop=128, nfft=1024)
+    rows = numpy.concatenate(resp._data['frames'])
+
+    x = samples / 8192.
+    expected = numpy.array([numpy.abs(numpy.fft.rfft(x[i:i + 512] * numpy.hanning(512), 1024)) for i in range(0, len(x) - 511, 128)])
+    assert resp._data['rows'] == len(expected) == len(rows)
+    assert resp._data['frequencies'] == 513
+    assert numpy.allclose(rows, expected, atol=1e-3)
+
+def test_spectrogram_streams_blocks_of_rows(fft):
+    fft.spectrogram_rows = 16
+    resp = call(fft, 'spectrogram', 'tone', size=256, hop=64, streaming=True)
+    name, frames = resp._stream
+    frames = list(frames)
+    assert name == 'frames'
+    assert len(frames) > 1
+    assert sum(map(len, frames)) == resp._data['rows']
+
+def test_spectrogram_converts_its_sizes(fft):
+    expected = call(fft, 'spectrogram', 'tone', size=256, hop=64)._data['frames']
+    frames = call(fft, 'spectrogram', 'tone', size=256.0, hop='64')._data['frames']
+    assert all(numpy.array_equal(a, b) for a, b in zip(expected, frames))
+
+@pytest.mark.parametrize('size, hop, nfft', [
+    (0, 64, None), (-256, 64, None), (256, 0, None), (256, -64, None), (256, 64, 128),
+    ('big', 64, None), (None, 64, None), (float('nan'), 64, None), (float('inf'), 64, None), (256, 64, 2 ** 20),
+])
+def test_spectrogram_rejects_invalid_sizes(fft, size, hop, nfft):
+    resp = JXG.Response('test')
+    fft.spectrogram(resp, 'tone', size=size, hop=hop, nfft=nfft)
+    assert resp._type == 'error'
+
+
+############################
+#
+# waveform
+#
+############################
+
+def bruteForce(data, edges, end):
+    # Minima and maxima of the buckets from every edge to the next one
+    bounds = list(edges) + [end]
+    return numpy.array([data[a:b].min() for a, b in zip(bounds, bounds[1:])]), \
+           numpy.array([data[a:b].max() for a, b in zip(bounds, bounds[1:])])
+
+@pytest.fixture
+def noise():
+    return numpy.random.default_rng(3).integers(-32768, 32768, 8 ** 4 * 10, dtype=numpy.int16)
+
+def test_envelopes_on_block_boundaries_are_exact(noise):
+    import fft
+    pyramid = fft.Pyramid(noise, 1)
+    assert pyramid.blocks == [1, 8, 64]
+    for width in (40, 80, 5, 1):
+        mins, maxs, start, end = pyramid.envelope(0, len(noise), width)
+        expected = bruteForce(noise, numpy.arange(width) * len(noise) // width, len(noise))
+        assert (start, end) == (0, len(noise))
+        assert numpy.array_equal(mins, expected[0]) and numpy.array_equal(maxs, expected[1])
+
+@pytest.mark.parametrize('length, start, end, width', [
+    (40960, 0, 40960, 333), (40960, 1000, 1500, 7), (40960, 12345, 40000, 100), (40960, 5, 17, 100),
+    # The incomplete block at the end
+    (40003, 0, 40003, 10), (40003, 39000, 40003, 3),
+])
+def test_envelopes_start_at_blocks(noise, length, start, end, width):
+    import fft
+    noise = noise[:length]
+    pyramid = fft.Pyramid(noise, 1)
+    mins, maxs, s, e = pyramid.envelope(start, end, width)
+    width = min(width, end - start)
+    assert (s, e) == (start, end) and len(mins) == len(maxs) == width
+
+    # The buckets start at the blocks of the coarsest level not longer
+    # than a bucket containing their first frame
+    block = max(b for b in pyramid.blocks if b <= (end - start) / width)
+    edges = start + numpy.arange(width) * (end - start) // width
+    aligned = edges // block * block
+    expected = bruteForce(noise, aligned, -(-end // block) * block)
+    assert numpy.array_equal(mins, expected[0]) and numpy.array_equal(maxs, expected[1])
+
+def test_envelopes_of_single_frames_are_the_samples(noise):
+    import fft
+    mins, maxs, start, end = fft.Pyramid(noise, 1).envelope(100, 110, 1000)
+    assert numpy.array_equal(mins, noise[100:110]) and numpy.array_equal(maxs, noise[100:110])
+
+def test_envelopes_are_clipped_to_the_recording(noise):
+    import fft
+    pyramid = fft.Pyramid(noise, 1)
+    mins, maxs, start, end = pyramid.envelope(-100, 10 ** 9, 10)
+    assert (start, end) == (0, len(noise)) and len(mins) == 10
+    mins, maxs, start, end = pyramid.envelope(50000, 60000, 10)
+    assert len(mins) == 0 and start == end
+
+def test_envelopes_combine_the_channels(noise):
+    import fft
+    pyramid = fft.Pyramid(noise, 2)
+    assert pyramid.frames == len(noise) // 2
+    mins, maxs, start, end = pyramid.envelope(0, pyramid.frames, 10)
+    frames = noise.reshape(-1, 2)
+    expected = bruteForce(frames.min(axis=1), numpy.arange(10) * pyramid.frames // 10, pyramid.frames)
+    assert numpy.array_equal(mins, expected[0])
+    expected = bruteForce(frames.max(axis=1), numpy.arange(10) * pyramid.frames // 10, pyramid.frames)
+    assert numpy.array_equal(maxs, expected[1])
+
+def test_waveform_sends_the_envelope_in_seconds(fft, samples):
+    data = call(fft, 'waveform', 'tone', 100, 0.5, 1.0)._data
+    assert (data['start'], data['end'], data['seconds'], data['samplerate']) == (0.5, 1.0, 2.5, 8000)
+    assert len(data['min']) == len(data['max']) == 100
+    assert data['min'].dtype == numpy.float32
+    assert numpy.min(data['min']) == pytest.approx(samples[4000:8000].min() / 8192.)
+    assert numpy.max(data['max']) == pytest.approx(samples[4000:8000].max() / 8192.)
+
+def test_loadAudio_sends_the_envelope_for_a_width(fft, tmp_path):
+    (tmp_path / 'tone.ogg').write_bytes(b'OggS')
+    data = call(fft, 'loadAudio', 'ogg', 'tone', width=50)._data
+    assert data['audioB64'] == 'data:audio/ogg;base64,T2dnUw=='
+    assert len(data['min']) == 50 and 'audioData' not in data
+
+
+############################
+#
+# makeAudio
+#
+############################
+
+# Passes the wav through unchanged and counts its runs, OGGENC_FAIL and
+# OGGENC_DELAY make it fail or hang
+FAKE_OGGENC = """#!%s
+import os, sys, time
+with open(os.environ['OGGENC_RUNS'], 'a') as f:
+    f.write('run\\n')
+if 'OGGENC_FAIL' in os.environ:
+    sys.stderr.write(os.environ['OGGENC_FAIL'])
+    sys.exit(1)
+time.sleep(float(os.environ.get('OGGENC_DELAY', 0)))
+sys.stdout.buffer.write(sys.stdin.buffer.read())
+"""
+
+class Oggenc(object):
+
+    def __init__(self, tmp_path, monkeypatch):
+        bin = tmp_path / 'bin'
+        bin.mkdir()
+        (bin / 'oggenc').write_text(FAKE_OGGENC % sys.executable)
+        (bin / 'oggenc').chmod(0o755)
+        self.log = tmp_path / 'oggenc.log'
+        monkeypatch.setenv('PATH', str(bin) + os.pathsep + os.environ['PATH'])
+        monkeypatch.setenv('OGGENC_RUNS', str(self.log))
+
+    def runs(self):
+        return len(self.log.read_text().splitlines()) if self.log.exists() else 0
+
+@pytest.fixture
+def oggenc(tmp_path, monkeypatch):
+    return Oggenc(tmp_path, monkeypatch)
+
+def encoded(data):
+    # The wav passed through the fake oggenc
+    prefix = 'data:audio/ogg;base64,'
+    assert data['audioB64'].startswith(prefix)
+    with wave.open(io.BytesIO(base64.b64decode(data['audioB64'][len(prefix):]))) as w:
+        return w.getframerate(), numpy.frombuffer(w.readframes(w.getnframes()), dtype='<i2')
+
+def test_audio_is_scaled_and_clipped(fft, oggenc):
+    data = call(fft, 'makeAudio', 'ogg', 8000, [0, 0.5, -1, 1e-4, 5, -5, 4, -4])._data
+    rate, pcm = encoded(data)
+    assert rate == 8000
+    assert list(pcm) == [0, 2000, -4000, 0, 16000, -16000, 16000, -16000]
+
+def test_encoded_audio_is_cached(fft, oggenc):
+    x = numpy.sin(numpy.arange(1000) / 10)
+    first = call(fft, 'makeAudio', 'ogg', 8000, x)._data
+    assert call(fft, 'makeAudio', 'ogg', 8000, list(x))._data == first
+    assert oggenc.runs() == 1
+    # Other samples or another rate are encoded again
+    call(fft, 'makeAudio', 'ogg', 8000, x / 2)
+    call(fft, 'makeAudio', 'ogg', 16000, x)
+    assert oggenc.runs() == 3
+
+def test_failing_encoders_are_reported(fft, oggenc, monkeypatch):
+    monkeypatch.setenv('OGGENC_FAIL', 'broken pipe')
+    resp = JXG.Response('test')
+    fft.makeAudio(resp, 'ogg', 8000, [0.5])
+    assert resp._type == 'error' and resp._message == 'oggenc failed: broken pipe'
+    assert len(fft.encoded) == 0
+
+def test_slow_encoders_are_killed(fft, oggenc, monkeypatch):
+    monkeypatch.setenv('OGGENC_DELAY', '10')
+    fft.encoder_timeout = 0.5
+    resp = JXG.Response('test')
+    start = time.perf_counter()
+    fft.makeAudio(resp, 'ogg', 8000, [0.5])
+    assert time.perf_counter() - start < 5
+    assert resp._type == 'error' and 'within 0.5 seconds' in resp._message
+
+def test_missing_encoders_are_reported(fft, tmp_path, monkeypatch):
+    monkeypatch.setenv('PATH', str(tmp_path))
+    resp = JXG.Response('test')
+    fft.makeAudio(resp, 'ogg', 8000, [0.5])
+    assert resp._type == 'error' and resp._message.startswith("can't start oggenc")
@@ -0,0 +1,127 @@
+'''
+Tests of the request decoding and the response encoding of JXG.py.
+
+    python3 -m pytest src/unused/server
+'''
+
+import json
+import struct
+
+import numpy
+import pytest
+
+import JXG
+
+
+def typed(dtype, offset, shape):
+    return {'__jxgtyped__': dtype, 'offset': offset, 'shape': list(shape)}
+
+def decodeTyped(payload):
+    # Like server.js: 'JXGB', uint32 length of the JSON header, the header,
+    # padding to 8 bytes and the blocks
+    assert payload[:4] == JXG.TYPED_MAGIC
+    length = struct.unpack_from('<I', payload, 4)[0]
+    start = 8 + length + (-(length + 8) % 8)
+    blocks = payload[start:]
+
+    def hook(obj):
+        if '__jxgtyped__' not in obj:
+            return obj
+        dtype = numpy.dtype(JXG.TYPED_DTYPES[obj['__jxgtyped__']])
+        count = int(numpy.prod(obj['shape']))
+        assert obj['offset'] % 8 == 0
+        return numpy.frombuffer(blocks, dtype, count, obj['offset']).reshape(obj['shape'])
+    return json.loads(payload[8:8 + length].decode('utf-8'), object_hook=hook)
+
+
+############################
+#
+# Requests
+#
+############################
+
+def test_the_payload_is_decoded_once():
+    req = JXG.Request('exec', '1', json.dumps({'module': 'm', 'x': [1, 2]}))
+    values = req.getValues()
+    assert req.getValue('x') == [1, 2]
+    assert req.getValues() is values
+    assert req.getValue('action') == 'exec' and req.getValue('id') == '1'
+    with pytest.raises(KeyError):
+        req.getValue('y')
+
+def test_typed_fields_are_read_from_the_binary_block():
+    x = numpy.array([1.5, -2.0, 3.25])
+    s = numpy.array([[1, -2], [3, -4]], dtype='<i2')
+    binary = x.tobytes() + s.tobytes()
+    data = json.dumps({'x': typed('float64', 0, x.shape), 's': typed('int16', 24, s.shape), 'n': 3})
+    req = JXG.Request('exec', '1', data, binary)
+
+    assert numpy.array_equal(req.getValue('x'), x)
+    assert numpy.array_equal(req.getValue('s'), s)
+    assert req.getValue('n') == 3
+    # The arrays share the memory of the block
+    assert not req.getValue('x').flags.writeable
+
+def test_unknown_typed_fields_are_refused():
+    req = JXG.Request('exec', '1', json.dumps({'x': typed('complex128', 0, [1])}), b'\0' * 16)
+    with pytest.raises(ValueError, match='unknown typed array type'):
+        req.getValues()
+
+
+############################
+#
+# Responses
+#
+############################
+
+def test_typed_responses_round_trip():
+    resp = JXG.Response('7', typed=True)
+    data = {                                                            \
+             'f64': numpy.array([0.5, numpy.nan, -1e300]),              \
+             'f32': numpy.arange(5, dtype=numpy.float32),               \
+             'i32': numpy.array([[1, -2, 3], [4, 5, -6]], dtype=numpy.int32), \
+             'i16': numpy.array([-32768, 0, 32767], dtype=numpy.int16), \
+             'i64': numpy.array([2 ** 40, -1]),                         \
+             'odd': numpy.array([1, 2, 3], dtype=numpy.int16)[::2],     \
+             'scalar': numpy.float64(2.5),                              \
+             'list': [1, 'two'],                                        \
+           }
+    for name, value in data.items():
+        resp.addData(name, value)
+    resp.addField('JXG.Test', 'f', 'function() {}')
+
+    ret = decodeTyped(resp.dump())
+    assert ret['type'] == 'response' and ret['id'] == '7'
+    assert ret['fields'] == [{'namespace': 'JXG.Test', 'name': 'f', 'value': 'function() {}'}]
+    out = ret['data']
+    assert numpy.array_equal(out['f64'], data['f64'], equal_nan=True) and out['f64'].dtype == numpy.float64
+    assert numpy.array_equal(out['f32'], data['f32']) and out['f32'].dtype == numpy.float32
+    assert numpy.array_equal(out['i32'], data['i32']) and out['i32'].shape == (2, 3)
+    assert numpy.array_equal(out['i16'], data['i16']) and out['i16'].dtype == numpy.int16
+    # int64 isn't a typed array of javascript
+    assert numpy.array_equal(out['i64'], data['i64']) and out['i64'].dtype == numpy.float64
+    assert numpy.array_equal(out['odd'], [1, 3])
+    assert out['scalar'] == 2.5 and out['list'] == [1, 'two']
+
+def test_typed_responses_without_arrays_are_json():
+    resp = JXG.Response('7', typed=True)
+    resp.addData('x', [1, 2])
+    assert json.loads(resp.dump())['data'] == {'x': [1, 2]}
+
+def test_plain_responses_send_arrays_as_lists():
+    resp = JXG.Response('7')
+    resp.addData('x', numpy.array([1.0, numpy.nan, 2.0]))
+    resp.addData('n', numpy.array([[1, 2]], dtype=numpy.int16))
+    assert json.loads(resp.dump())['data'] == {'x': [1.0, 'null', 2.0], 'n': [[1, 2]]}
+
+def test_unsupported_arrays_are_refused():
+    resp = JXG.Response('7', typed=True)
+    resp.addData('c', numpy.array([1j]))
+    with pytest.raises(TypeError):
+        resp.dump()
+
+def test_errors_drop_the_data():
+    resp = JXG.Response('7', typed=True)
+    resp.addData('x', numpy.zeros(3))
+    resp.error('failed')
+    assert json.loads(resp.dump()) == {'type': 'error', 'id': '7', 'message': 'failed'}
@@ -0,0 +1,210 @@
+'''
+Tests of the locus computation: the canonical keys of eliminations and
+the handlers of geoloci.py run against cocoastub.py.
+
+    python3 -m pytest src/unused/server
+'''
+
+import os
+import re
+import time
+
+import numpy
+import pytest
+
+import JXG
+from JXGCoCoA import eliminationKey
+from JXGCache import LRUCache
+from JXGExecutor import Executor, executor
+from JXGMetrics import metrics
+from JXGPolynomial import parse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+CIRCLE = 'x - u[1], y - u[2], u[1]^2 + u[2]^2 - 1'
+
+
+############################
+#
+# Canonical keys
+#
+############################
+
+@pytest.mark.parametrize('other', [
+    'x-u[1],y-u[2],u[1]^2+u[2]^2-1',                    # whitespace
+    'u[2]^2 + u[1]^2 - 1, y - u[2], x - u[1]',          # order of generators and terms
+    '2*x - 2*u[1], -y + u[2], 3*u[1]^2 + 3*u[2]^2 - 3', # constant factors
+    'x - u[2], y - u[1], u[2]^2 + u[1]^2 - 1',          # renamed eliminated variables
+    '(x - u[1]), y - u[2], (u[1] + u[2])^2 - 2*u[1]*u[2] - 1',
+])
+def test_equivalent_systems_have_equal_keys(other):
+    assert eliminationKey(CIRCLE, 2, 'Xel') == eliminationKey(other, 2, 'Xel')
+
+@pytest.mark.parametrize('other, number, ordering, parameters', [
+    ('x - u[1], y - u[2], u[1]^2 + u[2]^2 - 4', 2, 'Xel', ()),
+    ('x - u[1], y + u[2], u[1]^2 + u[2]^2 - 1 + x', 2, 'Xel', ()),
+    ('x - u[1], y - u[2]^2, u[1]^2 + u[2]^2 - 1', 2, 'Xel', ()),
+    (CIRCLE, 1, 'Xel', ()),
+    (CIRCLE, 2, '', ()),
+    (CIRCLE, 2, 'Xel', ('t',)),
+])
+def test_different_systems_have_different_keys(other, number, ordering, parameters):
+    assert eliminationKey(CIRCLE, 2, 'Xel') != eliminationKey(other, number, ordering, parameters)
+
+def test_unparsable_systems_are_keyed_by_their_text():
+    assert eliminationKey('Foo(x), y', 0) == eliminationKey('Foo( x ),  y', 0)
+    assert eliminationKey('Foo(x), y', 0) != eliminationKey('Foo(y), x', 0)
+
+@pytest.mark.parametrize('polys, number', [
+    ('(x + y + u[1] + u[2] + u[3] + u[4])^64, x - u[1]', 4),
+    ('(x + u[1] + u[2] + u[3] + u[4] + u[5] + u[6])^7, x - y', 6),
+])
+def test_big_systems_are_keyed_quickly(polys, number):
+    start = time.perf_counter()
+    key = eliminationKey(polys, number, 'Xel')
+    assert time.perf_counter() - start < 1
+    assert key == eliminationKey(' ' + polys, number, 'Xel')
+
+
+############################
+#
+# lociCoCoA against the CoCoA stub
+#
+############################
+
+@pytest.fixture
+def geoloci(tmp_path, monkeypatch):
+    monkeypatch.setenv('JXG_COCOA', os.path.join(HERE, 'cocoastub.py'))
+    monkeypatch.setenv('JXG_ELIMINATION_CACHE', str(tmp_path))
+    monkeypatch.setattr(executor, 'inline', True)
+    import geoloci
+    module = geoloci.JXGGeoLociModule()
+    yield module
+    module.cocoa.close()
+
+# The stub answers with the generators free of u[i]
+LOCUS = 'x^2 + y^2 - 4, u[1] - x'
+
+def lociCoCoA(module, polys, bounds=(-3, 3, -3, 3), number=1, **size):
+    resp = JXG.Response('test')
+    module.lociCoCoA(resp, *bounds, number, polys, 1, 0, 0, 0, **size)
+    assert resp._type == 'response', resp._message
+    return resp._data
+
+def cacheHits():
+    m = re.search(r'^jxg_elimination_cache_total\{result="hit"\} (\S+)$', metrics.render(), re.M)
+    return float(m.group(1)) if m else 0
+
+def test_lociCoCoA_end_to_end(geoloci):
+    data = lociCoCoA(geoloci, LOCUS)
+    assert [parse(p) for p in data['polynomial']] == [parse('x^2 + y^2 - 4')]
+
+    # One closed curve, the NaN ends it
+    x, y = data['datax'], data['datay']
+    assert numpy.isnan(x[-1]) and numpy.count_nonzero(numpy.isnan(x)) == 1
+    assert x[0] == x[-2] and y[0] == y[-2]
+    assert numpy.allclose(numpy.hypot(x[:-1], y[:-1]), 2, atol=0.05)
+
+def test_lociCoCoA_skips_polynomials_not_in_x_and_y(geoloci):
+    data = lociCoCoA(geoloci, 'x^2 + y^2 - 4, x*z - 1, 3, u[1] - x')
+    assert [parse(p) for p in data['polynomial']] == [parse('x^2 + y^2 - 4')]
+
+def test_lociCoCoA_reuses_equivalent_eliminations(geoloci):
+    first = lociCoCoA(geoloci, LOCUS)
+    hits = cacheHits()
+    second = lociCoCoA(geoloci, '2*x - 2*u[1], y^2 + x^2 - 4')
+    assert cacheHits() == hits + 1
+    assert numpy.array_equal(first['datax'], second['datax'], equal_nan=True)
+
+def test_lociCoCoA_computes_the_tiles_in_the_pool(geoloci, monkeypatch):
+    import geoloci as plugin
+    expected = lociCoCoA(geoloci, LOCUS)
+
+    pool = Executor(2)
+    monkeypatch.setattr(plugin, 'executor', pool)
+    geoloci.tiles = LRUCache(geoloci.tile_cache_size)
+    # Several jobs finishing in any order
+    geoloci.tiles_per_job = 3
+    try:
+        data = lociCoCoA(geoloci, LOCUS)
+        assert pool.pool()._started == 2
+    finally:
+        pool.pool().shutdown()
+    assert numpy.array_equal(expected['datax'], data['datax'], equal_nan=True)
+    assert numpy.array_equal(expected['datay'], data['datay'], equal_nan=True)
+
+@pytest.mark.parametrize('bounds', [(3, -3, -3, 3), (3, -3, 3, -3), (-3, 3, 3, -3)])
+def test_lociCoCoA_accepts_reversed_bounds(geoloci, bounds):
+    expected = lociCoCoA(geoloci, LOCUS)
+    data = lociCoCoA(geoloci, LOCUS, bounds)
+    assert numpy.array_equal(expected['datax'], data['datax'], equal_nan=True)
+
+def test_lociCoCoA_caps_the_board_size(geoloci):
+    expected = lociCoCoA(geoloci, LOCUS, width=4096, height=4096)
+    start = time.perf_counter()
+    data = lociCoCoA(geoloci, LOCUS, width=50000, height=50000)
+    assert time.perf_counter() - start < 5
+    assert numpy.array_equal(expected['datax'], data['datax'], equal_nan=True)
+
+@pytest.mark.parametrize('width, height', [(0, 500), (500, -1), ('wide', 500), (None, 500), (float('nan'), 500)])
+def test_lociCoCoA_rejects_invalid_board_sizes(geoloci, width, height):
+    resp = JXG.Response('test')
+    geoloci.lociCoCoA(resp, -3, 3, -3, 3, 1, LOCUS, 1, 0, 0, 0, width, height)
+    assert resp._type == 'error'
+    assert 'board size' in resp._message
+
+
+############################
+#
+# lociSweep against the CoCoA stub
+#
+############################
+
+SWEEP = 'x^2 + y^2 - r^2, u[1] - x'
+
+def lociSweep(module, polys, parameter, values, streaming=False, **size):
+    resp = JXG.Response('test', streaming=streaming)
+    module.lociSweep(resp, -3, 3, -3, 3, 1, polys, parameter, values, 1, 0, 0, 0, **size)
+    return resp
+
+def test_lociSweep_computes_a_frame_per_value(geoloci):
+    resp = lociSweep(geoloci, SWEEP, 'r', [1, 2])
+    assert resp._type == 'response', resp._message
+    data = resp._data
+    assert data['values'] == [1.0, 2.0]
+    assert [parse(p) for p in data['polynomial']] == [parse('x^2 + y^2 - r^2')]
+
+    # The same curves as the loci of the substituted systems
+    for frame, r in zip(data['frames'], ('1', '2')):
+        expected = lociCoCoA(geoloci, SWEEP.replace('r', r))
+        assert frame['value'] == float(r)
+        assert numpy.array_equal(frame['datax'], expected['datax'], equal_nan=True)
+        assert numpy.array_equal(frame['datay'], expected['datay'], equal_nan=True)
+
+def test_lociSweep_accepts_ranges(geoloci):
+    resp = lociSweep(geoloci, SWEEP, 'r', {'start': 0.5, 'end': 1.5, 'step': 0.25})
+    assert resp._data['values'] == [0.5, 0.75, 1.0, 1.25, 1.5]
+    assert len(resp._data['frames']) == 5
+
+    resp = lociSweep(geoloci, SWEEP, 'r', {'start': 0, 'end': 1, 'step': 0.1})
+    assert resp._data['values'] == [round(i * 0.1, 12) for i in range(11)]
+
+def test_lociSweep_streams_the_frames(geoloci):
+    resp = lociSweep(geoloci, SWEEP, 'r', [1, 2, 3], streaming=True)
+    assert 'frames' not in resp._data
+    name, frames = resp._stream
+    assert name == 'frames'
+    assert [frame['value'] for frame in frames] == [1.0, 2.0, 3.0]
+
+@pytest.mark.parametrize('parameter', ['x', 'y', 'u', '2r', 'r; quit', 'R'])
+def test_lociSweep_rejects_invalid_parameters(geoloci, parameter):
+    resp = lociSweep(geoloci, SWEEP, parameter, [1])
+    assert resp._type == 'error' and "can't be used as parameter" in resp._message
+
+@pytest.mark.parametrize('values', [
+    ['one'], {'start': 0, 'end': 1}, {'start': 0, 'end': 1, 'step': 0}, {'start': 0, 'end': 1, 'step': -0.5},
+    {'start': 0, 'end': 1e9, 'step': 1}, list(range(501)),
+])
+def test_lociSweep_rejects_invalid_values(geoloci, values):
+    resp = lociSweep(geoloci, SWEEP, 'r', values)
+    assert resp._type == 'error' and 'invalid values' in resp._message
@@ -0,0 +1,80 @@
+'''
+Tests of the metrics of JXGMetrics.py and their Prometheus rendering.
+
+    python3 -m pytest src/unused/server
+'''
+
+import time
+
+import pytest
+
+from JXGMetrics import Metrics, HELP
+
+
+@pytest.fixture
+def metrics():
+    return Metrics()
+
+def samples(metrics):
+    # The samples of the rendered text by name with labels
+    return dict(line.rsplit(' ', 1) for line in metrics.render().splitlines() if line and not line.startswith('#'))
+
+
+def test_histograms_are_cumulative(metrics):
+    for value in (0.5, 1, 3, 100):
+        metrics.observe('jxg_test_seconds', value, (1, 2, 5), phase='a')
+    s = samples(metrics)
+    assert s['jxg_test_seconds_bucket{phase="a",le="1.0"}'] == '2'
+    assert s['jxg_test_seconds_bucket{phase="a",le="2.0"}'] == '2'
+    assert s['jxg_test_seconds_bucket{phase="a",le="5.0"}'] == '3'
+    assert s['jxg_test_seconds_bucket{phase="a",le="+Inf"}'] == '4'
+    assert s['jxg_test_seconds_sum{phase="a"}'] == '104.5'
+    assert s['jxg_test_seconds_count{phase="a"}'] == '4'
+
+def test_counters_are_kept_per_labels(metrics):
+    metrics.inc('jxg_test_total', module='a', handler='x')
+    metrics.inc('jxg_test_total', 2, handler='x', module='a')
+    metrics.inc('jxg_test_total', module='b', handler='x')
+    s = samples(metrics)
+    assert s['jxg_test_total{handler="x",module="a"}'] == '3'
+    assert s['jxg_test_total{handler="x",module="b"}'] == '1'
+
+def test_the_text_format(metrics):
+    metrics.inc('jxg_requests_total', action='exec')
+    metrics.inc('jxg_requests_total', action='load')
+    metrics.inc('jxg_test_total', plugin='a "quoted"\nname')
+    text = metrics.render()
+    assert text.count('# TYPE jxg_requests_total counter') == 1
+    assert '# HELP jxg_requests_total ' + HELP['jxg_requests_total'] in text
+    assert 'jxg_test_total{plugin="a \\"quoted\\"\\nname"} 1' in text
+    assert text.endswith('\n')
+
+def test_timers_observe_the_phase(metrics):
+    with metrics.timer('handler', module='m'):
+        time.sleep(0.05)
+    with pytest.raises(ValueError):
+        with metrics.timer('handler', module='m'):
+            raise ValueError
+    s = samples(metrics)
+    assert s['jxg_phase_seconds_count{module="m",phase="handler"}'] == '2'
+    assert float(s['jxg_phase_seconds_sum{module="m",phase="handler"}']) >= 0.05
+
+def test_gauges_are_computed_on_rendering(metrics):
+    value = [1]
+    metrics.addGauges(lambda: [('jxg_test_running', 'gauge', {'module': 'm'}, value[0])])
+    assert samples(metrics)['jxg_test_running{module="m"}'] == '1'
+    value[0] = 3
+    assert samples(metrics)['jxg_test_running{module="m"}'] == '3'
+
+def test_buffered_events_are_replayed(metrics):
+    worker = Metrics()
+    worker.buffered = True
+    worker.observe('jxg_test_seconds', 0.2, (1,), phase='a')
+    worker.inc('jxg_test_total', module='m')
+    assert samples(worker) == {}
+
+    metrics.replay(worker.drain())
+    assert worker.drain() == []
+    s = samples(metrics)
+    assert s['jxg_test_seconds_count{phase="a"}'] == '1'
+    assert s['jxg_test_total{module="m"}'] == '1'
@@ -0,0 +1,104 @@
+'''
+Tests of the polynomial parser and the evaluator of JXGPolynomial.py.
+
+    python3 -m pytest src/unused/server
+'''
+
+from fractions import Fraction
+
+import numpy
+import pytest
+
+from JXGPolynomial import PolynomialError, Evaluator, compile as compilePolynomial, parse, parseSystem, toString, monic, rename, substitute, variables
+
+
+X = (('x', 1),)
+Y = (('y', 1),)
+U1 = (('u[1]', 1),)
+
+
+@pytest.mark.parametrize('text, poly', [
+    ('x', {X: 1}),
+    ('2*x - 3/2', {X: 2, (): Fraction(-3, 2)}),
+    ('x**2 + x^2', {(('x', 2),): 2}),
+    ('(x + y)^2', {(('x', 2),): 1, (('x', 1), ('y', 1)): 2, (('y', 2),): 1}),
+    ('-(u[1])*(x) + 0.5', {(('u[1]', 1), ('x', 1)): -1, (): Fraction(1, 2)}),
+    ('1e-1*y', {Y: Fraction(1, 10)}),
+    ('x - x', {}),
+    ('(x^2 - 1)/2', {(('x', 2),): Fraction(1, 2), (): Fraction(-1, 2)}),
+])
+def test_polynomials_are_expanded(text, poly):
+    assert parse(text) == poly
+
+@pytest.mark.parametrize('text', [
+    '', 'x +', 'x^y', 'x^1.5', 'x^65', '1/x', 'x; y', 'u[x]', '(x', 'x, y', 'sin(x)',
+])
+def test_syntax_errors_are_reported(text):
+    with pytest.raises(PolynomialError):
+        parse(text)
+
+def test_systems():
+    assert parseSystem('x, y - 1') == [{X: 1}, {Y: 1, (): -1}]
+
+def test_too_big_expansions_are_refused():
+    with pytest.raises(PolynomialError, match='too big'):
+        parse('(x + y + u[1] + u[2] + u[3] + u[4])^20')
+    # The budget is shared by the polynomials of a system
+    parseSystem('(x + y + u[1])^10')
+    with pytest.raises(PolynomialError, match='too big'):
+        parseSystem(', '.join(['(x + y + u[1])^10'] * 40))
+
+def test_polynomials_round_trip():
+    p = parse('(u[1])*(x)-3/2*y^2+0.5')
+    assert toString(p) == '1/2 + 1*u[1]*x + -3/2*y^2'
+    assert parse(toString(p)) == p
+
+def test_helpers():
+    p = parse('3*u[1]*x - 6*y')
+    assert variables(p) == set(['u[1]', 'x', 'y'])
+    assert monic(p) == parse('-1/2*u[1]*x + y')
+    assert rename(p, {'u[1]': 'u[2]'}) == parse('3*u[2]*x - 6*y')
+
+def test_substitution():
+    p = parse('x^2 + y^2 - r^2 + r*x')
+    assert substitute(p, {'r': 2}) == parse('x^2 + y^2 - 4 + 2*x')
+    # Floats by their shortest decimal representation
+    assert substitute(p, {'r': 0.1}) == parse('x^2 + y^2 - 1/100 + 1/10*x')
+    # Terms cancelling out are dropped
+    assert substitute(parse('r*x - 2*x + y'), {'r': 2}) == parse('y')
+    assert substitute(p, {'z': 1}) == p
+
+
+############################
+#
+# Evaluator
+#
+############################
+
+@pytest.mark.parametrize('text, f', [
+    ('3*x^3*y - x*y^2 + 1/2*y^4 - 7', lambda x, y: 3 * x**3 * y - x * y**2 + 0.5 * y**4 - 7),
+    ('x**2 + y**2 - 1', lambda x, y: x**2 + y**2 - 1),
+    ('-2/3*y^5', lambda x, y: -2 / 3 * y**5 + 0 * x),
+    ('x^7 - x', lambda x, y: x**7 - x + 0 * y),
+    ('5', lambda x, y: 5 + 0 * x * y),
+])
+def test_evaluator_matches_the_polynomial(text, f):
+    x, y = numpy.meshgrid(numpy.linspace(-2, 2, 7), numpy.linspace(-1, 3, 5))
+    assert numpy.allclose(compilePolynomial(text)(x, y), f(x, y))
+
+def test_evaluator_broadcasts():
+    f = compilePolynomial('x*y + 1')
+    assert f(2, 3) == 7
+    assert f(numpy.arange(3), 2).tolist() == [1, 3, 5]
+    assert f(numpy.arange(3)[None, :], numpy.arange(2)[:, None]).shape == (2, 3)
+
+def test_evaluator_keeps_the_coefficients():
+    assert Evaluator(parse('2*x^2*y + 3')).coefficients.tolist() == [[3, 0], [0, 0], [0, 2]]
+
+def test_evaluator_needs_a_polynomial_in_x_and_y():
+    with pytest.raises(PolynomialError, match='not a polynomial in x and y'):
+        compilePolynomial('x*u[1] + y')
+    assert compilePolynomial('s*t', 's', 't')(2, 3) == 6
+
+def test_compiled_polynomials_are_cached():
+    assert compilePolynomial('x - y') is compilePolynomial('x - y')
@@ -0,0 +1,103 @@
+'''
+Tests of the plugin registry and the dispatch of exec calls.
+
+    python3 -m pytest src/unused/server
+'''
+
+import pytest
+
+import JXG
+from JXGRegistry import Registry, RegistryError
+from JXGServer import call_handler
+from JXGServerModule import JXGServerModule, handlerOptions
+
+
+# Loaded by the registries from this module
+class JXGRegistryTestModule(JXGServerModule):
+
+    instances = 0
+
+    def __init__(self):
+        JXGRegistryTestModule.instances += 1
+        JXGServerModule.__init__(self)
+
+    def add(self, resp, a, b=10):
+        resp.addData('sum', a + b)
+
+    @handlerOptions(cpubound=True, timeout=5, cacheable=True, ttl=60)
+    def options(self, x, resp):
+        resp.addData('x', x)
+
+    def fails(self, resp):
+        raise ValueError("on purpose")
+
+    def _helper(self, resp):
+        pass
+
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+
+def test_plugins_are_loaded_once(registry):
+    instances = JXGRegistryTestModule.instances
+    plugin = registry.plugin(__name__)
+    assert registry.plugin(__name__) is plugin
+    assert isinstance(plugin.instance, JXGRegistryTestModule)
+    assert JXGRegistryTestModule.instances == instances + 1
+    assert registry.plugins() == [plugin]
+
+def test_only_public_handlers_are_registered(registry):
+    assert sorted(registry.plugin(__name__).handlers) == ['add', 'fails', 'options']
+    with pytest.raises(RegistryError, match='undefined'):
+        registry.handler(__name__, '_helper')
+    with pytest.raises(RegistryError, match='undefined'):
+        registry.handler(__name__, 'init')
+
+@pytest.mark.parametrize('name', ['nonexistent_plugin', 'json'])
+def test_modules_without_plugin_are_refused(registry, name):
+    with pytest.raises(RegistryError):
+        registry.plugin(name)
+
+def test_handler_options(registry):
+    h = registry.handler(__name__, 'options')
+    assert (h.cpubound, h.timeout, h.cacheable, h.ttl) == (True, 5, True, 60)
+    h = registry.handler(__name__, 'add')
+    assert (h.cpubound, h.timeout, h.cacheable, h.ttl) == (False, None, False, None)
+
+def test_fields_are_bound_to_the_parameters(registry):
+    resp = JXG.Response('test')
+    h = registry.handler(__name__, 'add')
+    assert h.parameters == ['a', 'b']
+    assert h.bind(JXG.Request('exec', 'test', None, values={'a': 1}), resp) == [resp, 1, 10]
+    assert h.bind(JXG.Request('exec', 'test', None, values={'b': 2, 'a': 1, 'c': 3}), resp) == [resp, 1, 2]
+
+    # The response may be any parameter
+    h = registry.handler(__name__, 'options')
+    assert h.bind(JXG.Request('exec', 'test', None, values={'x': 5}), resp) == [5, resp]
+
+def test_missing_fields_are_reported(registry):
+    h = registry.handler(__name__, 'add')
+    with pytest.raises(RegistryError, match='missing parameter "a"'):
+        h.bind(JXG.Request('exec', 'test', None, values={'b': 2}), None)
+
+
+def call(handler, **values):
+    resp = JXG.Response('test')
+    call_handler(__name__, handler, JXG.Request('exec', 'test', None, values=values), resp)
+    return resp
+
+def test_exec_calls_the_handler():
+    resp = call('add', a=1, b=2)
+    assert resp._type == 'response' and resp._data == {'sum': 3}
+
+@pytest.mark.parametrize('handler, values, message', [
+    ('add', {}, 'missing parameter "a"'),
+    ('subtract', {'a': 1}, 'handler "subtract" is undefined'),
+    ('fails', {}, 'error in handler'),
+])
+def test_exec_reports_errors(handler, values, message):
+    resp = call(handler, **values)
+    assert resp._type == 'error'
+    assert message in resp._message
@@ -0,0 +1,225 @@
+'''
+Tests of the request handling of JXGServer.py, requests are passed to
+handle() as decoded forms.
+
+    python3 -m pytest src/unused/server
+'''
+
+import base64
+import json
+import re
+import threading
+import time
+import zlib
+
+import pytest
+
+import JXGServer
+from JXGMetrics import metrics
+from JXGRegistry import registry
+from JXGServerModule import JXGServerModule, handlerOptions
+
+
+# Loaded by the registry from this module
+class JXGServerTestModule(JXGServerModule):
+
+    maxConcurrency = 1
+    queueDepth = 4
+    queueTimeout = 5
+
+    def echo(self, resp, x, y=1):
+        resp.addData('x', x)
+        resp.addData('y', y)
+
+    def wait(self, resp, seconds):
+        time.sleep(seconds)
+        resp.addData('waited', seconds)
+
+    def frames(self, resp, count):
+        resp.addStream('frames', range(count))
+
+    calls = 0
+
+    @handlerOptions(cacheable=True)
+    def cached(self, resp, x):
+        JXGServerTestModule.calls += 1
+        resp.addData('x', x)
+        resp.addField('JXG.Test', 'calls', JXGServerTestModule.calls)
+
+
+def form(action='exec', id='1', accept='', **data):
+    return {                                                                    \
+             'action': action,                                                  \
+             'id': id,                                                          \
+             'accept': accept,                                                  \
+             'dataJSON': base64.b64encode(json.dumps(data).encode('utf-8')).decode('ascii') \
+           }
+
+def decode(body, headers):
+    if headers.get('X-JXG-Transfer') == 'base64':
+        body = base64.b64decode(body)
+    if headers.get('X-JXG-Encoding') == 'zlib':
+        body = zlib.decompress(body)
+    return json.loads(body)
+
+def request(**kwargs):
+    body, headers = JXGServer.handle(form(**kwargs))
+    return decode(body, headers)
+
+def observed(phase, **labels):
+    # Count and sum of the observations of phase
+    labels = ','.join('%s="%s"' % item for item in sorted(dict(labels, phase=phase).items()))
+    text = metrics.render()
+    count = re.search(r'^jxg_phase_seconds_count\{%s\} (\S+)$' % re.escape(labels), text, re.M)
+    total = re.search(r'^jxg_phase_seconds_sum\{%s\} (\S+)$' % re.escape(labels), text, re.M)
+    return (float(count.group(1)), float(total.group(1))) if count else (0, 0.0)
+
+
+############################
+#
+# Compression
+#
+############################
+
+@pytest.mark.parametrize('accept, encoding, transfer', [
+    ('', 'zlib', 'base64'),
+    ('identity', 'identity', 'base64'),
+    ('binary', 'zlib', 'binary'),
+    ('identity,binary', 'identity', 'binary'),
+])
+def test_the_encoding_is_negotiated(accept, encoding, transfer):
+    body, headers = JXGServer.handle(form(accept=accept, module=__name__, handler='echo', x=2))
+    assert headers['X-JXG-Encoding'] == encoding and headers['X-JXG-Transfer'] == transfer
+    assert decode(body, headers)['data'] == {'x': 2, 'y': 1}
+    if accept == 'identity,binary':
+        assert json.loads(body)['data'] == {'x': 2, 'y': 1}
+
+
+############################
+#
+# Result cache
+#
+############################
+
+def test_cacheable_handlers_are_computed_once():
+    calls = JXGServerTestModule.calls
+    x = [time.time(), 'cache']
+
+    body, headers = JXGServer.handle(form(id='first', module=__name__, handler='cached', x=x))
+    first = decode(body, headers)
+    assert headers['X-JXG-Cache'] == 'miss'
+    body, headers = JXGServer.handle(form(id='second', module=__name__, handler='cached', x=x))
+    second = decode(body, headers)
+    assert headers['X-JXG-Cache'] == 'hit'
+
+    assert JXGServerTestModule.calls == calls + 1
+    # The hit is encoded for the request
+    assert (first['id'], second['id']) == ('first', 'second')
+    assert first['data'] == second['data'] == {'x': x}
+    assert first['fields'] == second['fields']
+
+    body, headers = JXGServer.handle(form(id='third', module=__name__, handler='cached', x=x + [1]))
+    assert headers['X-JXG-Cache'] == 'miss'
+    assert JXGServerTestModule.calls == calls + 2
+
+def test_handlers_not_declared_cacheable_are_not_cached():
+    body, headers = JXGServer.handle(form(module=__name__, handler='echo', x=1))
+    assert 'X-JXG-Cache' not in headers
+
+
+############################
+#
+# Batch
+#
+############################
+
+def test_batch_runs_every_call():
+    ret = request(action='batch', calls=[
+        {'id': 'a', 'module': __name__, 'handler': 'echo', 'args': {'x': 1}},
+        {'module': __name__, 'handler': 'echo', 'args': {'x': 2, 'y': 3}},
+        {'id': 'c', 'module': __name__, 'handler': 'echo', 'args': {}},
+        {'id': 'd', 'module': __name__, 'handler': 'nothing'},
+        {'id': 'e', 'module': __name__},
+    ])
+    assert ret['type'] == 'response'
+    data = ret['data']
+    assert data['a'] == {'type': 'response', 'data': {'x': 1, 'y': 1}}
+    assert data['1'] == {'type': 'response', 'data': {'x': 2, 'y': 3}}
+    assert data['c']['type'] == 'error' and 'missing parameter "x"' in data['c']['message']
+    assert data['d']['type'] == 'error' and 'undefined' in data['d']['message']
+    assert data['e']['type'] == 'error' and 'needs a module, a handler' in data['e']['message']
+
+def test_parallel_batches_run_at_once(monkeypatch):
+    # The module admits one call at a time
+    monkeypatch.setattr(registry.plugin(__name__).limiter, 'concurrency', None)
+    calls = [{'id': str(i), 'module': __name__, 'handler': 'wait', 'args': {'seconds': 0.3}} for i in range(4)]
+    start = time.perf_counter()
+    ret = request(action='batch', calls=calls, parallel=True)
+    assert time.perf_counter() - start < 1
+    assert all(ret['data'][str(i)]['data'] == {'waited': 0.3} for i in range(4))
+
+@pytest.mark.parametrize('calls, message', [
+    (None, 'needs a list of calls'),
+    ({'id': 'a'}, 'needs a list of calls'),
+    ([{'module': __name__, 'handler': 'echo', 'args': {'x': 1}}] * (JXGServer.MAX_BATCH + 1), 'too many calls'),
+])
+def test_invalid_batches_are_refused(calls, message):
+    ret = request(action='batch', calls=calls)
+    assert ret['type'] == 'error' and message in ret['message']
+
+
+############################
+#
+# Metrics
+#
+############################
+
+def test_the_phases_of_a_request_are_timed():
+    labels = {'action': 'exec', 'module': __name__, 'handler': 'echo'}
+    before = dict((phase, observed(phase, **labels)[0]) for phase in ('lookup', 'bind', 'admission', 'handler', 'dump'))
+    assert request(module=__name__, handler='echo', x=2)['data'] == {'x': 2, 'y': 1}
+    for phase, count in before.items():
+        assert observed(phase, **labels)[0] == count + 1, phase
+
+def test_the_wait_for_admission_is_timed():
+    labels = {'action': 'exec', 'module': __name__, 'handler': 'echo'}
+    count, total = observed('admission', **labels)
+
+    # The only slot is taken for a while
+    limiter = registry.plugin(__name__).limiter
+    limiter.acquire()
+    threading.Timer(0.2, limiter.release).start()
+    assert request(module=__name__, handler='echo', x=2)['type'] == 'response'
+
+    assert observed('admission', **labels)[0] == count + 1
+    assert observed('admission', **labels)[1] - total >= 0.2
+
+
+############################
+#
+# Admission
+#
+############################
+
+def test_streamed_responses_keep_their_slot():
+    limiter = registry.plugin(__name__).limiter
+    body, headers = JXGServer.handle(form(accept='stream', module=__name__, handler='frames', count=3))
+    assert limiter.running == 1
+    list(body)
+    assert limiter.running == 0
+
+    # Also when the client went away
+    body, headers = JXGServer.handle(form(accept='stream', module=__name__, handler='frames', count=3))
+    next(body)
+    body.close()
+    assert limiter.running == 0
+
+def test_busy_modules_refuse_calls(monkeypatch):
+    limiter = registry.plugin(__name__).limiter
+    monkeypatch.setattr(limiter, 'depth', 0)
+    limiter.acquire()
+    try:
+        resp = request(module=__name__, handler='echo', x=2)
+    finally:
+        limiter.release()
+    assert resp['type'] == 'error' and resp['message'].startswith('busy, retry')
@@ -397,6 +397,8 @@ Mat.Symbolic = {
             rot,
             transx,
             transy,
+            board.canvasWidth,
+            board.canvasHeight,
             this.cb,
             true
         );